@@ -0,0 +1,254 @@
+"""通过服务商的批处理接口离线翻译工作队列中的词条
+
+首次翻译大型整合包时不要求延迟，用批处理接口（OpenAI的batch文件格式）代替逐个请求：
+领取队列中的词条并用较长的租约锁定，按LLMClient相同的方式分批，每个批次写成JSONL中的一行，
+上传文件并创建批处理任务，轮询到任务结束后下载结果，写入zhcn3和翻译缓存，失败的条目释放租约。
+
+每个任务的状态（任务ID，custom_id对应的词条和提交时附带的术语）保存在[LLM] batch_dir中，
+提交后可以退出程序，之后用 cli.py batch --collect 继续等待并取回结果。
+"""
+import asyncio
+import datetime
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import aiohttp
+
+from config import getConfig
+from llm_client import BatchItem, LLMClient
+from metrics import metrics
+
+# 批处理任务的最终状态，其余状态（validating、in_progress、finalizing、cancelling）需要继续等待
+FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+BATCH_ENDPOINT = '/v1/chat/completions'
+
+
+class BatchTranslator:
+    def __init__(self, llm: LLMClient):
+        self.llm = llm
+        self.db = llm.db
+        self.api_base = llm.api_base.rstrip('/')
+        self.headers = {'Authorization': f'Bearer {llm.api_key}'}
+        self.job_dir = Path(getConfig('LLM', 'batch_dir', 'staging/batch_jobs'))
+        # 租约需要长于任务的完成时限，否则任务完成前这些词条可能被普通翻译重新领取
+        self.lease_seconds = float(getConfig('LLM', 'batch_lease_seconds', '90000'))
+        self.poll_seconds = float(getConfig('LLM', 'batch_poll_seconds', '60'))
+        self.max_requests = int(getConfig('LLM', 'batch_max_requests', '50000'))
+        self.completion_window = getConfig('LLM', 'batch_completion_window', '24h')
+
+    def submit(self, status: int, use_cache: bool = True) -> List[str]:
+        """领取指定状态的全部词条，命中缓存的直接写入，其余提交为批处理任务，返回任务ID"""
+        return asyncio.run(self._submit(status, use_cache))
+
+    def collect(self, wait: bool = True) -> int:
+        """取回所有未取回的任务的结果，wait为False时只处理已结束的任务，返回写入的条目数"""
+        return asyncio.run(self._collect(wait))
+
+    def pending_jobs(self) -> List[dict]:
+        """已提交、结果尚未取回的任务"""
+        if not self.job_dir.exists():
+            return []
+        jobs = [json.loads(path.read_text(encoding='utf-8')) for path in sorted(self.job_dir.glob('*.json'))]
+        return [job for job in jobs if not job.get('collected')]
+
+    def _claim_all(self, status: int, use_cache: bool) -> List[List[BatchItem]]:
+        """分块领取全部词条，写入命中缓存的翻译，返回需要提交的批次"""
+        batches = []
+        after = None
+        cached_total = 0
+        while True:
+            items = self.db.claim_work(status, self.llm.queue_chunk_size, self.lease_seconds,
+                                       self.llm.max_attempts, after)
+            if not items:
+                break
+            after = items[-1][:2]
+            results = [None] * len(items)
+            need_translate = self.llm._split_cached(items, results, use_cache)
+            cached = [(r.modid, r.key, r.translation) for r in results if r is not None]
+            self.db.update_zhcn3_many(cached)
+            cached_total += len(cached)
+            metrics.count('llm.items_claimed', len(items))
+            metrics.count('llm.items_from_cache', len(cached))
+            batches.extend(self.llm._create_batches(need_translate))
+        if cached_total:
+            print(f"已从缓存写入 {cached_total} 个翻译")
+        return batches
+
+    async def _submit(self, status: int, use_cache: bool) -> List[str]:
+        self.llm._refresh_token_ratio()
+        await asyncio.to_thread(self.llm.refresh_glossary)
+        if use_cache:
+            self.llm.evict_cache()
+        batches = await asyncio.to_thread(self._claim_all, status, use_cache)
+        await asyncio.to_thread(self.llm.report_exhausted, status)
+        if not batches:
+            print("没有需要提交的词条")
+            return []
+
+        self.job_dir.mkdir(parents=True, exist_ok=True)
+        job_ids = []
+        async with aiohttp.ClientSession() as session:
+            for start in range(0, len(batches), self.max_requests):
+                chunk = batches[start:start + self.max_requests]
+                try:
+                    job_ids.append(await self._submit_job(session, chunk, use_cache))
+                except Exception:
+                    # 没有提交成功的词条释放租约，之后可以重新提交或用普通方式翻译
+                    for unsubmitted in batches[start:]:
+                        await asyncio.to_thread(self.db.release_work,
+                                                [(item.modid, item.key) for item in unsubmitted])
+                    raise
+        return job_ids
+
+    async def _submit_job(self, session: aiohttp.ClientSession, batches: List[List[BatchItem]],
+                          use_cache: bool) -> str:
+        """把批次写成JSONL并上传，创建批处理任务并保存任务状态，返回任务ID"""
+        name = datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        requests = {}
+        lines = []
+        for n, batch in enumerate(batches):
+            custom_id = f'{name}-{n}'
+            # 保存提交时的术语，取回结果时按相同的内容重建请求，术语表之后更新也不影响
+            glossary = self.llm._batch_glossary(batch)
+            data, _, _ = self.llm._build_request(batch, glossary)
+            lines.append(json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': BATCH_ENDPOINT,
+                                     'body': data}, ensure_ascii=False))
+            requests[custom_id] = {'items': [[item.modid, item.key, item.text] for item in batch],
+                                   'glossary': glossary}
+        input_path = self.job_dir / f'{name}.jsonl'
+        input_path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+        form = aiohttp.FormData()
+        form.add_field('purpose', 'batch')
+        form.add_field('file', input_path.read_bytes(), filename=input_path.name,
+                       content_type='application/jsonl')
+        async with session.post(f'{self.api_base}/v1/files', headers=self.headers, data=form) as response:
+            response.raise_for_status()
+            input_file = await response.json()
+        async with session.post(f'{self.api_base}/v1/batches', headers=self.headers, json={
+            'input_file_id': input_file['id'],
+            'endpoint': BATCH_ENDPOINT,
+            'completion_window': self.completion_window,
+        }) as response:
+            response.raise_for_status()
+            job = await response.json()
+
+        state = {'id': job['id'], 'input_file_id': input_file['id'], 'input_path': str(input_path),
+                 'model': self.llm.model, 'submitted_at': time.time(), 'use_cache': use_cache, 'collected': False,
+                 'requests': requests}
+        self._save_state(state)
+        item_count = sum(len(batch) for batch in batches)
+        metrics.count('llm.batch_jobs_submitted')
+        print(f"已提交批处理任务 {job['id']}：{len(batches)} 个请求，{item_count} 个条目")
+        return job['id']
+
+    def _save_state(self, state: dict):
+        path = self.job_dir / f"{state['id']}.json"
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(state, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp_path, path)
+
+    async def _collect(self, wait: bool) -> int:
+        jobs = await asyncio.to_thread(self.pending_jobs)
+        if not jobs:
+            print("没有等待取回的批处理任务")
+            return 0
+        translated = 0
+        async with aiohttp.ClientSession() as session:
+            for state in jobs:
+                job = await self._poll(session, state['id'], wait)
+                if job['status'] not in FINAL_STATUSES:
+                    print(f"批处理任务 {state['id']} 尚未结束（{job['status']}）")
+                    continue
+                translated += await self._ingest(session, state, job)
+        print(f"批处理结果取回完成，共写入 {translated} 个翻译")
+        return translated
+
+    async def _poll(self, session: aiohttp.ClientSession, job_id: str, wait: bool) -> dict:
+        """查询任务状态，wait为True时一直等到任务结束"""
+        last_status = None
+        while True:
+            async with session.get(f'{self.api_base}/v1/batches/{job_id}', headers=self.headers) as response:
+                response.raise_for_status()
+                job = await response.json()
+            if job['status'] in FINAL_STATUSES or not wait:
+                return job
+            counts = job.get('request_counts') or {}
+            if job['status'] != last_status:
+                print(f"批处理任务 {job_id}: {job['status']}，"
+                      f"已完成 {counts.get('completed', 0)}/{counts.get('total', 0)} 个请求")
+                last_status = job['status']
+            await asyncio.sleep(self.poll_seconds)
+
+    async def _download(self, session: aiohttp.ClientSession, file_id: str | None) -> List[dict]:
+        if not file_id:
+            return []
+        async with session.get(f'{self.api_base}/v1/files/{file_id}/content', headers=self.headers) as response:
+            response.raise_for_status()
+            content = await response.text(encoding='utf-8')
+        return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+    async def _ingest(self, session: aiohttp.ClientSession, state: dict, job: dict) -> int:
+        """解析任务的输出，写入zhcn3和缓存，记录用量，释放没有结果的条目"""
+        # 任务失败或过期时也可能有部分结果，错误文件中的请求和缺失的请求一样按失败处理，不需要下载
+        outputs = await self._download(session, job.get('output_file_id'))
+        # 整个任务从提交到完成的时间，不是单个请求的延迟，单独记录
+        turnaround = max(0.0, (job.get('completed_at') or time.time()) - state['submitted_at'])
+        metrics.record_time('llm.batch_turnaround', turnaround)
+
+        requests: Dict[str, List[BatchItem]] = {}
+        glossaries: Dict[str, Dict[str, str] | None] = {}
+        for custom_id, request in state['requests'].items():
+            # 旧格式的任务状态只保存了词条列表，没有提交时的术语，按当前术语表重建
+            if isinstance(request, list):
+                request = {'items': request, 'glossary': None}
+            requests[custom_id] = [BatchItem(modid, key, text, i)
+                                   for i, (modid, key, text) in enumerate(request['items'])]
+            glossaries[custom_id] = request['glossary']
+        finished_ids = set()
+        finished = []
+        cache_rows = []
+        for output in outputs:
+            batch = requests.get(output.get('custom_id'))
+            response = output.get('response') or {}
+            if batch is None or response.get('status_code') != 200:
+                continue
+            result = response['body']
+            data, grouped_items, position_map = self.llm._build_request(
+                batch, glossaries[output['custom_id']])
+            await self.llm._record_usage(result.get('usage') or {}, data['messages'], grouped_items,
+                                         0.0, result.get('model') or state['model'], turnaround)
+            log_file = self.llm.log_dir / f"llm_batch_{state['id']}_{output['custom_id']}.log"
+            try:
+                translations = self.llm._parse_translations(result, grouped_items, position_map,
+                                                            len(batch), log_file)
+            except (KeyError, IndexError, TypeError) as e:
+                metrics.count('llm.invalid_responses')
+                print(f"解析批处理结果 {output['custom_id']} 失败: {e}")
+                continue
+            if not (translations and all(isinstance(t, str) for t in translations)):
+                metrics.count('llm.batches_failed')
+                continue
+            metrics.count('llm.batches_succeeded')
+            finished_ids.add(output['custom_id'])
+            for item, translation in zip(batch, translations):
+                finished.append((item.modid, item.key, translation))
+                cache_rows.append((item.modid, item.key, item.text, translation))
+
+        failed = [(item.modid, item.key) for custom_id, batch in requests.items()
+                  if custom_id not in finished_ids for item in batch]
+        await asyncio.to_thread(self.db.update_zhcn3_many, finished)
+        if state.get('use_cache', True):
+            await asyncio.to_thread(self.db.cache_translations, cache_rows)
+        await asyncio.to_thread(self.db.release_work, failed)
+        metrics.count('llm.items_released', len(failed))
+
+        state.update(collected=True, status=job['status'], translated=len(finished), failed=len(failed),
+                     turnaround=turnaround)
+        await asyncio.to_thread(self._save_state, state)
+        print(f"批处理任务 {state['id']}（{job['status']}）：写入 {len(finished)} 个翻译，"
+              f"{len(failed)} 个条目失败，已释放租约")
+        return len(finished)
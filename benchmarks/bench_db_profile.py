@@ -0,0 +1,74 @@
+"""对比SQLite默认参数与config.ini中[DATABASE]性能参数下的耗时
+
+测量入库、导出资源包和缓存查询三项，用法：
+    python benchmarks/bench_db_profile.py [词条数]
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import Database, load_pragma_profile
+from file_processor import FileProcessor
+
+
+def run_profile(pragmas: dict[str, str], rows: int, work_dir: str) -> dict[str, float]:
+    """在指定PRAGMA参数下运行一次，返回各阶段耗时（秒）"""
+    db = Database(os.path.join(work_dir, 'bench.db'), pragmas, shared_store_path='')
+    timings = {}
+
+    try:
+        # 入库：英文词条逐条写入，三分之一带有中文
+        start = time.perf_counter()
+        for i in range(rows):
+            modid = f'mod{i % 50}'
+            key = f'item.{modid}.entry{i}'
+            db.insert_translation(modid, key, f'Sample text number {i}')
+            if i % 3 == 0:
+                db.update_zhcn1(modid, key, f'示例文本{i}')
+        timings['ingest'] = time.perf_counter() - start
+
+        # 导出资源包
+        start = time.perf_counter()
+        processor = FileProcessor(work_dir, db)
+        processor.generate_language_pack(os.path.join(work_dir, 'dist', 'pack.zip'))
+        timings['export'] = time.perf_counter() - start
+
+        # 缓存查询：写入一半，再全部查询一遍（命中率50%）
+        for i in range(0, rows, 2):
+            db.cache_translation(f'mod{i % 50}', f'entry{i}', f'Sample text number {i}', f'示例文本{i}')
+        start = time.perf_counter()
+        for i in range(rows):
+            db.get_cached_translation(f'mod{i % 50}', f'Sample text number {i}')
+        timings['cache_probe'] = time.perf_counter() - start
+    finally:
+        db.close()
+
+    return timings
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    profiles = {
+        'default': {},
+        'tuned': load_pragma_profile(),
+    }
+
+    results = {}
+    for name, pragmas in profiles.items():
+        with tempfile.TemporaryDirectory() as work_dir:
+            results[name] = run_profile(pragmas, rows, work_dir)
+
+    print(f"词条数: {rows}")
+    print(f"{'阶段':<12}{'default':>12}{'tuned':>12}{'加速比':>10}")
+    for stage in results['default']:
+        before = results['default'][stage]
+        after = results['tuned'][stage]
+        print(f"{stage:<12}{before:>11.3f}s{after:>11.3f}s{before / after:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""用本地模拟接口压测LLMClient的工作队列翻译
+
+用法：
+    python benchmarks/bench_llm.py [--items 5000] [--latency 0.3] [--error-rate-5xx 0.05] ...
+
+模拟接口的参数与 mock_llm_server.py 相同，结果以JSON打印，包括吞吐量和接口统计。
+"""
+import argparse
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import time
+from dataclasses import fields
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import config
+from database import Database, STATUS_UNTRANSLATED
+from llm_client import LLMClient
+
+from mock_llm_server import MockLLMServer, MockOptions
+from run_benchmarks import ensure_llm_config
+import synthetic
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用本地模拟接口压测LLMClient")
+    parser.add_argument('--items', type=int, default=5000, help="待翻译词条数")
+    parser.add_argument('--mods', type=int, default=50, help="词条分布的mod数")
+    parser.add_argument('--parallel-requests', type=int, help="覆盖[LLM]中的parallel_requests")
+    parser.add_argument('--endpoints', type=int, default=1, help="启动的模拟接口数，配置为多个接口")
+    parser.add_argument('--client-rpm', type=int, help="覆盖[LLM]中的rpm（客户端每分钟请求数限制）")
+    parser.add_argument('--client-tpm', type=int, help="覆盖[LLM]中的tpm（客户端每分钟token数限制）")
+    parser.add_argument('--verbose', action='store_true', help="显示LLMClient的输出")
+    for field in fields(MockOptions):
+        if field.name not in ('host', 'port'):
+            parser.add_argument(f"--{field.name.replace('_', '-')}", type=type(field.default),
+                                default=field.default)
+    args = parser.parse_args()
+
+    options = MockOptions(**{field.name: getattr(args, field.name)
+                             for field in fields(MockOptions)
+                             if field.name not in ('host', 'port')})
+    servers = [MockLLMServer(options) for _ in range(args.endpoints)]
+    base_urls = [server.start_in_thread() for server in servers]
+
+    ensure_llm_config()
+    config.setConfig('LLM', 'api_base', base_urls[0])
+    config.setConfig('LLM', 'api_key', 'mock')
+    # 第一个模拟接口使用[LLM]本身，其余的配置为[LLM.mockN]
+    names = ['default']
+    for i, base_url in enumerate(base_urls[1:], start=2):
+        section = f'LLM.mock{i}'
+        if not config.configParser.has_section(section):
+            config.configParser.add_section(section)
+        config.setConfig(section, 'api_base', base_url)
+        names.append(f'mock{i}')
+    config.setConfig('LLM', 'endpoints', ','.join(names))
+    if args.parallel_requests:
+        config.setConfig('LLM', 'parallel_requests', str(args.parallel_requests))
+    if args.client_rpm is not None:
+        config.setConfig('LLM', 'rpm', str(args.client_rpm))
+    if args.client_tpm is not None:
+        config.setConfig('LLM', 'tpm', str(args.client_tpm))
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(str(Path(tmp) / 'bench.db'), shared_store_path='')
+            mods = synthetic.generate_mods(Path(tmp) / 'mods', args.mods,
+                                           max(1, args.items // args.mods), 0, classes=0)
+            for modid, entries in mods.items():
+                db.insert_translations(modid, entries.items())
+
+            llm = LLMClient(db)
+            output = None if args.verbose else io.StringIO()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+                translated = llm.translate_queue(STATUS_UNTRANSLATED, use_cache=False)
+            elapsed = time.perf_counter() - start
+            remaining = len(db.get_untranslated())
+            db.close()
+    finally:
+        for server in servers:
+            server.stop()
+
+    print(json.dumps({
+        'items': args.items,
+        'translated': translated,
+        'remaining': remaining,
+        'seconds': round(elapsed, 3),
+        'items_per_second': round(translated / elapsed, 1) if elapsed else None,
+        'servers': [{**server.stats, 'peak_concurrency': server.peak_concurrency} for server in servers],
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+"""本地模拟的OpenAI兼容接口，用于离线测试和压测LLMClient与任务书翻译
+
+返回确定性的"翻译"（在原文前加上前缀），可配置延迟、并发和速率上限，
+并按比例注入429/5xx错误、条目数量不一致和被截断的JSON响应。
+按消息前缀模拟服务商的上下文缓存，在用量中返回命中缓存的token数。
+还模拟了批处理接口（/v1/files 和 /v1/batches）：上传的JSONL在batch_delay秒后按同样的规则处理完成。
+
+独立运行：
+    python benchmarks/mock_llm_server.py --port 8000 --latency 0.5 --error-rate-429 0.05
+然后把config.ini中[LLM]的api_base设为 http://127.0.0.1:8000
+
+在代码中使用：
+    server = MockLLMServer(MockOptions(latency=0.1))
+    base_url = server.start_in_thread()
+    ...
+    server.stop()
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, fields
+
+from aiohttp import web
+
+TRANSLATION_PREFIX = "译："
+QUEST_SEPARATOR = "#EOL#"
+
+
+@dataclass
+class MockOptions:
+    host: str = '127.0.0.1'
+    port: int = 0                   # 0表示自动选择端口
+    latency: float = 0.2            # 每个请求的基础延迟（秒）
+    jitter: float = 0.0             # 延迟的随机波动（秒）
+    token_latency: float = 0.0      # 每个输出token额外的延迟（秒）
+    max_concurrency: int = 0        # 同时处理的请求上限，超过返回429，0为不限
+    rpm: int = 0                    # 每分钟请求数上限，超过返回429，0为不限
+    tpm: int = 0                    # 每分钟token数上限，超过返回429，0为不限
+    error_rate_429: float = 0.0     # 随机返回429的比例
+    error_rate_5xx: float = 0.0     # 随机返回500/502/503的比例
+    mismatch_rate: float = 0.0      # 随机少返回一个条目的比例
+    truncate_rate: float = 0.0      # 随机返回被截断JSON的比例
+    retry_after: float = 1.0        # 429响应中的Retry-After（秒）
+    batch_delay: float = 1.0        # 批处理任务从提交到完成的时间（秒）
+    seed: int = 0
+
+
+def translate_text(text: str) -> str:
+    """确定性的模拟翻译"""
+    return TRANSLATION_PREFIX + text
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 2)
+
+
+class MockLLMServer:
+    def __init__(self, options: MockOptions):
+        self.options = options
+        self.rng = random.Random(options.seed)
+        self.stats = Counter()
+        self.active = 0
+        self.peak_concurrency = 0
+        # 最近一分钟的(时间, token数)，用于速率限制
+        self._window = deque()
+        # 已见过的消息前缀的摘要，用于模拟前缀缓存
+        self._prefix_cache: set[bytes] = set()
+        # 批处理接口上传和生成的文件、批处理任务
+        self.files: dict[str, dict] = {}
+        self.batches: dict[str, dict] = {}
+        self._batch_tasks = set()
+        self._runner: web.AppRunner | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self.base_url = ''
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post('/v1/chat/completions', self.handle_chat)
+        app.router.add_post('/chat/completions', self.handle_chat)
+        app.router.add_post('/v1/files', self.handle_file_upload)
+        app.router.add_get('/v1/files/{file_id}/content', self.handle_file_content)
+        app.router.add_post('/v1/batches', self.handle_batch_create)
+        app.router.add_get('/v1/batches/{batch_id}', self.handle_batch_get)
+        app.router.add_get('/stats', self.handle_stats)
+        return app
+
+    def _rate_limited(self, tokens: int) -> bool:
+        """检查并记录速率窗口，超过rpm或tpm时返回True"""
+        now = time.monotonic()
+        while self._window and now - self._window[0][0] > 60:
+            self._window.popleft()
+        if self.options.rpm and len(self._window) >= self.options.rpm:
+            return True
+        if self.options.tpm and sum(t for _, t in self._window) + tokens > self.options.tpm:
+            return True
+        self._window.append((now, tokens))
+        return False
+
+    def _error(self, status: int, message: str) -> web.Response:
+        self.stats[f'status_{status}'] += 1
+        headers = {'Retry-After': str(self.options.retry_after)} if status == 429 else None
+        return web.json_response({'error': {'message': message, 'type': 'mock_error', 'code': status}},
+                                 status=status, headers=headers)
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({**self.stats, 'peak_concurrency': self.peak_concurrency})
+
+    async def handle_chat(self, request: web.Request) -> web.Response:
+        self.stats['requests'] += 1
+        body = await request.json()
+        messages = body.get('messages', [])
+        prompt = ''.join(str(m.get('content', '')) for m in messages)
+        prompt_tokens = estimate_tokens(prompt)
+        opts = self.options
+
+        if opts.max_concurrency and self.active >= opts.max_concurrency:
+            return self._error(429, "Too many concurrent requests")
+        if self._rate_limited(prompt_tokens):
+            return self._error(429, "Rate limit reached")
+        if self.rng.random() < opts.error_rate_429:
+            return self._error(429, "Injected rate limit")
+
+        self.active += 1
+        self.peak_concurrency = max(self.peak_concurrency, self.active)
+        try:
+            content = self._translate_content(messages[-1].get('content', '') if messages else '')
+            completion_tokens = estimate_tokens(content)
+            cached_tokens = self._prefix_cache_hit(messages)
+            delay = opts.latency + self.rng.uniform(0, opts.jitter) + opts.token_latency * completion_tokens
+            await asyncio.sleep(delay)
+
+            if self.rng.random() < opts.error_rate_5xx:
+                return self._error(self.rng.choice((500, 502, 503)), "Injected server error")
+            if self.rng.random() < opts.truncate_rate:
+                self.stats['truncated'] += 1
+                content = content[:max(1, len(content) // 2)]
+        finally:
+            self.active -= 1
+
+        return web.json_response(self._completion(body, content, prompt_tokens, completion_tokens, cached_tokens))
+
+    def _prefix_cache_hit(self, messages: list) -> int:
+        """与之前的请求相同的最长消息前缀（不含最后一条）算作命中缓存，返回命中的token数"""
+        digest = hashlib.blake2b(digest_size=16)
+        cached_tokens = 0
+        prefix_tokens = 0
+        for message in messages[:-1]:
+            digest.update(json.dumps(message, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+            prefix_tokens += estimate_tokens(str(message.get('content', '')))
+            key = digest.digest()
+            if key in self._prefix_cache:
+                cached_tokens = prefix_tokens
+            else:
+                self._prefix_cache.add(key)
+        return cached_tokens
+
+    def _completion(self, body: dict, content: str, prompt_tokens: int, completion_tokens: int,
+                    cached_tokens: int = 0) -> dict:
+        """记录统计并生成chat.completion响应体，用量同时包含DeepSeek和OpenAI的缓存字段"""
+        self.stats['completed'] += 1
+        self.stats['prompt_tokens'] += prompt_tokens
+        self.stats['completion_tokens'] += completion_tokens
+        self.stats['cached_tokens'] += cached_tokens
+        return {
+            'id': f"mock-{self.stats['completed']}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'mock'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+                'prompt_cache_hit_tokens': cached_tokens,
+                'prompt_cache_miss_tokens': prompt_tokens - cached_tokens,
+                'prompt_tokens_details': {'cached_tokens': cached_tokens},
+            },
+        }
+
+    def _add_file(self, content: bytes, purpose: str, filename: str) -> dict:
+        file_id = f"file-mock-{len(self.files) + 1}"
+        self.files[file_id] = {'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                               'filename': filename, 'purpose': purpose, 'content': content}
+        return {k: v for k, v in self.files[file_id].items() if k != 'content'}
+
+    async def handle_file_upload(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        upload = form.get('file')
+        if upload is None or not hasattr(upload, 'file'):
+            return self._error(400, "Missing file")
+        self.stats['files_uploaded'] += 1
+        return web.json_response(self._add_file(upload.file.read(), str(form.get('purpose', '')), upload.filename))
+
+    async def handle_file_content(self, request: web.Request) -> web.Response:
+        file = self.files.get(request.match_info['file_id'])
+        if file is None:
+            return self._error(404, "No such file")
+        return web.Response(body=file['content'], content_type='application/octet-stream')
+
+    async def handle_batch_create(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if body.get('input_file_id') not in self.files:
+            return self._error(400, "Invalid input_file_id")
+        batch_id = f"batch_mock_{len(self.batches) + 1}"
+        batch = {
+            'id': batch_id, 'object': 'batch', 'endpoint': body.get('endpoint'),
+            'input_file_id': body['input_file_id'], 'completion_window': body.get('completion_window'),
+            'status': 'validating', 'output_file_id': None, 'error_file_id': None,
+            'created_at': int(time.time()), 'completed_at': None,
+            'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+            'metadata': body.get('metadata'),
+        }
+        self.batches[batch_id] = batch
+        self.stats['batches'] += 1
+        task = asyncio.create_task(self._run_batch(batch))
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+        return web.json_response(batch)
+
+    async def handle_batch_get(self, request: web.Request) -> web.Response:
+        batch = self.batches.get(request.match_info['batch_id'])
+        if batch is None:
+            return self._error(404, "No such batch")
+        return web.json_response(batch)
+
+    async def _run_batch(self, batch: dict):
+        """等待batch_delay秒后逐行处理，成功的写入输出文件，注入的5xx错误写入错误文件"""
+        batch['status'] = 'in_progress'
+        lines = [json.loads(line) for line in self.files[batch['input_file_id']]['content'].decode('utf-8').splitlines()
+                 if line.strip()]
+        batch['request_counts']['total'] = len(lines)
+        await asyncio.sleep(self.options.batch_delay)
+
+        outputs, errors = [], []
+        for n, line in enumerate(lines, 1):
+            body = line.get('body', {})
+            messages = body.get('messages', [])
+            record = {'id': f"batch_req_{n}", 'custom_id': line.get('custom_id'), 'error': None}
+            self.stats['batch_requests'] += 1
+            if self.rng.random() < self.options.error_rate_5xx:
+                self.stats['status_500'] += 1
+                record['response'] = {'status_code': 500, 'request_id': f"req_{n}",
+                                      'body': {'error': {'message': "Injected server error", 'type': 'mock_error'}}}
+                errors.append(record)
+                continue
+            content = self._translate_content(messages[-1].get('content', '') if messages else '')
+            prompt_tokens = estimate_tokens(''.join(str(m.get('content', '')) for m in messages))
+            completion_tokens = estimate_tokens(content)
+            cached_tokens = self._prefix_cache_hit(messages)
+            if self.rng.random() < self.options.truncate_rate:
+                self.stats['truncated'] += 1
+                content = content[:max(1, len(content) // 2)]
+            record['response'] = {'status_code': 200, 'request_id': f"req_{n}",
+                                  'body': self._completion(body, content, prompt_tokens, completion_tokens,
+                                                           cached_tokens)}
+            outputs.append(record)
+
+        def jsonl(records):
+            return ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records).encode('utf-8')
+
+        if outputs:
+            batch['output_file_id'] = self._add_file(jsonl(outputs), 'batch_output', 'output.jsonl')['id']
+        if errors:
+            batch['error_file_id'] = self._add_file(jsonl(errors), 'batch_output', 'errors.jsonl')['id']
+        batch['request_counts'].update(completed=len(outputs), failed=len(errors))
+        batch['status'] = 'completed'
+        batch['completed_at'] = int(time.time())
+
+    def _translate_content(self, content: str) -> str:
+        """按请求格式生成翻译：模组的JSON批次、任务书的#EOL#分隔文本或普通文本"""
+        try:
+            request_json = json.loads(content)
+        except (json.JSONDecodeError, TypeError):
+            request_json = None
+
+        if isinstance(request_json, dict) and isinstance(request_json.get('items'), list):
+            groups = [{'m': group.get('m'), 'texts': [translate_text(t) for t in group.get('texts', [])]}
+                      for group in request_json['items']]
+            if groups and self.rng.random() < self.options.mismatch_rate:
+                self.stats['mismatched'] += 1
+                group = self.rng.choice(groups)
+                if group['texts']:
+                    group['texts'].pop()
+            return json.dumps({'items': groups}, ensure_ascii=False)
+
+        segments = [translate_text(s) for s in content.split(QUEST_SEPARATOR)]
+        if len(segments) > 1 and self.rng.random() < self.options.mismatch_rate:
+            self.stats['mismatched'] += 1
+            segments.pop()
+        return QUEST_SEPARATOR.join(segments)
+
+    async def start(self) -> str:
+        """在当前事件循环中启动，返回服务地址"""
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.options.host, self.options.port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://{self.options.host}:{port}"
+        return self.base_url
+
+    async def close(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def start_in_thread(self) -> str:
+        """在后台线程中启动，供同步代码使用，返回服务地址"""
+        started = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.close())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=serve, name='mock-llm-server', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.base_url
+
+    def stop(self):
+        """停止后台线程中的服务"""
+        if self._loop and self._thread:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的OpenAI兼容翻译接口")
+    for field in fields(MockOptions):
+        parser.add_argument(f"--{field.name.replace('_', '-')}", type=type(field.default),
+                            default=field.default)
+    args = parser.parse_args()
+    options = MockOptions(**vars(args))
+    if not options.port:
+        options.port = 8000
+
+    server = MockLLMServer(options)
+    print(f"模拟接口运行在 http://{options.host}:{options.port} ，统计信息见 /stats")
+    web.run_app(server.make_app(), host=options.host, port=options.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
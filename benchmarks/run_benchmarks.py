@@ -0,0 +1,210 @@
+"""基准测试：在合成整合包上测量各处理阶段的耗时
+
+用法：
+    python benchmarks/run_benchmarks.py [--jars 200] [--keys 300] [--output 结果.json]
+    python benchmarks/run_benchmarks.py --compare 旧结果.json
+
+结果以JSON保存（默认 benchmarks/results/ 下），可用 --compare 与之前的结果对比。
+"""
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import config
+from database import Database, STATUS_UNTRANSLATED, STATUS_LOW_CONFIDENCE
+from file_processor import FileProcessor
+from llm_client import BatchItem, LLMClient
+
+import synthetic
+
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+
+class Timings:
+    """记录各阶段耗时"""
+
+    def __init__(self):
+        self.stages: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        print(f"→ {name} ...", end='', flush=True)
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        self.stages[name] = elapsed
+        print(f" {elapsed:.3f}s")
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True, cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ensure_llm_config():
+    """没有config.ini时使用config.sample中的LLM默认配置"""
+    if not config.configParser.has_section('LLM'):
+        config.configParser.read('config.sample')
+
+
+def bench_writeback(work_dir: Path, modpack_dir: Path, timings: Timings, counts: dict):
+    """测量任务书写回，需要ftb_snbt_lib"""
+    try:
+        import main
+    except ImportError as e:
+        print(f"跳过任务书写回: {e}")
+        return
+
+    lang_source = 'config/ftbquests/quests/lang/en_us.snbt'
+    if not config.configParser.has_section('QUEST'):
+        config.configParser.add_section('QUEST')
+    config.setConfig('QUEST', 'ftb_lang_source_path', lang_source)
+    config.setConfig('QUEST', 'ftb_lang_target_path', 'config/ftbquests/quests/lang/zh_cn.snbt')
+    config.setConfig('QUEST', 'translate_work_path', str(work_dir / 'quest_translate_work.json'))
+    config.setConfig('QUEST', 'translate_fine_path', str(work_dir / 'quest_translate_fine.json'))
+    config.setConfig('QUEST', 'source_hash_path', str(work_dir / 'quest_source_hash.json'))
+    config.setConfig('QUEST', 'writeback_state_path', str(work_dir / 'quest_writeback_state.json'))
+    config.setConfig('QUEST', 'staging_backend', 'json')
+
+    # 一半条目作为待翻译（已有AI译文），一半作为已确认的精细翻译
+    with open(modpack_dir / lang_source, 'r', encoding='utf-8') as f:
+        lang_map = main.extractLangMapFromLangTree(main.slib.load(f))
+    work, fine = {}, {}
+    for i, (key, value) in enumerate(lang_map.items()):
+        if i % 2:
+            work[key] = {'origin': value, 'ref': '', 'target': f"译文：{value}"}
+        else:
+            fine[key] = f"译文：{value}"
+    with open(work_dir / 'quest_translate_work.json', 'w', encoding='utf-8') as f:
+        json.dump(work, f, ensure_ascii=False, indent=4)
+    with open(work_dir / 'quest_translate_fine.json', 'w', encoding='utf-8') as f:
+        json.dump(fine, f, ensure_ascii=False, indent=4)
+    counts['quest_entries'] = len(lang_map)
+
+    with timings.stage('snbt_writeback'):
+        main.writeBackLang(str(modpack_dir))
+    # 译文没有变化时再次写回，应跳过解析和写入
+    with timings.stage('snbt_writeback_repeat'):
+        main.writeBackLang(str(modpack_dir))
+
+
+def run(args) -> dict:
+    timings = Timings()
+    counts = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = Path(tmp)
+        modpack_dir = work_dir / 'modpack'
+        mods_dir = modpack_dir / 'mods'
+
+        print("生成合成数据...")
+        mods = synthetic.generate_mods(mods_dir, args.jars, args.keys, args.zh_coverage,
+                                       args.classes, args.seed)
+        synthetic.generate_resource_pack(work_dir / 'resourcepack.zip', mods, args.pack_coverage, args.seed)
+        synthetic.generate_reference(work_dir / 'reference.json', mods, args.reference_coverage, args.seed)
+        counts['quest_strings'] = synthetic.generate_quest_book(
+            modpack_dir / 'config/ftbquests/quests/lang/en_us.snbt', args.chapters, args.quests, args.seed)
+        counts['jars'] = args.jars
+        counts['mod_keys'] = args.jars * args.keys
+
+        db = Database(str(work_dir / 'bench.db'), {} if args.default_pragmas else None,
+                      shared_store_path='')
+        processor = FileProcessor(str(mods_dir), db)
+        try:
+            with timings.stage('ingest'):
+                processor.process_mods()
+            with timings.stage('resource_pack'):
+                processor.process_resource_pack(work_dir / 'resourcepack.zip')
+            with timings.stage('reference_apply'):
+                processor.process_reference_dat(work_dir / 'reference.json')
+
+            with timings.stage('work_set_fetch'):
+                untranslated = list(db.iter_by_status(STATUS_UNTRANSLATED))
+                low_confidence = list(db.iter_by_status(STATUS_LOW_CONFIDENCE))
+            counts['untranslated'] = len(untranslated)
+            counts['low_confidence'] = len(low_confidence)
+
+            ensure_llm_config()
+            llm = LLMClient(db)
+            items = [BatchItem(modid, key, text, i) for i, (modid, key, text) in enumerate(untranslated)]
+            with timings.stage('batching'):
+                batches = llm._create_batches(items)
+            counts['batches'] = len(batches)
+
+            with timings.stage('pack_export'):
+                processor.generate_language_pack(str(work_dir / 'dist' / 'pack.zip'))
+        finally:
+            processor.close()
+
+        bench_writeback(work_dir, modpack_dir, timings, counts)
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'params': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'counts': counts,
+        'timings': timings.stages,
+    }
+
+
+def compare(current: dict, baseline: dict):
+    """打印与之前结果的对比"""
+    print(f"\n对比 {baseline['meta'].get('commit')} -> {current['meta'].get('commit')}")
+    if baseline.get('params') != current.get('params'):
+        print("注意: 两次运行的参数不同")
+    print(f"{'阶段':<18}{'之前':>10}{'现在':>10}{'变化':>10}")
+    for stage, now in current['timings'].items():
+        before = baseline['timings'].get(stage)
+        if before is None:
+            print(f"{stage:<18}{'-':>10}{now:>9.3f}s{'':>10}")
+        else:
+            print(f"{stage:<18}{before:>9.3f}s{now:>9.3f}s{(now - before) / before:>+9.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在合成整合包上运行基准测试")
+    parser.add_argument('--jars', type=int, default=200, help="jar数量")
+    parser.add_argument('--keys', type=int, default=300, help="每个jar的词条数")
+    parser.add_argument('--classes', type=int, default=200, help="每个jar中的class文件数")
+    parser.add_argument('--zh-coverage', type=float, default=0.3, help="jar自带中文的词条比例")
+    parser.add_argument('--pack-coverage', type=float, default=0.3, help="汉化资源包覆盖的词条比例")
+    parser.add_argument('--reference-coverage', type=float, default=0.1, help="补充参考文件覆盖的词条比例")
+    parser.add_argument('--chapters', type=int, default=20, help="任务书章节数")
+    parser.add_argument('--quests', type=int, default=50, help="每章任务数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--default-pragmas', action='store_true', help="不应用[DATABASE]中的性能参数")
+    parser.add_argument('--output', type=Path, help="结果文件路径")
+    parser.add_argument('--compare', type=Path, help="与之前的结果文件对比")
+    args = parser.parse_args()
+
+    result = run(args)
+
+    output = args.output or RESULTS_DIR / f"bench_{result['meta']['commit'] or 'local'}_{int(time.time())}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到 {output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
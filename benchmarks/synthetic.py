@@ -0,0 +1,124 @@
+"""生成用于基准测试的合成整合包数据
+
+包括mods目录（jar中带en_us/zh_cn语言文件和若干class文件）、汉化资源包、
+补充参考文件以及FTB任务书的en_us.snbt，内容由随机种子决定，便于跨提交比较。
+"""
+import json
+import random
+import zipfile
+from pathlib import Path
+
+_WORDS = (
+    "iron copper gold diamond netherite energy fluid storage crystal ancient "
+    "reinforced magic mana essence machine generator furnace press crusher pipe "
+    "cable block ingot dust plate gear rod wire upgrade module core frame casing "
+    "processing speed efficiency capacity range damage armor tool sword pickaxe"
+).split()
+
+_TEMPLATES = (
+    "{0} {1}",
+    "{0} {1} {2}",
+    "Right-click to toggle the {0} {1}",
+    "Stores up to %s FE of {0} energy",
+    "Increases {0} {1} by %d%%",
+    "Requires a {0} {1} placed adjacent to the {2}",
+    "A {0} {1} used to craft the {2} {3}. Shift-click for more details.",
+)
+
+
+def _text(rng: random.Random) -> str:
+    template = rng.choice(_TEMPLATES)
+    return template.format(*(rng.choice(_WORDS) for _ in range(4))).capitalize()
+
+
+def _translate(text: str) -> str:
+    """生成确定性的"中文翻译"，保证包含中文字符"""
+    return f"译文：{text}"
+
+
+def _mod_keys(modid: str, keys: int, rng: random.Random) -> dict[str, str]:
+    kinds = ('item', 'block', 'tooltip', 'gui', 'message')
+    return {f"{rng.choice(kinds)}.{modid}.entry_{i}": _text(rng) for i in range(keys)}
+
+
+def modid_of(index: int) -> str:
+    return f"synthmod{index:04d}"
+
+
+def generate_mods(mods_dir: Path, jars: int, keys: int, zh_coverage: float,
+                  classes: int = 200, seed: int = 0) -> dict[str, dict[str, str]]:
+    """生成mods目录，返回每个modid的英文词条"""
+    rng = random.Random(seed)
+    mods_dir.mkdir(parents=True, exist_ok=True)
+    mods = {}
+    for i in range(jars):
+        modid = modid_of(i)
+        entries = _mod_keys(modid, keys, rng)
+        mods[modid] = entries
+        with zipfile.ZipFile(mods_dir / f"{modid}-1.0.{i}.jar", 'w', zipfile.ZIP_DEFLATED) as jar:
+            jar.writestr('META-INF/mods.toml',
+                         f'[[mods]]\nmodId="{modid}"\nversion="1.0.{i}"\n')
+            for c in range(classes):
+                jar.writestr(f"com/synth/{modid}/pkg{c % 16}/Class{c}.class", rng.randbytes(256))
+            jar.writestr(f"assets/{modid}/textures/item/icon.png", rng.randbytes(512))
+            jar.writestr(f"assets/{modid}/lang/en_us.json",
+                         json.dumps(entries, ensure_ascii=False, indent=2))
+            zh_keys = [key for key in entries if rng.random() < zh_coverage]
+            if zh_keys:
+                jar.writestr(f"assets/{modid}/lang/zh_cn.json",
+                             json.dumps({key: _translate(entries[key]) for key in zh_keys},
+                                        ensure_ascii=False, indent=2))
+    return mods
+
+
+def generate_resource_pack(pack_path: Path, mods: dict[str, dict[str, str]],
+                           coverage: float, seed: int = 0):
+    """生成汉化资源包，覆盖每个mod中coverage比例的词条"""
+    rng = random.Random(seed + 1)
+    pack_path.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(pack_path, 'w', zipfile.ZIP_DEFLATED) as pack:
+        pack.writestr('pack.mcmeta', json.dumps({"pack": {"pack_format": 15, "description": "synthetic"}}))
+        for modid, entries in mods.items():
+            content = {key: _translate(text) for key, text in entries.items() if rng.random() < coverage}
+            if content:
+                pack.writestr(f"assets/{modid}/lang/zh_cn.json", json.dumps(content, ensure_ascii=False))
+
+
+def generate_reference(reference_path: Path, mods: dict[str, dict[str, str]],
+                       coverage: float, seed: int = 0):
+    """生成按key对应的补充参考文件"""
+    rng = random.Random(seed + 2)
+    reference_path.parent.mkdir(parents=True, exist_ok=True)
+    content = {key: _translate(text)
+               for entries in mods.values()
+               for key, text in entries.items() if rng.random() < coverage}
+    with open(reference_path, 'w', encoding='utf-8') as f:
+        json.dump(content, f, ensure_ascii=False)
+
+
+def _snbt_string(text: str) -> str:
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def generate_quest_book(lang_path: Path, chapters: int, quests: int, seed: int = 0) -> int:
+    """生成FTB任务书的en_us.snbt，返回字符串条目数"""
+    rng = random.Random(seed + 3)
+    lang_path.parent.mkdir(parents=True, exist_ok=True)
+    lines = ['{']
+    count = 0
+    for c in range(chapters):
+        lines.append(f'\tchapter.{rng.getrandbits(64):016X}.title: {_snbt_string(_text(rng))}')
+        count += 1
+        for _ in range(quests):
+            quest_id = f"{rng.getrandbits(64):016X}"
+            lines.append(f'\tquest.{quest_id}.title: {_snbt_string(_text(rng))}')
+            lines.append(f'\tquest.{quest_id}.quest_subtitle: {_snbt_string(_text(rng))}')
+            description = [_text(rng) for _ in range(rng.randint(1, 5))]
+            lines.append(f'\tquest.{quest_id}.quest_desc: [')
+            lines.extend(f'\t\t{_snbt_string(line)}' for line in description)
+            lines.append('\t]')
+            count += 2 + len(description)
+    lines.append('}')
+    with open(lang_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    return count
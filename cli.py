@@ -0,0 +1,354 @@
+"""整合包翻译的命令行入口
+
+用法：
+    python cli.py prepare  [--modpack 整合包目录] [--mods mods目录] [--resource-pack 资源包] [--reference 参考文件]
+    python cli.py translate [--status untranslated|low|all] [--quest] [--retry-exhausted]
+    python cli.py batch    [--status untranslated|low|all] [--no-wait | --collect] [--retry-exhausted]
+    python cli.py pack     [--output 输出路径]
+    python cli.py pipeline [prepare和pack的参数]
+    python cli.py maintain [--vacuum]
+    python cli.py usage    [--run 运行ID]
+    python cli.py quest    export|import
+
+整合包目录默认使用配置中的modpack_path，资源包和参考文件默认使用[MOD]中的路径。
+pipeline依次暂存资源包和参考文件，然后边导入jar边翻译已导入的词条，队列清空后生成资源包。
+translate --quest 同时翻译任务书工作文件中的文本，两者共用[LLM]中rpm/tpm的请求额度，任务书优先。
+batch通过服务商的批处理接口离线翻译：提交后等待任务完成并取回结果；--no-wait只提交，之后用--collect取回。
+词条失败达到[LLM] max_attempts次后不再被领取，排除问题（如API密钥、服务故障）后用--retry-exhausted重新翻译。
+所有子命令都支持 --profile 和 --trace-sql。
+"""
+import argparse
+import os
+import threading
+import time
+from pathlib import Path
+
+import batch_api
+import profiling
+import quest_staging
+from config import getConfig
+from database import Database, STATUS_UNTRANSLATED, STATUS_LOW_CONFIDENCE
+from file_processor import FileProcessor
+from llm_client import LLMClient, Pricing
+from metrics import metrics
+
+DEFAULT_PACK_OUTPUT = 'dist/minecraft-language-pack.zip'
+
+# --status 参数对应的词条状态
+QUEUE_STATUSES = {
+    'untranslated': [STATUS_UNTRANSLATED],
+    'low': [STATUS_LOW_CONFIDENCE],
+    'all': [STATUS_UNTRANSLATED, STATUS_LOW_CONFIDENCE],
+}
+
+
+def _configured_path(section: str, key: str) -> Path | None:
+    value = getConfig(section, key, '')
+    return Path(value) if value and value != '<none>' else None
+
+
+def resolve_mods_dir(args: argparse.Namespace) -> Path | None:
+    """mods目录：--mods > --modpack/mods > 配置的modpack_path/mods"""
+    if args.mods:
+        return args.mods
+    modpack = args.modpack or _configured_path('DEFAULT', 'modpack_path')
+    return modpack / 'mods' if modpack else None
+
+
+def _input_path(value: Path | None, section: str, key: str, description: str) -> Path | None:
+    """命令行参数优先，否则使用配置中的路径，文件不存在时返回None"""
+    path = value or _configured_path(section, key)
+    if path is None:
+        return None
+    if not path.exists():
+        print(f"跳过{description}: 文件不存在 {path}")
+        return None
+    return path
+
+
+def _open_processor(args: argparse.Namespace, db: Database) -> FileProcessor | None:
+    mods_dir = resolve_mods_dir(args)
+    if mods_dir is None:
+        print("错误: 请用 --modpack 或 --mods 指定目录，或在配置中设置modpack_path")
+        return None
+    if not mods_dir.exists():
+        print(f"错误: 指定的mods目录不存在: {mods_dir}")
+        return None
+    return FileProcessor(str(mods_dir), db)
+
+
+def _print_ingest_result(total: int, errors: int, elapsed: float):
+    print("\n处理完成!")
+    print(f"总计处理: {total} 个文件")
+    print(f"成功: {total - errors} 个")
+    print(f"失败: {errors} 个")
+    print(f"耗时: {elapsed:.2f} 秒")
+
+
+def cmd_prepare(args: argparse.Namespace, db: Database):
+    """导入mods中的语言文件、汉化资源包和补充参考文件"""
+    processor = _open_processor(args, db)
+    if processor is None:
+        return
+
+    start_time = time.time()
+    with metrics.timer('stage.mods'):
+        total, errors = processor.process_mods()
+    if not total:
+        print("mods目录中没有找到.jar文件")
+        return
+    _print_ingest_result(total, errors, time.time() - start_time)
+
+    resource_pack = _input_path(args.resource_pack, 'MOD', 'resourcepack_path', "汉化资源包")
+    if resource_pack:
+        with metrics.timer('stage.resource_pack'):
+            processor.process_resource_pack(resource_pack)
+
+    reference = _input_path(args.reference, 'MOD', 'reference_path', "补充参考文件")
+    if reference:
+        with metrics.timer('stage.reference'):
+            processor.process_reference_dat(reference)
+
+
+class ConsoleReporter:
+    """在控制台输出任务书翻译的进度，代替主窗口"""
+
+    def write(self, text: str):
+        print(text)
+
+    def show_info(self, title: str, message: str):
+        print(f"{title}: {message}")
+
+
+def translate_quests(db: Database):
+    """翻译任务书暂存中还没有译文的文本"""
+    # main依赖任务书的snbt库和界面模块，只在需要时导入
+    import main as quest
+    staging = quest_staging.open_quest_staging(db)
+    try:
+        translate_map = staging.load_work()
+        if not translate_map:
+            print(f"{staging.location}中没有任务书文本，跳过任务书翻译")
+            return
+        with metrics.timer('stage.translate_quest'):
+            quest.translateQuestTexts(translate_map, staging, db, ConsoleReporter())
+    finally:
+        staging.close()
+
+
+def cmd_translate(args: argparse.Namespace, db: Database):
+    """翻译工作队列中的词条，--quest时同时翻译任务书"""
+    quest_thread = None
+    if args.quest:
+        quest_thread = threading.Thread(target=translate_quests, args=(db,), name='quest')
+        quest_thread.start()
+    try:
+        llm = LLMClient(db)
+        if args.retry_exhausted:
+            llm.retry_exhausted()
+        for status in QUEUE_STATUSES[args.status]:
+            name = "未翻译" if status == STATUS_UNTRANSLATED else "低信心"
+            print(f"\n开始翻译{name}条目...")
+            with metrics.timer(f'stage.translate_{status}'):
+                translated = llm.translate_queue(status)
+            print(f"已将 {translated} 个{name}条目的翻译结果写入数据库")
+    finally:
+        if quest_thread:
+            quest_thread.join()
+
+
+def cmd_batch(args: argparse.Namespace, db: Database):
+    """通过批处理接口翻译工作队列中的词条"""
+    llm = LLMClient(db)
+    translator = batch_api.BatchTranslator(llm)
+    if args.retry_exhausted:
+        llm.retry_exhausted()
+    if not args.collect:
+        for status in QUEUE_STATUSES[args.status]:
+            with metrics.timer(f'stage.batch_submit_{status}'):
+                translator.submit(status)
+        if args.no_wait:
+            pending = len(translator.pending_jobs())
+            print(f"共有 {pending} 个批处理任务等待完成，之后用 cli.py batch --collect 取回结果")
+            return
+    with metrics.timer('stage.batch_collect'):
+        translated = translator.collect()
+    print(f"已将 {translated} 个条目的翻译结果写入数据库")
+
+
+def cmd_pack(args: argparse.Namespace, db: Database):
+    """生成汉化资源包"""
+    print("正在生成汉化资源包...")
+    with metrics.timer('stage.pack'):
+        FileProcessor(".", db).generate_language_pack(str(args.output))
+    print(f"资源包生成成功！{args.output}")
+
+
+def cmd_pipeline(args: argparse.Namespace, db: Database):
+    """导入、翻译和生成资源包，导入jar的同时翻译已导入的词条"""
+    processor = _open_processor(args, db)
+    if processor is None:
+        return
+    llm = LLMClient(db)
+
+    # 资源包和参考文件先暂存，每个jar导入时一并写入zhcn2，这些词条就不会被当作未翻译词条发给LLM
+    resource_pack = _input_path(args.resource_pack, 'MOD', 'resourcepack_path', "汉化资源包")
+    if resource_pack:
+        with metrics.timer('stage.resource_pack'):
+            processor.process_resource_pack(resource_pack, stage=True)
+    reference = _input_path(args.reference, 'MOD', 'reference_path', "补充参考文件")
+    if reference:
+        with metrics.timer('stage.reference'):
+            processor.stage_reference(reference)
+
+    ingest_done = threading.Event()
+    ingest_result = []
+
+    def ingest():
+        start_time = time.time()
+        try:
+            with metrics.timer('stage.mods'):
+                ingest_result.extend(processor.process_mods(staged=True))
+            _print_ingest_result(*ingest_result, time.time() - start_time)
+        finally:
+            ingest_done.set()
+
+    ingest_thread = threading.Thread(target=ingest, name='ingest')
+    ingest_thread.start()
+    try:
+        with metrics.timer('stage.translate_1'):
+            translated = llm.translate_queue(STATUS_UNTRANSLATED, producer_done=ingest_done)
+        print(f"已将 {translated} 个未翻译条目的翻译结果写入数据库")
+    finally:
+        ingest_thread.join()
+        db.clear_staged()
+
+    # 低信心条目依赖资源包和参考文件，全部导入后再翻译
+    with metrics.timer('stage.translate_2'):
+        translated = llm.translate_queue(STATUS_LOW_CONFIDENCE)
+    print(f"已将 {translated} 个低信心条目的翻译结果写入数据库")
+
+    cmd_pack(args, db)
+
+
+def cmd_maintain(args: argparse.Namespace, db: Database):
+    """更新统计信息，可选VACUUM整理数据库文件"""
+    size_before = os.path.getsize(db.db_path)
+    print("正在维护数据库..." + ("（包括VACUUM）" if args.vacuum else ""))
+    removed = db.cache_evict(float(getConfig('LLM', 'cache_ttl_days', '0')),
+                             int(getConfig('LLM', 'cache_max_entries', '0')))
+    print(f"已从翻译缓存中淘汰 {removed} 条记录")
+    db.maintain(vacuum=args.vacuum)
+    size_after = os.path.getsize(db.db_path)
+    print(f"维护完成，数据库大小: {size_before / 1048576:.2f}MB -> {size_after / 1048576:.2f}MB")
+
+
+def _print_usage_summary(db: Database, pricing: Pricing, group_by: str, title: str, run_id: str | None):
+    rows = db.get_usage_summary(group_by, run_id)
+    print(f"\n{title}")
+    if not rows:
+        print("  没有记录")
+        return
+    print(f"  {'':<30}{'请求':>8}{'条目':>10}{'输入token':>12}{'缓存命中':>10}{'输出token':>12}"
+          f"{'平均延迟':>10}{'估计费用':>14}")
+    for name, requests, items, prompt_tokens, completion_tokens, cached_tokens, latency in rows:
+        latency_text = f"{latency:.2f}s" if latency is not None else '-'
+        hit_rate = f"{cached_tokens / prompt_tokens:.0%}" if prompt_tokens else '-'
+        print(f"  {name:<30}{requests:>8}{items:>10}{prompt_tokens:>12}{hit_rate:>10}{completion_tokens:>12}"
+              f"{latency_text:>10}{pricing.format(prompt_tokens, completion_tokens, cached_tokens):>14}")
+
+
+def cmd_usage(args: argparse.Namespace, db: Database):
+    """按运行、模型和模组汇总LLM用量"""
+    pricing = Pricing.from_config()
+    _print_usage_summary(db, pricing, 'run_id', "按运行汇总:", args.run)
+    _print_usage_summary(db, pricing, 'model', "按模型汇总:", args.run)
+    _print_usage_summary(db, pricing, 'modid', "按模组汇总（按字符数分摊）:", args.run)
+    ratio = db.get_token_ratio(getConfig('LLM', 'model'))
+    if ratio:
+        print(f"\n实际输入token / 估算值: {ratio:.2f}")
+
+
+def cmd_quest(args: argparse.Namespace, db: Database):
+    """在数据库暂存和translate_work_path/translate_fine_path的JSON文件之间导出或导入任务书翻译"""
+    staging = quest_staging.SqliteQuestStaging(db)
+    files = quest_staging.json_staging()
+    if args.action == 'export':
+        work, fine = quest_staging.copy_staging(staging, files)
+        print(f"已导出 {work} 条工作翻译和 {fine} 条精细翻译到 {files.work_path} 和 {files.fine_path}")
+    else:
+        work, fine = quest_staging.copy_staging(files, staging)
+        print(f"已从 {files.work_path} 和 {files.fine_path} 导入 {work} 条工作翻译和 {fine} 条精细翻译")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    common = argparse.ArgumentParser(add_help=False)
+    profiling.add_arguments(common)
+
+    inputs = argparse.ArgumentParser(add_help=False)
+    inputs.add_argument('--modpack', type=Path, help="整合包目录，默认使用配置中的modpack_path")
+    inputs.add_argument('--mods', type=Path, help="mods目录，默认为整合包目录下的mods")
+    inputs.add_argument('--resource-pack', type=Path, help="汉化资源包，默认使用[MOD]中的resourcepack_path")
+    inputs.add_argument('--reference', type=Path, help="补充参考文件，默认使用[MOD]中的reference_path")
+
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument('--output', type=Path, default=Path(DEFAULT_PACK_OUTPUT), help="资源包输出路径")
+
+    parser = argparse.ArgumentParser(description="整合包翻译工具")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    prepare = commands.add_parser('prepare', parents=[common, inputs], help="导入语言文件、资源包和参考文件")
+    prepare.set_defaults(func=cmd_prepare, report=True)
+
+    translate = commands.add_parser('translate', parents=[common], help="翻译工作队列中的词条")
+    translate.add_argument('--status', choices=QUEUE_STATUSES, default='all', help="翻译哪些状态的词条")
+    translate.add_argument('--quest', action='store_true', help="同时翻译任务书，与模组词条共用请求额度")
+    translate.add_argument('--retry-exhausted', action='store_true', help="重新翻译已达到最大尝试次数的条目")
+    translate.set_defaults(func=cmd_translate, report=True)
+
+    batch = commands.add_parser('batch', parents=[common], help="通过批处理接口离线翻译工作队列中的词条")
+    batch.add_argument('--status', choices=QUEUE_STATUSES, default='all', help="提交哪些状态的词条")
+    batch_mode = batch.add_mutually_exclusive_group()
+    batch_mode.add_argument('--no-wait', action='store_true', help="只提交任务，不等待结果")
+    batch_mode.add_argument('--collect', action='store_true', help="不提交新任务，等待并取回已提交任务的结果")
+    batch.add_argument('--retry-exhausted', action='store_true', help="重新提交已达到最大尝试次数的条目")
+    batch.set_defaults(func=cmd_batch, report=True)
+
+    pack = commands.add_parser('pack', parents=[common, output], help="生成汉化资源包")
+    pack.set_defaults(func=cmd_pack, report=True)
+
+    pipeline = commands.add_parser('pipeline', parents=[common, inputs, output], help="导入、翻译并生成资源包")
+    pipeline.set_defaults(func=cmd_pipeline, report=True)
+
+    maintain = commands.add_parser('maintain', parents=[common], help="数据库维护")
+    maintain.add_argument('--vacuum', action='store_true', help="同时整理数据库文件")
+    maintain.set_defaults(func=cmd_maintain)
+
+    usage = commands.add_parser('usage', parents=[common], help="LLM用量和费用汇总")
+    usage.add_argument('--run', help="只统计指定的运行ID")
+    usage.set_defaults(func=cmd_usage)
+
+    quest = commands.add_parser('quest', parents=[common], help="任务书翻译的数据库暂存与JSON文件互相转换")
+    quest.add_argument('action', choices=['export', 'import'], help="export: 数据库 -> JSON，import: JSON -> 数据库")
+    quest.set_defaults(func=cmd_quest)
+    return parser
+
+
+def main(argv: list[str] | None = None):
+    args = build_parser().parse_args(argv)
+
+    def run():
+        db = Database()
+        try:
+            args.func(args, db)
+        finally:
+            db.close()
+            if getattr(args, 'report', False):
+                _, report_path = metrics.write_report(args.command)
+                print(f"运行报告已保存到 {report_path}")
+
+    profiling.run_profiled(args.command, run, args)
+
+
+if __name__ == "__main__":
+    main()
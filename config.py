@@ -30,8 +30,12 @@ def register_config_change_callback(callback: Callable[[], None]):
     """注册配置变更回调"""
     _config_change_callbacks.append(callback)
 
-def getConfig(section, key):
-    return configParser.get(section, key)
+_UNSET = object()
+
+def getConfig(section, key, fallback=_UNSET):
+    if fallback is _UNSET:
+        return configParser.get(section, key)
+    return configParser.get(section, key, fallback=fallback)
 
 def getDefaultConfig(key):
     return getConfig('DEFAULT', key)
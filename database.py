@@ -1,169 +1,969 @@
 import sqlite3
-from config import getDefaultConfig
-from typing import List, Tuple
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from config import getConfig, getDefaultConfig
+from typing import Any, Iterable, Iterator, List, Tuple
+from itertools import islice
 import hashlib
+import re
+import time
+from memory_cache import LRUCache
+from metrics import metrics
+
+# 词条状态（translations.status）
+STATUS_TRANSLATED = 0       # 已有zhcn1或zhcn3
+STATUS_UNTRANSLATED = 1     # zhcn1、zhcn2、zhcn3都为空，需要翻译
+STATUS_LOW_CONFIDENCE = 2   # 只有zhcn2，属于低信心值条目
+
+# 重新导入时原文有变化的词条当作新词条，清除之前失败留下的尝试次数和租约
+_RESET_WORK_ON_CHANGE = '''
+                attempts = CASE WHEN translations.enus = excluded.enus THEN translations.attempts ELSE 0 END,
+                claimed_at = CASE WHEN translations.enus = excluded.enus THEN translations.claimed_at END,'''
+
+# 根据三个中文字段计算状态的SQL表达式，{0}为列前缀（如 NEW.）
+_STATUS_EXPR = '''
+    CASE
+        WHEN {0}zhcn1 IS NOT NULL OR {0}zhcn3 IS NOT NULL THEN 0
+        WHEN {0}zhcn2 IS NOT NULL THEN 2
+        ELSE 1
+    END
+'''
+
+_CJK_PATTERN = re.compile('[\u4e00-\u9fff]')
+# 内存缓存中表示"持久缓存里没有"的标记
+_CACHE_MISS = object()
+
+
+def cache_text_id(text: str) -> int:
+    """缓存文本的id：blake2b哈希的前8字节，作为有符号64位整数"""
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+def normalize_zhcn1(text: str | None) -> str | None:
+    """长度超过6且不含中文字符的zhcn1视为未翻译，返回None"""
+    if text is not None and len(text) > 6 and not _CJK_PATTERN.search(text):
+        return None
+    return text
+
+# 打开数据库时应用的PRAGMA，可在config.ini的[DATABASE]中覆盖，留空则使用SQLite默认值
+DEFAULT_PRAGMA_PROFILE = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': '268435456',   # 256MB
+    'cache_size': '-65536',     # 负数表示KB，即64MB
+    'temp_store': 'MEMORY',
+}
+
+_PRAGMA_VALUE_PATTERN = re.compile(r'^-?[A-Za-z0-9_]+$')
+
+
+def load_pragma_profile() -> dict[str, str]:
+    """从配置读取PRAGMA性能参数"""
+    profile = {}
+    for name, default in DEFAULT_PRAGMA_PROFILE.items():
+        value = getConfig('DATABASE', name, default).strip()
+        if value:
+            profile[name] = value
+    return profile
+
+
+class ConnectionManager:
+    """数据库连接管理
+
+    所有写操作通过同一个写连接串行执行，读操作使用每个线程各自的只读连接，
+    配合WAL模式可以在写入的同时并发读取。
+    """
+
+    # 新建连接使用的连接类，SQL跟踪时替换为带计时的子类
+    connection_factory: type[sqlite3.Connection] = sqlite3.Connection
+
+    def __init__(self, db_path: str, pragmas: dict[str, str], timeout: float = 30.0,
+                 attached: dict[str, str] | None = None):
+        for name, value in pragmas.items():
+            if name not in DEFAULT_PRAGMA_PROFILE or not _PRAGMA_VALUE_PATTERN.match(value):
+                raise ValueError(f"无效的数据库参数: {name} = {value}")
+        self.db_path = db_path
+        self.pragmas = pragmas
+        self.timeout = timeout
+        # 每个连接都要附加的数据库，别名 -> 文件路径
+        self.attached = attached or {}
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        # 内存数据库无法被其他连接打开，读写共用一个连接
+        self._shared = db_path == ':memory:'
+        self._writer = self._connect(readonly=False)
+
+    def _connect(self, readonly: bool) -> sqlite3.Connection:
+        """打开连接并应用PRAGMA参数"""
+        if readonly:
+            uri = Path(self.db_path).resolve().as_uri() + '?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, timeout=self.timeout, check_same_thread=False,
+                                   factory=self.connection_factory)
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False,
+                                   factory=self.connection_factory)
+        for name, value in self.pragmas.items():
+            # journal_mode是数据库文件级别的设置，由写连接设置即可
+            if readonly and name == 'journal_mode':
+                continue
+            conn.execute(f'PRAGMA {name} = {value}')
+        for alias, path in self.attached.items():
+            if readonly:
+                conn.execute(f'ATTACH DATABASE ? AS {alias}', (Path(path).resolve().as_uri() + '?mode=ro',))
+            else:
+                conn.execute(f'ATTACH DATABASE ? AS {alias}', (path,))
+                for name in ('journal_mode', 'synchronous'):
+                    if name in self.pragmas:
+                        conn.execute(f'PRAGMA {alias}.{name} = {self.pragmas[name]}')
+        return conn
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Connection]:
+        """获取写连接，退出时提交，出错时回滚
+
+        同一线程中嵌套调用时，内层使用SAVEPOINT，出错只回滚内层的修改，由最外层统一提交
+        """
+        waited = time.perf_counter()
+        with self._write_lock:
+            if self._write_depth:
+                yield from self._nested_write()
+                return
+            metrics.record_time('db.write_lock_wait', time.perf_counter() - waited)
+            self._write_depth = 1
+            with metrics.timer('db.write'):
+                try:
+                    yield self._writer
+                    self._writer.commit()
+                except BaseException:
+                    self._writer.rollback()
+                    raise
+                finally:
+                    self._write_depth = 0
+
+    def _nested_write(self) -> Iterator[sqlite3.Connection]:
+        """嵌套写入：在外层事务中开启SAVEPOINT"""
+        self._write_depth += 1
+        try:
+            # 外层还没有执行过修改时先显式开始事务，避免RELEASE直接提交
+            if not self._writer.in_transaction:
+                self._writer.execute('BEGIN')
+            self._writer.execute('SAVEPOINT nested_write')
+            try:
+                yield self._writer
+                self._writer.execute('RELEASE nested_write')
+            except BaseException:
+                self._writer.execute('ROLLBACK TO nested_write')
+                self._writer.execute('RELEASE nested_write')
+                raise
+        finally:
+            self._write_depth -= 1
+
+    def reader(self) -> sqlite3.Connection:
+        """获取当前线程的只读连接"""
+        if self._shared:
+            return self._writer
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect(readonly=True)
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    def close(self):
+        """关闭所有连接"""
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+        with self._write_lock:
+            self._writer.close()
+
 
 class Database:
-    def __init__(self):
-        self.db_path = getDefaultConfig('database_path')
-        self.conn = sqlite3.connect(self.db_path)
+    def __init__(self, db_path: str | None = None, pragmas: dict[str, str] | None = None,
+                 shared_store_path: str | None = None):
+        self.db_path = db_path or getDefaultConfig('database_path')
+        # 多个整合包共用的词条库，传入空字符串或配置为<none>时不使用
+        if shared_store_path is None:
+            shared_store_path = getConfig('DEFAULT', 'shared_store_path', '')
+        self.shared_store_path = shared_store_path if shared_store_path not in ('', '<none>') else None
+        self.connections = ConnectionManager(
+            self.db_path, load_pragma_profile() if pragmas is None else pragmas,
+            attached={'shared': self.shared_store_path} if self.shared_store_path else None)
+        # 翻译缓存前面的进程内LRU，(modid, 原文) -> 译文，同时记住未命中的原文
+        self.memory_cache = LRUCache(int(getConfig('LLM', 'memory_cache_size', '0')), 'cache.memory')
         self._create_tables()
+        if self.shared_store_path:
+            self._create_shared_tables()
+
+    @property
+    def shared(self) -> bool:
+        """是否使用共享词条库"""
+        return self.shared_store_path is not None
+
+    def write(self):
+        """获取写连接的上下文，退出时自动提交"""
+        return self.connections.write()
+
+    def reader(self) -> sqlite3.Connection:
+        """获取当前线程的只读连接"""
+        return self.connections.reader()
 
     def _create_tables(self):
         """创建数据库表"""
-        cursor = self.conn.cursor()
-        
-        # 创建翻译词条表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS translations (
-                modid TEXT NOT NULL,
-                key TEXT NOT NULL,
-                enus TEXT NOT NULL,
-                zhcn1 TEXT,
-                zhcn2 TEXT,
-                zhcn3 TEXT,
-                PRIMARY KEY (modid, key)
-            )
-        ''')
+        with self.write() as conn:
+            cursor = conn.cursor()
+
+            # 创建翻译词条表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS translations (
+                    modid TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    enus TEXT NOT NULL,
+                    zhcn1 TEXT,
+                    zhcn2 TEXT,
+                    zhcn3 TEXT,
+                    status INTEGER NOT NULL DEFAULT 1,
+                    claimed_at REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    mod_version TEXT,
+                    PRIMARY KEY (modid, key)
+                )
+            ''')
+
+            # 旧数据库没有status列，补上并回填
+            if self._add_column(cursor, 'translations', 'status', 'INTEGER NOT NULL DEFAULT 1'):
+                conn.create_function('normalize_zhcn1', 1, normalize_zhcn1, deterministic=True)
+                cursor.execute('''
+                    UPDATE translations SET zhcn1 = normalize_zhcn1(zhcn1)
+                    WHERE zhcn1 IS NOT NULL
+                ''')
+                cursor.execute(f'UPDATE translations SET status = {_STATUS_EXPR.format("")}')
+
+            # 工作队列的租约字段
+            self._add_column(cursor, 'translations', 'claimed_at', 'REAL')
+            self._add_column(cursor, 'translations', 'attempts', 'INTEGER NOT NULL DEFAULT 0')
+            # 词条来自的mod版本，用于和共享词条库对应
+            self._add_column(cursor, 'translations', 'mod_version', 'TEXT')
+
+            # 中文字段变化时维护status
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS translations_status_update
+                AFTER UPDATE OF zhcn1, zhcn2, zhcn3 ON translations
+                BEGIN
+                    UPDATE translations SET status = {_STATUS_EXPR.format("NEW.")}
+                    WHERE rowid = NEW.rowid;
+                END
+            ''')
+
+            # 只索引待处理的词条，已翻译的词条不占索引空间
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_translations_pending
+                ON translations (status, modid, key)
+                WHERE status != 0
+            ''')
         
-        # 创建翻译缓存表 - 修改表结构，增加modid和key
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS translation_cache (
-                text_hash TEXT NOT NULL,
-                modid TEXT NOT NULL,
-                key TEXT NOT NULL,
-                original TEXT NOT NULL,
-                translation TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (text_hash, modid)
-            )
+            # 翻译缓存：原文和译文去重存放在cache_texts中，id为文本哈希的前8字节，
+            # cache_entries只保存(原文id, modid) -> 译文id，行很小，适合WITHOUT ROWID
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS cache_texts (
+                    id INTEGER PRIMARY KEY,
+                    text TEXT NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    source_id INTEGER NOT NULL,
+                    modid TEXT NOT NULL,
+                    translation_id INTEGER NOT NULL,
+                    cached_at INTEGER NOT NULL,
+                    PRIMARY KEY (source_id, modid)
+                ) WITHOUT ROWID
+            ''')
+            self._migrate_translation_cache(conn)
+
+            # 每个LLM请求的用量，estimated_tokens为请求前估算的输入token数，
+            # cached_tokens为输入中命中服务商前缀缓存的token数，
+            # 批处理接口的结果没有单个请求的延迟，latency为0，batch_turnaround为整个任务从提交到完成的时间
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS llm_usage (
+                    id INTEGER PRIMARY KEY,
+                    run_id TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    items INTEGER NOT NULL,
+                    chars INTEGER NOT NULL,
+                    prompt_tokens INTEGER NOT NULL,
+                    completion_tokens INTEGER NOT NULL,
+                    estimated_tokens INTEGER NOT NULL,
+                    latency REAL NOT NULL,
+                    cached_tokens INTEGER NOT NULL DEFAULT 0,
+                    batch_turnaround REAL
+                )
+            ''')
+            self._add_column(cursor, 'llm_usage', 'cached_tokens', 'INTEGER NOT NULL DEFAULT 0')
+            self._add_column(cursor, 'llm_usage', 'batch_turnaround', 'REAL')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_llm_usage_run ON llm_usage (run_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_llm_usage_model ON llm_usage (model, id)')
+
+            # 一个请求中各mod所占的条目数和字符数，用于按mod分摊用量
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS llm_usage_mods (
+                    usage_id INTEGER NOT NULL,
+                    modid TEXT NOT NULL,
+                    items INTEGER NOT NULL,
+                    chars INTEGER NOT NULL,
+                    PRIMARY KEY (usage_id, modid)
+                ) WITHOUT ROWID
+            ''')
+
+            # 任务书的工作翻译和精细翻译（[QUEST] staging_backend = sqlite时使用），按写入顺序保存
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS quest_work (
+                    key TEXT PRIMARY KEY,
+                    origin TEXT NOT NULL,
+                    ref TEXT NOT NULL,
+                    target TEXT NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS quest_fine (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            ''')
+
+    def _create_shared_tables(self):
+        """创建共享词条库的表
+
+        mod_versions记录已导入的(modid, 版本)，entries保存该版本jar中的英文和自带中文，
+        translations保存LLM翻译结果，按原文匹配后可以在不同整合包和版本之间复用
+        """
+        with self.write() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS shared.mod_versions (
+                    modid TEXT NOT NULL,
+                    mod_version TEXT NOT NULL,
+                    entries INTEGER NOT NULL,
+                    ingested_at REAL NOT NULL,
+                    PRIMARY KEY (modid, mod_version)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS shared.entries (
+                    modid TEXT NOT NULL,
+                    mod_version TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    enus TEXT NOT NULL,
+                    zhcn1 TEXT,
+                    PRIMARY KEY (modid, mod_version, key)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS shared.translations (
+                    modid TEXT NOT NULL,
+                    mod_version TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    enus TEXT NOT NULL,
+                    zhcn3 TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (modid, mod_version, key)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS shared.idx_translations_source
+                ON translations (modid, key, enus)
+            ''')
+
+    def _migrate_translation_cache(self, conn: sqlite3.Connection):
+        """把旧的translation_cache表（十六进制md5、每行保存原文和译文）迁移到新的缓存表"""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'translation_cache'").fetchone()
+        if not exists:
+            return
+        conn.create_function('cache_text_id', 1, cache_text_id, deterministic=True)
+        conn.execute('''
+            INSERT OR IGNORE INTO cache_texts (id, text)
+            SELECT cache_text_id(original), original FROM translation_cache
+            UNION ALL
+            SELECT cache_text_id(translation), translation FROM translation_cache
         ''')
-        
-        self.conn.commit()
+        # 和cache_translations一样，原文或译文的ID已被另一个文本占用时跳过该条缓存
+        migrated = conn.execute('''
+            INSERT OR REPLACE INTO cache_entries (source_id, modid, translation_id, cached_at)
+            SELECT s.id, c.modid, t.id,
+                   COALESCE(CAST(strftime('%s', c.created_at) AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER))
+            FROM translation_cache AS c
+            JOIN cache_texts AS s ON s.id = cache_text_id(c.original) AND s.text = c.original
+            JOIN cache_texts AS t ON t.id = cache_text_id(c.translation) AND t.text = c.translation
+            ORDER BY c.created_at
+        ''').rowcount
+        skipped = conn.execute('SELECT COUNT(*) FROM translation_cache').fetchone()[0] - migrated
+        conn.execute('DROP TABLE translation_cache')
+        print(f"已将 {migrated} 条翻译缓存迁移到新的缓存表，可运行 maintain --vacuum 回收空间")
+        if skipped > 0:
+            metrics.count('cache.collisions', skipped)
+            print(f"{skipped} 条翻译缓存的文本ID与其他文本冲突，未迁移")
+
+    def _add_column(self, cursor: sqlite3.Cursor, table: str, column: str, definition: str) -> bool:
+        """表中缺少该列时添加，返回是否新增"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        if any(row[1] == column for row in cursor.fetchall()):
+            return False
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        return True
 
     def insert_translation(self, modid: str, key: str, enus: str):
         """插入新的翻译词条"""
-        cursor = self.conn.cursor()        
-        cursor.execute('''
-            INSERT INTO translations (modid, key, enus)
-            VALUES (?, ?, ?)
-            ON CONFLICT(modid, key) DO UPDATE SET
-            enus = excluded.enus
-        ''', (modid, key, enus))
-        self.conn.commit()
+        with self.write() as conn:
+            conn.execute(f'''
+                INSERT INTO translations (modid, key, enus)
+                VALUES (?, ?, ?)
+                ON CONFLICT(modid, key) DO UPDATE SET{_RESET_WORK_ON_CHANGE}
+                enus = excluded.enus
+            ''', (modid, key, enus))
+
+    def insert_translations(self, modid: str, rows: Iterable[Tuple[str, str]], mod_version: str | None = None):
+        """在一个事务中批量插入同一mod的词条，rows为(key, enus)"""
+        with self.write() as conn:
+            conn.executemany(f'''
+                INSERT INTO translations (modid, key, enus, mod_version)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(modid, key) DO UPDATE SET{_RESET_WORK_ON_CHANGE}
+                enus = excluded.enus,
+                mod_version = excluded.mod_version
+            ''', ((modid, key, enus, mod_version) for key, enus in rows))
 
     def update_zhcn1(self, modid: str, key: str, zhcn1: str):
         """更新zhcn1字段"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE translations
-            SET zhcn1 = ?
-            WHERE modid = ? AND key = ?
-        ''', (zhcn1, modid, key))
-        self.conn.commit()
+        with self.write() as conn:
+            conn.execute('''
+                UPDATE translations
+                SET zhcn1 = ?
+                WHERE modid = ? AND key = ?
+            ''', (normalize_zhcn1(zhcn1), modid, key))
+
+    def update_zhcn1_many(self, modid: str, rows: Iterable[Tuple[str, str]]):
+        """在一个事务中批量更新同一mod的zhcn1字段，rows为(key, zhcn1)"""
+        with self.write() as conn:
+            conn.executemany('''
+                UPDATE translations
+                SET zhcn1 = ?
+                WHERE modid = ? AND key = ?
+            ''', ((normalize_zhcn1(zhcn1), modid, key) for key, zhcn1 in rows))
 
     def update_zhcn2(self, modid: str, key: str, zhcn2: str):
         """更新zhcn2字段"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE translations
-            SET zhcn2 = ?
-            WHERE modid = ? AND key = ?
-        ''', (zhcn2, modid, key))
-        self.conn.commit()
+        with self.write() as conn:
+            conn.execute('''
+                UPDATE translations
+                SET zhcn2 = ?
+                WHERE modid = ? AND key = ?
+            ''', (zhcn2, modid, key))
+
+    def update_zhcn2_many(self, modid: str, rows: Iterable[Tuple[str, str]]):
+        """在一个事务中批量更新同一mod的zhcn2字段，rows为(key, zhcn2)"""
+        with self.write() as conn:
+            conn.executemany('''
+                UPDATE translations
+                SET zhcn2 = ?
+                WHERE modid = ? AND key = ?
+            ''', ((zhcn2, modid, key) for key, zhcn2 in rows))
 
     def update_zhcn3(self, modid: str, key: str, zhcn3: str):
         """更新zhcn3字段"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE translations
-            SET zhcn3 = ?
-            WHERE modid = ? AND key = ?
-        ''', (zhcn3, modid, key))
-        self.conn.commit()
+        self.update_zhcn3_many([(modid, key, zhcn3)])
 
-    def get_untranslated(self) -> List[Tuple[str, str, str]]:
-        """获取需要翻译的词条"""
-        cursor = self.conn.cursor()
-        
-        # 先获取所有 zhcn1 不为空的记录
+    def update_zhcn3_many(self, rows: List[Tuple[str, str, str]]):
+        """在一个事务中批量更新zhcn3字段，rows为(modid, key, zhcn3)
+
+        使用共享词条库时同时把译文写入共享库，供其他整合包复用
+        """
+        with self.write() as conn:
+            conn.executemany('''
+                UPDATE translations
+                SET zhcn3 = ?
+                WHERE modid = ? AND key = ?
+            ''', ((zhcn3, modid, key) for modid, key, zhcn3 in rows))
+            if self.shared:
+                now = time.time()
+                conn.executemany('''
+                    INSERT OR REPLACE INTO shared.translations
+                        (modid, mod_version, key, enus, zhcn3, updated_at)
+                    SELECT modid, mod_version, key, enus, zhcn3, ? FROM translations
+                    WHERE modid = ? AND key = ? AND mod_version IS NOT NULL AND zhcn3 IS NOT NULL
+                ''', ((now, modid, key) for modid, key, _ in rows))
+
+    def has_shared_version(self, modid: str, mod_version: str) -> bool:
+        """共享词条库中是否已有该版本mod的词条"""
+        cursor = self.reader().cursor()
+        cursor.execute('SELECT 1 FROM shared.mod_versions WHERE modid = ? AND mod_version = ?',
+                       (modid, mod_version))
+        return cursor.fetchone() is not None
+
+    def import_shared_version(self, modid: str, mod_version: str) -> int:
+        """从共享词条库复制该版本mod的英文和自带中文，代替解析jar，返回复制的词条数"""
+        with self.write() as conn:
+            # 新插入的行直接计算status；已有的行更新zhcn1时由触发器维护
+            return conn.execute(f'''
+                INSERT INTO translations (modid, key, enus, zhcn1, mod_version, status)
+                SELECT modid, key, enus, zhcn1, mod_version,
+                       CASE WHEN zhcn1 IS NOT NULL THEN 0 ELSE 1 END
+                FROM shared.entries
+                WHERE modid = ? AND mod_version = ?
+                ON CONFLICT(modid, key) DO UPDATE SET{_RESET_WORK_ON_CHANGE}
+                enus = excluded.enus,
+                zhcn1 = excluded.zhcn1,
+                mod_version = excluded.mod_version
+            ''', (modid, mod_version)).rowcount
+
+    def publish_shared_version(self, modid: str, mod_version: str) -> int:
+        """把刚从jar导入的该版本mod词条写入共享词条库，返回写入的词条数"""
+        with self.write() as conn:
+            count = conn.execute('''
+                INSERT OR REPLACE INTO shared.entries (modid, mod_version, key, enus, zhcn1)
+                SELECT modid, mod_version, key, enus, zhcn1 FROM translations
+                WHERE modid = ? AND mod_version = ?
+            ''', (modid, mod_version)).rowcount
+            conn.execute('''
+                INSERT OR REPLACE INTO shared.mod_versions (modid, mod_version, entries, ingested_at)
+                VALUES (?, ?, ?, ?)
+            ''', (modid, mod_version, count, time.time()))
+        return count
+
+    def apply_shared_translations(self, modid: str) -> int:
+        """用共享词条库中原文相同的译文填充该mod没有zhcn1和zhcn3的词条，返回填充数"""
+        with self.write() as conn:
+            return conn.execute('''
+                UPDATE translations
+                SET zhcn3 = s.zhcn3
+                FROM shared.translations AS s
+                WHERE translations.modid = ?
+                AND s.modid = translations.modid AND s.key = translations.key AND s.enus = translations.enus
+                AND translations.zhcn1 IS NULL AND translations.zhcn3 IS NULL
+            ''', (modid,)).rowcount
+
+    def get_shared_translation(self, modid: str, key: str, enus: str) -> str | None:
+        """从共享词条库查找同一词条、原文相同的译文"""
+        cursor = self.reader().cursor()
         cursor.execute('''
-            SELECT modid, key, enus, zhcn1
-            FROM translations
-            WHERE zhcn1 IS NOT NULL
+            SELECT zhcn3 FROM shared.translations
+            WHERE modid = ? AND key = ? AND enus = ?
+            ORDER BY updated_at DESC LIMIT 1
+        ''', (modid, key, enus))
+        result = cursor.fetchone()
+        return result[0] if result else None
+
+    def _create_staging_tables(self, conn: sqlite3.Connection):
+        """创建暂存资源包和参考翻译的临时表，临时表只存在于写连接中"""
+        conn.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS reference_import (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
         ''')
-        
-        # 检查并更新纯英文的 zhcn1
-        for row in cursor.fetchall():
-            zhcn1 = row[3]
-            # 检查是否为纯英文文本(不含中文字符)
-            if len(zhcn1) > 6 and not any('\u4e00' <= c <= '\u9fff' for c in zhcn1):
-                cursor.execute('''
-                    UPDATE translations
-                    SET zhcn1 = NULL
-                    WHERE modid = ? AND key = ?
-                ''', (row[0], row[1]))
-        self.conn.commit()
-        
-        # 然后获取所有需要翻译的记录
-        cursor.execute('''
-            SELECT modid, key, enus
-            FROM translations
-            WHERE zhcn1 IS NULL AND zhcn2 IS NULL AND zhcn3 IS NULL
-            ORDER BY RANDOM()
+        conn.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS pack_import (
+                modid TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (modid, key)
+            )
         ''')
-        return cursor.fetchall()
+
+    def load_reference(self, items: Iterable[Tuple[str, Any]], batch_size: int = 5000) -> int:
+        """把参考翻译导入临时表，替换之前导入的内容，items为(key, 翻译)，返回导入条数"""
+        items = iter(items)
+        loaded = 0
+        with self.write() as conn:
+            self._create_staging_tables(conn)
+            conn.execute('DELETE FROM temp.reference_import')
+
+            while chunk := list(islice(items, batch_size)):
+                rows = [(key, value) for key, value in chunk if isinstance(value, str)]
+                # 重复的key以后出现的为准，与json.load一致
+                conn.executemany('INSERT OR REPLACE INTO temp.reference_import VALUES (?, ?)', rows)
+                loaded += len(rows)
+        return loaded
+
+    def stage_pack_translations(self, modid: str, rows: Iterable[Tuple[str, str]]):
+        """把资源包中一个mod的译文暂存到临时表，rows为(key, zhcn2)"""
+        with self.write() as conn:
+            self._create_staging_tables(conn)
+            conn.executemany('INSERT OR REPLACE INTO temp.pack_import VALUES (?, ?, ?)',
+                             ((modid, key, value) for key, value in rows))
+
+    def apply_staged(self, modids: List[str] | None = None) -> Tuple[int, int]:
+        """把暂存的资源包译文和参考翻译写入zhcn2，modids为空时处理全部
+
+        先用资源包覆盖zhcn2，再用参考翻译填充仍为空的同key词条，与逐步导入的顺序一致。
+        返回(资源包更新的词条数, 参考翻译更新的词条数)
+        """
+        if modids is not None and not modids:
+            return 0, 0
+        modid_filter = f"AND translations.modid IN ({', '.join('?' * len(modids))})" if modids else ''
+        params = tuple(modids or ())
+        with self.write() as conn:
+            self._create_staging_tables(conn)
+            pack_updated = conn.execute(f'''
+                UPDATE translations
+                SET zhcn2 = p.value
+                FROM temp.pack_import AS p
+                WHERE translations.modid = p.modid AND translations.key = p.key {modid_filter}
+            ''', params).rowcount
+            reference_updated = conn.execute(f'''
+                UPDATE translations
+                SET zhcn2 = r.value
+                FROM temp.reference_import AS r
+                WHERE translations.key = r.key AND translations.zhcn2 IS NULL {modid_filter}
+            ''', params).rowcount
+        return pack_updated, reference_updated
+
+    def clear_staged(self):
+        """清空暂存的资源包译文和参考翻译"""
+        with self.write() as conn:
+            self._create_staging_tables(conn)
+            conn.execute('DELETE FROM temp.pack_import')
+            conn.execute('DELETE FROM temp.reference_import')
+
+    def apply_reference(self, items: Iterable[Tuple[str, Any]], batch_size: int = 5000) -> Tuple[int, int]:
+        """批量导入参考翻译到临时表，再用一条UPDATE填充zhcn2为空的同key词条
+
+        items为(key, 翻译)，返回(读取的参考条数, 更新的词条数)
+        """
+        with self.write() as conn:
+            loaded = self.load_reference(items, batch_size)
+            updated = conn.execute('''
+                UPDATE translations
+                SET zhcn2 = r.value
+                FROM temp.reference_import AS r
+                WHERE translations.key = r.key AND translations.zhcn2 IS NULL
+            ''').rowcount
+            conn.execute('DELETE FROM temp.reference_import')
+        return loaded, updated
+
+    def get_untranslated(self) -> List[Tuple[str, str, str]]:
+        """获取需要翻译的词条"""
+        return list(self.iter_by_status(STATUS_UNTRANSLATED))
 
     def get_low_confidence(self) -> List[Tuple[str, str, str]]:
         """获取低信心值的条目（有zhcn2但没有zhcn1的条目）"""
-        cursor = self.conn.cursor()
+        return list(self.iter_by_status(STATUS_LOW_CONFIDENCE))
+
+    def iter_by_status(self, status: int, chunk_size: int = 1000) -> Iterator[Tuple[str, str, str]]:
+        """按(modid, key)顺序分页读取指定状态的词条"""
+        cursor = self.reader().cursor()
+        # 条件中保留 status != 0 以命中部分索引
         cursor.execute('''
-            SELECT modid, key, enus 
+            SELECT modid, key, enus
             FROM translations
-            WHERE zhcn2 IS NOT NULL AND zhcn1 IS NULL AND zhcn3 IS NULL
-            ORDER BY RANDOM()
+            WHERE status != 0 AND status = ?
+            ORDER BY modid, key
+            LIMIT ?
+        ''', (status, chunk_size))
+        rows = cursor.fetchall()
+        while rows:
+            yield from rows
+            cursor.execute('''
+                SELECT modid, key, enus
+                FROM translations
+                WHERE status != 0 AND status = ? AND (modid, key) > (?, ?)
+                ORDER BY modid, key
+                LIMIT ?
+            ''', (status, *rows[-1][:2], chunk_size))
+            rows = cursor.fetchall()
+
+    def iter_glossary_terms(self) -> Iterator[Tuple[str, str]]:
+        """已有译名的物品和方块名称(原文, 译名)，译名优先取zhcn1，其次zhcn2"""
+        return self.reader().execute('''
+            SELECT enus, COALESCE(zhcn1, zhcn2) FROM translations
+            WHERE (key LIKE 'item.%' OR key LIKE 'block.%')
+            AND (zhcn1 IS NOT NULL OR zhcn2 IS NOT NULL)
         ''')
-        return cursor.fetchall()
+
+    def claim_work(self, status: int, limit: int, lease_seconds: float, max_attempts: int,
+                   after: Tuple[str, str] | None = None) -> List[Tuple[str, str, str]]:
+        """从工作队列领取一批词条
+
+        按(modid, key)顺序领取排在after之后、未被领取或租约已过期、尝试次数未超限的词条，
+        领取时记录claimed_at并累加attempts。使用BEGIN IMMEDIATE保证多个进程不会领取到同一词条。
+        """
+        now = time.time()
+        keyset = 'AND (modid, key) > (?, ?)' if after else ''
+        with self.write() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            # 条件中保留 status != 0 以命中部分索引
+            cursor.execute(f'''
+                UPDATE translations
+                SET claimed_at = ?, attempts = attempts + 1
+                WHERE rowid IN (
+                    SELECT rowid FROM translations
+                    WHERE status != 0 AND status = ? {keyset}
+                    AND (claimed_at IS NULL OR claimed_at < ?)
+                    AND attempts < ?
+                    ORDER BY modid, key
+                    LIMIT ?
+                )
+                RETURNING modid, key, enus, attempts
+            ''', (now, status, *(after or ()), now - lease_seconds, max_attempts, limit))
+            claimed = cursor.fetchall()
+        # 尝试次数大于1的是之前失败或租约过期后重新领取的条目
+        metrics.count('queue.retries', sum(1 for row in claimed if row[3] > 1))
+        # RETURNING不保证顺序
+        rows = sorted(row[:3] for row in claimed)
+        return rows
+
+    def release_work(self, keys: List[Tuple[str, str]], refund_attempt: bool = False):
+        """释放未完成词条的租约，使其可以被重新领取
+
+        refund_attempt为True时同时退回领取时累加的尝试次数，用于请求根本没有发出的情况
+        """
+        attempts = 'MAX(attempts - 1, 0)' if refund_attempt else 'attempts'
+        with self.write() as conn:
+            conn.executemany(f'''
+                UPDATE translations
+                SET claimed_at = NULL, attempts = {attempts}
+                WHERE modid = ? AND key = ?
+            ''', keys)
+
+    def reset_work_attempts(self, max_attempts: int) -> int:
+        """把尝试次数已达上限的未完成词条清零，使其可以重新领取，返回清零的条目数
+
+        不清除租约，正在处理或已提交批处理任务的词条不会被重复领取
+        """
+        with self.write() as conn:
+            return conn.execute('''
+                UPDATE translations
+                SET attempts = 0
+                WHERE status != 0 AND attempts >= ?
+            ''', (max_attempts,)).rowcount
+
+    def count_exhausted_work(self, status: int, max_attempts: int) -> int:
+        """统计尝试次数已达上限、不会再被领取的词条数"""
+        cursor = self.reader().cursor()
+        cursor.execute('''
+            SELECT COUNT(*) FROM translations
+            WHERE status != 0 AND status = ? AND attempts >= ?
+        ''', (status, max_attempts))
+        return cursor.fetchone()[0]
 
     def cache_purge(self):
         """清除缓存"""
-        cursor = self.conn.cursor()
-        cursor.execute('DELETE FROM translation_cache')
-        self.conn.commit()
+        with self.write() as conn:
+            conn.execute('DELETE FROM cache_entries')
+            conn.execute('DELETE FROM cache_texts')
+        self.memory_cache.clear()
 
     def cache_translation(self, modid: str, key: str, original: str, translation: str) -> None:
         """缓存翻译结果"""
-        cursor = self.conn.cursor()
-        text_hash = hashlib.md5(original.encode('utf-8')).hexdigest()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO translation_cache 
-            (text_hash, modid, key, original, translation)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (text_hash, modid, key, original, translation))
-        
-        self.conn.commit()
+        self.cache_translations([(modid, key, original, translation)])
+
+    def cache_translations(self, rows: List[Tuple[str, str, str, str]]) -> None:
+        """在一个事务中批量缓存翻译结果，rows为(modid, key, original, translation)
+
+        缓存按原文和modid查找，不保存key。原文或译文的id与已保存的其他文本碰撞时不缓存该条，
+        避免查询时返回错误的译文或覆盖其他原文的记录
+        """
+        now = int(time.time())
+        keyed = []
+        texts = {}
+        for modid, _, original, translation in rows:
+            source_id, translation_id = cache_text_id(original), cache_text_id(translation)
+            texts[source_id] = original
+            texts[translation_id] = translation
+            keyed.append((source_id, translation_id, modid, original, translation))
+        with self.write() as conn:
+            conn.executemany('INSERT OR IGNORE INTO cache_texts (id, text) VALUES (?, ?)', texts.items())
+            # INSERT OR IGNORE保留了先写入的文本，逐个核对id对应的文本是否就是要缓存的文本
+            ids = list(texts)
+            stored = {}
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                stored.update(conn.execute(
+                    f'SELECT id, text FROM cache_texts WHERE id IN ({",".join("?" * len(chunk))})', chunk))
+            collided = {text_id for text_id, text in texts.items() if stored.get(text_id) != text}
+            if collided:
+                metrics.count('cache.collisions', len(collided))
+                keyed = [row for row in keyed if row[0] not in collided and row[1] not in collided]
+            conn.executemany('''
+                INSERT OR REPLACE INTO cache_entries (source_id, modid, translation_id, cached_at)
+                VALUES (?, ?, ?, ?)
+            ''', [(source_id, modid, translation_id, now) for source_id, translation_id, modid, _, _ in keyed])
+        for _, _, modid, original, translation in keyed:
+            self.memory_cache.put((modid, original), translation)
 
     def get_cached_translation(self, modid: str, text: str) -> str | None:
-        """获取缓存的翻译结果，考虑mod上下文"""
-        cursor = self.conn.cursor()
-        text_hash = hashlib.md5(text.encode('utf-8')).hexdigest()
-        
+        """获取缓存的翻译结果，考虑mod上下文，先查内存缓存"""
+        cached = self.memory_cache.get((modid, text), negative=_CACHE_MISS)
+        if cached is not None:
+            return None if cached is _CACHE_MISS else cached
+
+        cursor = self.reader().cursor()
+        source_id = cache_text_id(text)
+
+        # 同时比较原文，原文哈希碰撞时视为未命中；译文碰撞的记录在写入时已跳过
         cursor.execute('''
-            SELECT translation FROM translation_cache
-            WHERE text_hash = ? AND modid = ?
-        ''', (text_hash, modid))
+            SELECT t.text FROM cache_entries AS e
+            JOIN cache_texts AS s ON s.id = e.source_id
+            JOIN cache_texts AS t ON t.id = e.translation_id
+            WHERE e.source_id = ? AND e.modid = ? AND s.text = ?
+        ''', (source_id, modid, text))
         
         result = cursor.fetchone()
+        metrics.count('cache.hit' if result else 'cache.miss')
+        self.memory_cache.put((modid, text), result[0] if result else _CACHE_MISS)
         return result[0] if result else None
 
     def get_cache_stats(self) -> tuple[int, str]:
         """获取缓存统计信息"""
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT COUNT(*), MIN(created_at) FROM translation_cache')
+        cursor = self.reader().cursor()
+        cursor.execute('''
+            SELECT COUNT(*), datetime(MIN(cached_at), 'unixepoch') FROM cache_entries
+        ''')
         count, earliest = cursor.fetchone()
         return count, earliest or "N/A"
 
+    def cache_evict(self, ttl_days: float = 0, max_entries: int = 0) -> int:
+        """淘汰缓存：删除超过ttl_days天的记录，再按时间从旧到新删除超出max_entries的记录，
+        最后清理不再被引用的文本。参数为0表示不限制，返回删除的记录数
+        """
+        removed = 0
+        with self.write() as conn:
+            if ttl_days:
+                removed += conn.execute('DELETE FROM cache_entries WHERE cached_at < ?',
+                                        (int(time.time() - ttl_days * 86400),)).rowcount
+            if max_entries:
+                removed += conn.execute('''
+                    DELETE FROM cache_entries WHERE (source_id, modid) IN (
+                        SELECT source_id, modid FROM cache_entries
+                        ORDER BY cached_at
+                        LIMIT MAX((SELECT COUNT(*) FROM cache_entries) - ?, 0)
+                    )
+                ''', (max_entries,)).rowcount
+            if removed:
+                conn.execute('''
+                    DELETE FROM cache_texts WHERE id NOT IN (
+                        SELECT source_id FROM cache_entries
+                        UNION
+                        SELECT translation_id FROM cache_entries
+                    )
+                ''')
+        if removed:
+            self.memory_cache.clear()
+        metrics.count('cache.evicted', removed)
+        return removed
+
+    def replace_quest_work(self, rows: Iterable[Tuple[str, str, str, str]]):
+        """用rows替换全部任务书工作翻译，rows为(key, origin, ref, target)"""
+        with self.write() as conn:
+            conn.execute('DELETE FROM quest_work')
+            conn.executemany('INSERT INTO quest_work (key, origin, ref, target) VALUES (?, ?, ?, ?)', rows)
+
+    def replace_quest_fine(self, rows: Iterable[Tuple[str, str]]):
+        """用rows替换全部任务书精细翻译，rows为(key, value)"""
+        with self.write() as conn:
+            conn.execute('DELETE FROM quest_fine')
+            conn.executemany('INSERT INTO quest_fine (key, value) VALUES (?, ?)', rows)
+
+    def update_quest_targets(self, rows: Iterable[Tuple[str, str]]) -> int:
+        """只更新指定条目的译文，rows为(key, target)，返回更新的条目数"""
+        with self.write() as conn:
+            return conn.executemany('UPDATE quest_work SET target = ? WHERE key = ?',
+                                    ((target, key) for key, target in rows)).rowcount
+
+    def iter_quest_work(self, pending_only: bool = False) -> Iterator[Tuple[str, str, str, str]]:
+        """按写入顺序读取工作翻译(key, origin, ref, target)，pending_only时只读取没有译文的条目"""
+        where = "WHERE target = ''" if pending_only else ''
+        return self.reader().execute(f'SELECT key, origin, ref, target FROM quest_work {where} ORDER BY rowid')
+
+    def iter_quest_fine(self) -> Iterator[Tuple[str, str]]:
+        """按写入顺序读取精细翻译(key, value)"""
+        return self.reader().execute('SELECT key, value FROM quest_fine ORDER BY rowid')
+
+    def record_usage(self, run_id: str, model: str, prompt_tokens: int, completion_tokens: int,
+                     estimated_tokens: int, latency: float, mods: List[Tuple[str, int, int]],
+                     cached_tokens: int = 0, batch_turnaround: float | None = None):
+        """记录一个LLM请求的用量，mods为(modid, 条目数, 字符数)，批处理结果传入batch_turnaround"""
+        with self.write() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO llm_usage (run_id, model, created_at, items, chars, prompt_tokens,
+                                       completion_tokens, estimated_tokens, latency, cached_tokens,
+                                       batch_turnaround)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (run_id, model, time.time(), sum(m[1] for m in mods), sum(m[2] for m in mods),
+                  prompt_tokens, completion_tokens, estimated_tokens, latency, cached_tokens,
+                  batch_turnaround))
+            usage_id = cursor.lastrowid
+            cursor.executemany('''
+                INSERT INTO llm_usage_mods (usage_id, modid, items, chars) VALUES (?, ?, ?, ?)
+            ''', [(usage_id, *m) for m in mods])
+
+    def get_usage_summary(self, group_by: str, run_id: str | None = None) -> List[Tuple]:
+        """按run、model或modid汇总用量
+
+        返回(分组, 请求数, 条目数, 输入token, 输出token, 命中缓存的输入token, 平均延迟)，按mod汇总时
+        请求的token按各mod的字符数占比分摊，平均延迟为None；批处理结果没有延迟，不计入平均延迟，
+        分组中全是批处理结果时平均延迟为None
+        """
+        where = 'WHERE u.run_id = ?' if run_id else ''
+        params = (run_id,) if run_id else ()
+        cursor = self.reader().cursor()
+        if group_by == 'modid':
+            cursor.execute(f'''
+                SELECT m.modid, COUNT(*), SUM(m.items),
+                       CAST(ROUND(SUM(u.prompt_tokens * m.chars * 1.0 / MAX(u.chars, 1))) AS INTEGER),
+                       CAST(ROUND(SUM(u.completion_tokens * m.chars * 1.0 / MAX(u.chars, 1))) AS INTEGER),
+                       CAST(ROUND(SUM(u.cached_tokens * m.chars * 1.0 / MAX(u.chars, 1))) AS INTEGER),
+                       NULL
+                FROM llm_usage_mods m JOIN llm_usage u ON u.id = m.usage_id
+                {where}
+                GROUP BY m.modid
+                ORDER BY 4 DESC
+            ''', params)
+        elif group_by in ('run_id', 'model'):
+            cursor.execute(f'''
+                SELECT u.{group_by}, COUNT(*), SUM(u.items), SUM(u.prompt_tokens),
+                       SUM(u.completion_tokens), SUM(u.cached_tokens),
+                       AVG(CASE WHEN u.batch_turnaround IS NULL THEN u.latency END)
+                FROM llm_usage u
+                {where}
+                GROUP BY u.{group_by}
+                ORDER BY MIN(u.id)
+            ''', params)
+        else:
+            raise ValueError(f"不支持的分组方式: {group_by}")
+        return cursor.fetchall()
+
+    def get_token_ratio(self, model: str, recent: int = 200) -> float | None:
+        """最近若干请求中实际输入token与估算值之比，没有记录时返回None"""
+        cursor = self.reader().cursor()
+        cursor.execute('''
+            SELECT SUM(prompt_tokens), SUM(estimated_tokens) FROM (
+                SELECT prompt_tokens, estimated_tokens FROM llm_usage
+                WHERE model = ? AND estimated_tokens > 0 AND prompt_tokens > 0
+                ORDER BY id DESC LIMIT ?
+            )
+        ''', (model, recent))
+        actual, estimated = cursor.fetchone()
+        return actual / estimated if actual and estimated else None
+
+    def maintain(self, vacuum: bool = False):
+        """数据库维护：更新统计信息，可选VACUUM整理文件"""
+        with self.write() as conn:
+            conn.execute('ANALYZE')
+            conn.execute('PRAGMA optimize')
+            if vacuum:
+                conn.execute('VACUUM')
+            # WAL模式下把日志写回主文件并截断
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
     def close(self):
         """关闭数据库连接"""
-        self.conn.close()
+        self.connections.close()
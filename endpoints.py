@@ -0,0 +1,152 @@
+"""多个OpenAI兼容接口之间分配翻译请求
+
+[LLM] endpoints 列出要使用的接口名，每个接口的配置在 [LLM.接口名] 节中：
+    api_base、api_key、model   未设置时使用[LLM]中的值
+    weight                     吞吐量权重，默认1，越大分到的请求越多
+    parallel_requests          该接口的并发数，默认使用[LLM]中的值
+    rpm、tpm                   该接口的速率限制，默认不限制
+接口名 default 表示[LLM]本身（与任务书翻译共用额度）。endpoints为空时只使用[LLM]。
+
+分配时在有空闲并发的接口中选择预计完成最早的：(在途请求数 + 1) * 平均延迟 / 权重。
+请求失败的接口冷却一段时间，期间的请求转到其他接口；所有接口都在冷却时等待最早的冷却结束，
+只有一个请求已经试过所有接口时才放弃。
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import List
+
+from config import getConfig
+from metrics import metrics
+from scheduler import RequestScheduler, get_scheduler
+
+DEFAULT_ENDPOINT = 'default'
+# 平均延迟的平滑系数
+_LATENCY_ALPHA = 0.3
+# 连续失败次数达到该值后冷却，冷却时长（秒）
+_FAILURES_BEFORE_COOLDOWN = 2
+_COOLDOWN_SECONDS = 30.0
+# 所有接口都没有空闲并发时的轮询间隔（秒）
+_POLL_INTERVAL = 0.05
+
+
+class NoEndpointAvailable(Exception):
+    """所有接口都已尝试过或处于冷却中"""
+
+
+@dataclass(eq=False)
+class Endpoint:
+    name: str
+    api_base: str
+    api_key: str
+    model: str
+    weight: float
+    scheduler: RequestScheduler
+    active: int = 0
+    latency: float | None = None        # 成功请求延迟的指数平均
+    failures: int = 0                   # 连续失败次数
+    cooldown_until: float = 0.0
+    stats: dict = field(default_factory=lambda: {'requests': 0, 'failures': 0})
+
+    @property
+    def url(self) -> str:
+        return f'{self.api_base}/v1/chat/completions'
+
+    @property
+    def headers(self) -> dict:
+        return {'Authorization': f'Bearer {self.api_key}', 'Content-Type': 'application/json'}
+
+    def available(self, now: float) -> bool:
+        return now >= self.cooldown_until and self.scheduler.has_capacity()
+
+    def expected_finish(self, default_latency: float) -> float:
+        return (self.active + 1) * (self.latency or default_latency) / self.weight
+
+    def record_success(self, latency: float):
+        self.failures = 0
+        self.latency = latency if self.latency is None else \
+            (1 - _LATENCY_ALPHA) * self.latency + _LATENCY_ALPHA * latency
+        metrics.record_time(f'llm.endpoint.{self.name}', latency)
+
+    def record_failure(self, allow_cooldown: bool = True):
+        self.failures += 1
+        self.stats['failures'] += 1
+        metrics.count(f'llm.endpoint.{self.name}.failures')
+        if allow_cooldown and self.failures >= _FAILURES_BEFORE_COOLDOWN:
+            self.cooldown_until = time.monotonic() + _COOLDOWN_SECONDS
+            print(f"接口 {self.name} 连续失败 {self.failures} 次，{_COOLDOWN_SECONDS:.0f}秒内不再分配请求")
+
+
+def _endpoint_from_config(name: str) -> Endpoint:
+    section = 'LLM' if name == DEFAULT_ENDPOINT else f'LLM.{name}'
+    return Endpoint(
+        name=name,
+        api_base=getConfig(section, 'api_base', getConfig('LLM', 'api_base')),
+        api_key=getConfig(section, 'api_key', getConfig('LLM', 'api_key')),
+        model=getConfig(section, 'model', getConfig('LLM', 'model')),
+        weight=float(getConfig(section, 'weight', '1')),
+        scheduler=get_scheduler(section),
+    )
+
+
+class EndpointPool:
+    def __init__(self, endpoints: List[Endpoint]):
+        if not endpoints:
+            raise ValueError("至少需要一个接口")
+        self.endpoints = endpoints
+
+    @classmethod
+    def from_config(cls) -> 'EndpointPool':
+        names = [name.strip() for name in getConfig('LLM', 'endpoints', '').split(',') if name.strip()]
+        return cls([_endpoint_from_config(name) for name in names or [DEFAULT_ENDPOINT]])
+
+    @property
+    def total_concurrency(self) -> int:
+        return sum(endpoint.scheduler.max_concurrency for endpoint in self.endpoints)
+
+    def _choose(self, exclude: set) -> Endpoint | None:
+        """在有空闲并发的接口中选择预计完成最早的，都没有空闲时返回None"""
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints if e not in exclude and e.available(now)]
+        if not candidates:
+            # 冷却中的接口等冷却结束后还能使用，只有全部接口都被本次请求试过时才放弃
+            if all(e in exclude for e in self.endpoints):
+                raise NoEndpointAvailable("没有可用的接口")
+            return None
+        known = [e.latency for e in self.endpoints if e.latency is not None]
+        # 没有延迟数据的接口按已知的最快接口估计，保证每个接口都能被尝试
+        default_latency = min(known) if known else 1.0
+        return min(candidates, key=lambda e: e.expected_finish(default_latency))
+
+    async def acquire(self, exclude: set) -> Endpoint:
+        """等待并选出一个接口，调用方用完后调用release"""
+        while True:
+            endpoint = self._choose(exclude)
+            if endpoint is not None:
+                endpoint.active += 1
+                endpoint.stats['requests'] += 1
+                metrics.count(f'llm.endpoint.{endpoint.name}.requests')
+                return endpoint
+            await asyncio.sleep(self._wait_time(exclude))
+
+    def record_failure(self, endpoint: Endpoint):
+        """记录接口失败，没有其他不在冷却中的接口时不冷却，冷却只会让请求空等"""
+        now = time.monotonic()
+        others = any(e is not endpoint and now >= e.cooldown_until for e in self.endpoints)
+        endpoint.record_failure(allow_cooldown=others)
+
+    def _wait_time(self, exclude: set) -> float:
+        """没有可选接口时的等待时间：都在冷却时等到最早的冷却结束（最多1秒后再检查），否则轮询"""
+        now = time.monotonic()
+        remaining = [e.cooldown_until - now for e in self.endpoints if e not in exclude]
+        if remaining and all(r > 0 for r in remaining):
+            return min(max(min(remaining), _POLL_INTERVAL), 1.0)
+        return _POLL_INTERVAL
+
+    def release(self, endpoint: Endpoint):
+        endpoint.active -= 1
+
+    def summary(self) -> str:
+        return '，'.join(f"{e.name}: {e.stats['requests']}次请求/{e.stats['failures']}次失败"
+                        + (f"/平均{e.latency:.2f}s" if e.latency is not None else '')
+                        for e in self.endpoints)
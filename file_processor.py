@@ -1,149 +1,266 @@
 import zipfile
 import json
+import io
 import time
 from pathlib import Path
 from database import Database
+from json_stream import iter_object_items, iter_lang_items
+from zip_index import JarIndex, ZipEntry
+import mod_metadata
+from itertools import islice
+from typing import Any, Callable, Iterable, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from config import getConfig
+from metrics import metrics
 import shutil
 import os
 import tempfile
 
+# jar中需要处理的语言文件及是否为中文，按顺序处理（英文先插入词条）
+LANG_FILES = {
+    'en_us.json': False,
+    'zh_cn.json': True,
+}
+
+# 流式解析lang文件时，每积累这么多条词条写入一次数据库
+WRITE_BATCH_SIZE = 2000
+
+
+def _write_in_batches(entries: Iterable[Tuple[str, Any]],
+                      write: Callable[[List[Tuple[str, str]]], None]) -> int:
+    """将键值对按批次交给write写入，跳过非字符串的值，返回写入条数"""
+    entries = iter(entries)
+    written = 0
+    while chunk := list(islice(entries, WRITE_BATCH_SIZE)):
+        rows = [(key, value) for key, value in chunk if isinstance(value, str)]
+        write(rows)
+        written += len(rows)
+    return written
+
+
+# 资源包中每个并行任务处理的语言文件数
+PACK_TASK_SIZE = 16
+
+# 资源包解析子进程各自持有的ZipFile
+_pack_zip: zipfile.ZipFile | None = None
+
+
+def _read_pack_member(zip_file: zipfile.ZipFile, name: str) -> Tuple[List[Tuple[str, str]] | None, str | None]:
+    """解析资源包中的一个语言文件，返回(词条, 错误信息)"""
+    try:
+        file_info = zip_file.getinfo(name)
+        with zip_file.open(file_info) as f:
+            rows = [(key, value) for key, value in iter_lang_items(f, file_info.file_size)
+                    if isinstance(value, str)]
+        return rows, None
+    except json.JSONDecodeError as e:
+        return None, f"错误: {name} 不是有效的JSON文件: {str(e)}"
+    except Exception as e:
+        return None, f"处理资源包语言文件 {name} 时出错: {str(e)}"
+
+
+def _init_pack_worker(pack_path: str):
+    """子进程初始化：打开自己的资源包文件句柄"""
+    global _pack_zip
+    _pack_zip = zipfile.ZipFile(pack_path, 'r')
+
+
+def _read_pack_task(names: List[str]) -> List[Tuple[str, List[Tuple[str, str]] | None, str | None]]:
+    """子进程任务：解析一组语言文件，返回(文件名, 词条, 错误信息)列表"""
+    return [(name, *_read_pack_member(_pack_zip, name)) for name in names]
+
+
 class FileProcessor:
-    def __init__(self, mods_dir: str):
+    def __init__(self, mods_dir: str, db: Database | None = None):
         self.mods_dir = mods_dir
-        self.db = Database()
+        self.db = db or Database()
+        # 解析资源包的进程数
+        self.workers = int(getConfig('MOD', 'workers', '0')) or os.cpu_count() or 1
+
+    def process_mods(self, staged: bool = False) -> Tuple[int, int]:
+        """处理mods目录下的所有jar文件，返回(jar总数, 出错的jar数)
 
-    def process_mods(self):
-        """处理mods目录下的所有jar文件"""
-        for jar_file in Path(self.mods_dir).glob('*.jar'):
-            self._process_jar(jar_file)
+        staged为True时每个jar在一个事务中导入，并同时写入暂存的资源包译文和参考翻译，
+        其他线程不会读到只有英文、还没有写入中文的词条
+        """
+        jar_files = sorted(Path(self.mods_dir).glob('*.jar'))
+        errors = 0
+        for i, jar_file in enumerate(jar_files, 1):
+            print(f"正在处理 [{i}/{len(jar_files)}] {jar_file.name}")
+            if staged:
+                with self.db.write():
+                    modids = self._process_jar(jar_file)
+                    self.db.apply_staged(modids)
+            else:
+                modids = self._process_jar(jar_file)
+            if modids is None:
+                errors += 1
+        return len(jar_files), errors
 
-    def _process_jar(self, jar_path: Path):
-        """处理单个jar文件"""
+    def _process_jar(self, jar_path: Path) -> List[str] | None:
+        """处理单个jar文件，返回处理的modid列表，jar无法读取时返回None"""
         try:
-            with zipfile.ZipFile(jar_path, 'r') as jar:
-                # 获取assets目录下的所有modid
-                assets_dir = 'assets/'
-                modids = set()
+            with metrics.timer('jar.open'):
+                jar = JarIndex(jar_path)
+            metrics.count('jar.opened')
+            with metrics.timer('jar.total'), jar:
+                # 只在中央目录中查找 assets/<modid>/lang/ 下的语言文件
+                with metrics.timer('jar.scan'):
+                    lang_files = {}
+                    for entry in jar.iter_entries(b'assets/'):
+                        parts = entry.name.split('/')
+                        if len(parts) == 4 and parts[2] == 'lang' and parts[3] in LANG_FILES:
+                            lang_files.setdefault(parts[1], {})[parts[3]] = entry
                 
-                # 遍历assets目录下的所有子目录
-                for file_info in jar.infolist():
-                    if file_info.filename.startswith(assets_dir):
-                        parts = file_info.filename.split('/')
-                        if len(parts) > 2:  # assets/<modid>/...
-                            modids.add(parts[1])
-                
-                if not modids:
-                    print(f"警告: {jar_path.name} 中没有找到有效的modid")
-                    return
+                if not lang_files:
+                    print(f"警告: {jar_path.name} 中没有找到语言文件")
+                    return []
                     
-                # 为每个modid处理lang文件
-                for modid in modids:
+                versions = mod_metadata.declared_versions(jar) if self.db.shared else {}
+
+                # 为每个modid处理lang文件，先处理英文再处理中文
+                for modid, entries in lang_files.items():
                     try:
-                        # 处理英文lang文件
-                        en_lang_path = f'assets/{modid}/lang/en_us.json'
-                        if en_lang_path in jar.namelist():
-                            self._process_lang_file(jar, modid, en_lang_path, is_chinese=False)
+                        if self.db.shared:
+                            self._process_mod_shared(jar, modid, entries, versions)
                         else:
-                            #print(f"提示: {jar_path.name} 的 {modid} 没有英文语言文件")
-                            pass
-                        
-                        # 处理中文lang文件
-                        zh_lang_path = f'assets/{modid}/lang/zh_cn.json'
-                        if zh_lang_path in jar.namelist():
-                            self._process_lang_file(jar, modid, zh_lang_path, is_chinese=True)
-                        else:
-                            #print(f"提示: {jar_path.name} 的 {modid} 没有中文语言文件")
-                            pass
+                            self._process_mod_lang_files(jar, modid, entries)
                             
                     except Exception as e:
                         print(f"处理 {jar_path.name} 的 {modid} 时出错: {str(e)}")
                         continue
+                return list(lang_files)
                         
         except zipfile.BadZipFile:
+            metrics.count('jar.errors')
             print(f"错误: {jar_path.name} 不是有效的zip文件")
         except Exception as e:
+            metrics.count('jar.errors')
             print(f"处理 {jar_path.name} 时发生未知错误: {str(e)}")
+        return None
+
+    def _process_mod_lang_files(self, jar: JarIndex, modid: str, entries: dict[str, ZipEntry],
+                                mod_version: str | None = None) -> bool:
+        """按LANG_FILES的顺序处理一个modid的语言文件，全部成功时返回True"""
+        ok = True
+        for file_name, is_chinese in LANG_FILES.items():
+            if file_name in entries:
+                ok &= self._process_lang_file(jar, modid, entries[file_name], is_chinese, mod_version)
+        return ok
 
-    def _process_lang_file(self, jar: zipfile.ZipFile, modid: str, file_path: str, is_chinese: bool):
-        """处理单个lang文件"""
+    def _process_mod_shared(self, jar: JarIndex, modid: str, entries: dict[str, ZipEntry],
+                            versions: dict[str, str]):
+        """使用共享词条库处理一个modid：已导入过的版本直接复制，否则解析后写入共享库"""
+        version = mod_metadata.mod_version(versions, modid, entries.values())
+        if self.db.has_shared_version(modid, version):
+            with metrics.timer('shared.import'):
+                count = self.db.import_shared_version(modid, version)
+            metrics.count('shared.reused_mods')
+            metrics.count('shared.reused_entries', count)
+        elif self._process_mod_lang_files(jar, modid, entries, version):
+            # 解析出错时不写入共享库，避免其他整合包复用不完整的词条
+            self.db.publish_shared_version(modid, version)
+        metrics.count('shared.reused_translations', self.db.apply_shared_translations(modid))
+
+    def _process_lang_file(self, jar: JarIndex, modid: str, entry: ZipEntry, is_chinese: bool,
+                           mod_version: str | None = None) -> bool:
+        """处理单个lang文件，边解析边分批写入数据库，出错时回滚该文件的写入并返回False"""
         try:
-            with jar.open(file_path) as f:
-                try:
-                    content = json.load(f)
-                except json.JSONDecodeError as e:
-                    print(f"错误: {file_path} 不是有效的JSON文件: {str(e)}")
-                    return
-                    
-                try:
+            with metrics.timer('lang.read'):
+                data = jar.read(entry)
+            metrics.observe('lang.file_bytes', len(data))
+            # 解析与写库交替进行，只统计解析器产出词条的时间
+            entries = metrics.timed_iter('lang.parse', iter_lang_items(io.BytesIO(data), len(data)))
+            try:
+                # 一个文件的词条在同一个事务中写入（staged时为jar事务中的SAVEPOINT），解析中途出错时整个文件回滚
+                with self.db.write():
                     if is_chinese:
-                        self._process_chinese_lang(modid, content)
+                        self._process_chinese_lang(modid, entries)
                     else:
-                        self._process_english_lang(modid, content)
-                except Exception as e:
-                    print(f"处理语言文件 {file_path} 时出错: {str(e)}")
+                        self._process_english_lang(modid, entries, mod_version)
+                return True
+            except json.JSONDecodeError as e:
+                metrics.count('lang.errors')
+                print(f"错误: {entry.name} 不是有效的JSON文件: {str(e)}")
+            except Exception as e:
+                metrics.count('lang.errors')
+                print(f"处理语言文件 {entry.name} 时出错: {str(e)}")
                     
         except Exception as e:
-            print(f"打开语言文件 {file_path} 时出错: {str(e)}")
+            print(f"打开语言文件 {entry.name} 时出错: {str(e)}")
+        return False
 
-    def _process_english_lang(self, modid: str, content: dict):
+    def _process_english_lang(self, modid: str, content: Iterable[Tuple[str, Any]],
+                              mod_version: str | None = None):
         """处理英文lang文件内容"""
-        
-        for key, value in content.items():
-            self.db.insert_translation(modid, key, value)
-        
+        metrics.count('lang.en_us_entries', _write_in_batches(
+            content, lambda rows: self.db.insert_translations(modid, rows, mod_version)))
 
-    def _process_chinese_lang(self, modid: str, content: dict):
+    def _process_chinese_lang(self, modid: str, content: Iterable[Tuple[str, Any]]):
         """处理中文lang文件内容"""
-        
-        for key, value in content.items():
-            self.db.update_zhcn1(modid, key, value)
-        
+        metrics.count('lang.zh_cn_entries', _write_in_batches(
+            content, lambda rows: self.db.update_zhcn1_many(modid, rows)))
 
     def close(self):
         """关闭数据库连接"""
         self.db.close()
 
-    def process_resource_pack(self, pack_path: Path):
-        """处理汉化资源包文件"""
+    def process_resource_pack(self, pack_path: Path, stage: bool = False):
+        """处理汉化资源包文件
+
+        语言文件分组后交给多个子进程解压和解析，各进程打开自己的文件句柄，
+        解析结果回到当前进程统一写入数据库。stage为True时只暂存到临时表，
+        由之后导入jar时的apply_staged写入
+        """
+        write = self.db.stage_pack_translations if stage else self.db.update_zhcn2_many
         try:
-            with zipfile.ZipFile(pack_path, 'r') as zip_file:
-                # 遍历所有文件找到中文语言文件
-                for file_info in zip_file.infolist():
-                    if file_info.filename.startswith('assets/') and file_info.filename.endswith('/lang/zh_cn.json'):
-                        parts = file_info.filename.split('/')
-                        if len(parts) >= 4:  # assets/<modid>/lang/zh_cn.json
-                            modid = parts[1]
-                            try:
-                                with zip_file.open(file_info.filename) as f:
-                                    content = json.load(f)
-                                    for key, value in content.items():
-                                        self.db.update_zhcn2(modid, key, value)
-                            except json.JSONDecodeError as e:
-                                print(f"错误: {file_info.filename} 不是有效的JSON文件: {str(e)}")
-                            except Exception as e:
-                                print(f"处理资源包语言文件 {file_info.filename} 时出错: {str(e)}")
+            with metrics.timer('resource_pack.total'), zipfile.ZipFile(pack_path, 'r') as zip_file:
+                # 遍历所有文件找到中文语言文件 assets/<modid>/lang/zh_cn.json
+                names = [file_info.filename for file_info in zip_file.infolist()
+                         if file_info.filename.startswith('assets/')
+                         and file_info.filename.endswith('/lang/zh_cn.json')
+                         and len(file_info.filename.split('/')) >= 4]
+
+                tasks = [names[i:i + PACK_TASK_SIZE] for i in range(0, len(names), PACK_TASK_SIZE)]
+                workers = min(self.workers, len(tasks))
+                if workers <= 1:
+                    results = ([(name, *_read_pack_member(zip_file, name)) for name in task]
+                               for task in tasks)
+                    self._write_pack_results(results, write)
+                else:
+                    with ProcessPoolExecutor(workers, initializer=_init_pack_worker,
+                                             initargs=(str(pack_path),)) as pool:
+                        self._write_pack_results(pool.map(_read_pack_task, tasks), write)
                             
         except zipfile.BadZipFile:
             print(f"错误: {pack_path.name} 不是有效的zip文件")
         except Exception as e:
             print(f"处理资源包 {pack_path.name} 时发生未知错误: {str(e)}")
 
+    def _write_pack_results(self, results: Iterable[List[Tuple[str, List[Tuple[str, str]] | None, str | None]]],
+                            write: Callable[[str, List[Tuple[str, str]]], None]):
+        """按任务顺序将资源包解析结果交给write写入"""
+        for task_results in results:
+            for name, rows, error in task_results:
+                if error:
+                    metrics.count('resource_pack.errors')
+                    print(error)
+                    continue
+                modid = name.split('/')[1]
+                metrics.count('resource_pack.entries', _write_in_batches(
+                    rows, lambda batch: write(modid, batch)))
+
     def process_reference_dat(self, dat_path: Path):
         """处理补充参考文件"""
         try:
             with open(dat_path, 'r', encoding='utf-8') as f:
                 try:
-                    reference_data = json.load(f)
-                    
-                    # 获取数据库中所有条目
-                    cursor = self.db.conn.cursor()
-                    cursor.execute('SELECT modid, key, zhcn2 FROM translations')
-                    
-                    # 对每个数据库条目，检查是否有对应的参考翻译
-                    for row in cursor.fetchall():
-                        modid, key, existing_zhcn2 = row
-                        if existing_zhcn2 is None and key in reference_data:
-                            self.db.update_zhcn2(modid, key, reference_data[key])
+                    # 流式读取参考文件，导入临时表后一次性更新zhcn2为空的同key词条
+                    with metrics.timer('reference.apply'):
+                        loaded, updated = self.db.apply_reference(iter_object_items(f))
+                    metrics.count('reference.loaded', loaded)
+                    metrics.count('reference.updated', updated)
+                    print(f"参考文件 {dat_path.name}: 读取 {loaded} 条参考翻译，更新 {updated} 个词条")
                             
                 except json.JSONDecodeError as e:
                     print(f"错误: {dat_path.name} 不是有效的JSON文件: {str(e)}")
@@ -151,16 +268,31 @@ class FileProcessor:
         except Exception as e:
             print(f"处理参考文件 {dat_path.name} 时发生错误: {str(e)}")
 
+    def stage_reference(self, dat_path: Path):
+        """把补充参考文件导入临时表，由之后导入jar时的apply_staged写入"""
+        try:
+            with open(dat_path, 'r', encoding='utf-8') as f:
+                try:
+                    loaded = self.db.load_reference(iter_object_items(f))
+                    metrics.count('reference.loaded', loaded)
+                    print(f"参考文件 {dat_path.name}: 暂存 {loaded} 条参考翻译")
+
+                except json.JSONDecodeError as e:
+                    print(f"错误: {dat_path.name} 不是有效的JSON文件: {str(e)}")
+
+        except Exception as e:
+            print(f"处理参考文件 {dat_path.name} 时发生错误: {str(e)}")
+
     def generate_language_pack(self, output_path: str = "dist/minecraft-language-pack.zip"):
         """生成整合包汉化资源包"""
         # 创建临时目录
-        with tempfile.TemporaryDirectory() as temp_dir:
+        with metrics.timer('pack_export.total'), tempfile.TemporaryDirectory() as temp_dir:
             # 确保assets目录存在
             assets_dir = Path(temp_dir) / "assets"
             assets_dir.mkdir(exist_ok=True)
             
             # 从数据库获取所有翻译内容
-            cursor = self.db.conn.cursor()
+            cursor = self.db.reader().cursor()
             cursor.execute('''
                 SELECT DISTINCT modid 
                 FROM translations 
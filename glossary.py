@@ -0,0 +1,137 @@
+"""物品和方块名称的术语表，为每个批次找出其中出现的术语
+
+术语取自已有译名的 item.* 和 block.* 词条（zhcn1优先，其次zhcn2），同一原文有多个译名时取最常见的。
+所有术语建成一个Aho-Corasick自动机，一次扫描批次的文本就能找出全部出现的术语，
+只把这些术语随批次发送，不需要在每个请求中附带完整的术语表。
+"""
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from metrics import metrics
+
+# 术语原文的长度范围，太短的容易误匹配，太长的通常是句子而不是名称
+MIN_TERM_LENGTH = 3
+MAX_TERM_LENGTH = 40
+# 含有这些字符的原文是格式化文本，不作为术语
+_FORMAT_CHARS = ('%', '§', '{', '\n')
+# 子节点表的键为 (节点 << _CHAR_BITS) | 字符编码
+_CHAR_BITS = 21
+
+
+class TermIndex:
+    """Aho-Corasick自动机，在文本中找出所有出现的术语（忽略大小写，按单词边界匹配）"""
+
+    def __init__(self, terms: List[str]):
+        self._lengths = [len(term) for term in terms]
+        # 所有节点的子节点放在一个字典中，节点多时比每个节点一个字典省内存
+        self._goto: Dict[int, int] = {}
+        self._fail = [0]
+        self._outputs: List[Tuple[int, ...]] = [()]
+        children: List[List[int]] = [[]]
+        for term_id, term in enumerate(terms):
+            node = 0
+            for char in term:
+                edge = (node << _CHAR_BITS) | ord(char)
+                child = self._goto.get(edge)
+                if child is None:
+                    child = len(self._fail)
+                    self._goto[edge] = child
+                    self._fail.append(0)
+                    self._outputs.append(())
+                    children.append([])
+                    children[node].append(edge)
+                node = child
+            self._outputs[node] += (term_id,)
+
+        # 按层构建失败指针，并把失败指针所指节点的输出合并进来
+        queue = [self._goto[edge] for edge in children[0]]
+        for node in queue:
+            for edge in children[node]:
+                child = self._goto[edge]
+                code = edge & ((1 << _CHAR_BITS) - 1)
+                fail = self._fail[node]
+                while fail and ((fail << _CHAR_BITS) | code) not in self._goto:
+                    fail = self._fail[fail]
+                target = self._goto.get((fail << _CHAR_BITS) | code, 0)
+                self._fail[child] = target if target != child else 0
+                self._outputs[child] += self._outputs[self._fail[child]]
+                queue.append(child)
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def find(self, text: str) -> List[int]:
+        """按首次出现的顺序返回text中出现的术语编号，text需已转为小写"""
+        found = []
+        seen = set()
+        node = 0
+        for end, char in enumerate(text):
+            code = ord(char)
+            while True:
+                child = self._goto.get((node << _CHAR_BITS) | code)
+                if child is not None:
+                    node = child
+                    break
+                if not node:
+                    break
+                node = self._fail[node]
+            for term_id in self._outputs[node]:
+                if term_id not in seen and self._at_boundary(text, end - self._lengths[term_id] + 1, end):
+                    seen.add(term_id)
+                    found.append(term_id)
+        return found
+
+    @staticmethod
+    def _at_boundary(text: str, start: int, end: int) -> bool:
+        """匹配的两端不在单词中间，允许复数形式的结尾s"""
+        if start > 0 and text[start].isalnum() and text[start - 1].isalnum():
+            return False
+        after = end + 1
+        if after < len(text) and text[end].isalnum() and text[after].isalnum():
+            return text[after] == 's' and (after + 1 == len(text) or not text[after + 1].isalnum())
+        return True
+
+
+class Glossary:
+    def __init__(self, entries: Dict[str, str]):
+        self.entries = entries
+        self._terms = list(entries)
+        self.index = TermIndex([term.lower() for term in self._terms])
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[str, str]]) -> 'Glossary':
+        """由(原文, 译名)构建，忽略大小写合并相同的原文，取最常见的译名"""
+        translations: Dict[str, Counter] = defaultdict(Counter)
+        spellings: Dict[str, str] = {}
+        for term, translation in rows:
+            term, translation = term.strip(), translation.strip()
+            if not (MIN_TERM_LENGTH <= len(term) <= MAX_TERM_LENGTH) or not translation or translation == term:
+                continue
+            if any(char in term for char in _FORMAT_CHARS) or not any(char.isalpha() for char in term):
+                continue
+            key = term.lower()
+            spellings.setdefault(key, term)
+            translations[key][translation] += 1
+        return cls({spellings[key]: counter.most_common(1)[0][0] for key, counter in translations.items()})
+
+    @classmethod
+    def from_database(cls, db) -> 'Glossary':
+        return cls.from_rows(db.iter_glossary_terms())
+
+    def lookup(self, texts: Iterable[str], limit: int) -> Dict[str, str]:
+        """texts中出现的术语及其译名，最多limit个，按首次出现的顺序
+
+        被另一个已找到的更长术语包含的术语（如Iron Ingot中的Iron）不单独列出
+        """
+        found = {}
+        for text in texts:
+            for term_id in self.index.find(text.lower()):
+                found.setdefault(self._terms[term_id].lower(), term_id)
+        names = list(found)
+        terms = [self._terms[term_id] for name, term_id in found.items()
+                 if not any(name != other and name in other for other in names)][:limit]
+        metrics.observe('llm.glossary_terms', len(terms))
+        return {term: self.entries[term] for term in terms}
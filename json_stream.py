@@ -0,0 +1,156 @@
+import io
+import json
+import re
+from typing import Any, BinaryIO, Iterator, TextIO, Tuple
+
+# 可选的快速解析后端
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 不超过该大小的lang文件在安装了orjson时整体解析，更大的文件流式解析
+ORJSON_MAX_SIZE = 32 * 1024 * 1024
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = re.compile(r'\s*')
+# 数字被截断时可能紧跟的字符，如 "-1." 会被解析为 -1
+_NUMBER_CONTINUATION = frozenset('.eE+-0123456789')
+
+
+class _StreamReader:
+    """在文本流上分块读取并解析JSON值"""
+
+    def __init__(self, fp: TextIO, chunk_size: int, lenient: bool = False):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.lenient = lenient
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """读取更多内容，已读到文件末尾时返回False"""
+        if self.eof:
+            return False
+        # 单个值超过缓冲区时按缓冲区大小成倍读取，避免反复重试解析
+        chunk = self.fp.read(max(self.chunk_size, len(self.buf) - self.pos))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def error(self, msg: str) -> json.JSONDecodeError:
+        return json.JSONDecodeError(msg, self.buf, self.pos)
+
+    def peek(self) -> str:
+        """跳过空白（宽松模式下还跳过注释），返回下一个字符，到达末尾时返回空字符串"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos >= len(self.buf):
+                if self.fill():
+                    continue
+                return ''
+            if self.lenient and self.buf[self.pos] == '/' and self._skip_comment():
+                continue
+            return self.buf[self.pos]
+
+    def _skip_comment(self) -> bool:
+        """跳过 // 或 /* */ 注释，不是注释时返回False"""
+        while self.pos + 1 >= len(self.buf):
+            if not self.fill():
+                return False
+        opener = self.buf[self.pos:self.pos + 2]
+        if opener not in ('//', '/*'):
+            return False
+        closer = '\n' if opener == '//' else '*/'
+        while True:
+            end = self.buf.find(closer, self.pos + 2)
+            if end >= 0:
+                self.pos = end + len(closer)
+                return True
+            if not self.fill():
+                if opener == '/*':
+                    raise self.error("Unterminated comment")
+                self.pos = len(self.buf)
+                return True
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise self.error(f"Expecting '{char}'")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """解析下一个完整的JSON值"""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # 值被缓冲区截断，读取更多后重试
+                if self.fill():
+                    continue
+                raise
+            # 数字等值恰好位于缓冲区末尾时可能不完整
+            truncated = end == len(self.buf) or (
+                isinstance(value, (int, float)) and self.buf[end] in _NUMBER_CONTINUATION)
+            if truncated and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_object_items(fp: TextIO, chunk_size: int = 1 << 16,
+                      lenient: bool = False) -> Iterator[Tuple[str, Any]]:
+    """流式读取顶层JSON对象的键值对，不需要把整个文件读入内存
+
+    lenient为True时允许顶层的 // 和 /* */ 注释以及最后一项后的逗号
+    """
+    reader = _StreamReader(fp, chunk_size, lenient)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+
+    while True:
+        key = reader.value()
+        if not isinstance(key, str):
+            raise reader.error("Expecting property name enclosed in double quotes")
+        reader.expect(':')
+        yield key, reader.value()
+
+        char = reader.peek()
+        if char == ',':
+            reader.pos += 1
+            if lenient and reader.peek() == '}':
+                return
+        elif char == '}':
+            return
+        else:
+            raise reader.error("Expecting ',' delimiter")
+
+
+def iter_lang_items(fp: BinaryIO, size: int | None = None) -> Iterator[Tuple[str, Any]]:
+    """读取lang文件的键值对
+
+    已知大小不超过ORJSON_MAX_SIZE且安装了orjson时整体解析；
+    否则或orjson解析失败时（带BOM、注释、尾随逗号等）按宽松模式流式解析
+    """
+    if orjson is not None and size is not None and size <= ORJSON_MAX_SIZE:
+        data = fp.read()
+        try:
+            content = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            content = None
+        if isinstance(content, dict):
+            yield from content.items()
+            return
+        fp = io.BytesIO(data)
+
+    text = io.TextIOWrapper(fp, encoding='utf-8-sig')
+    try:
+        yield from iter_object_items(text, lenient=True)
+    finally:
+        # 不关闭调用方的文件对象
+        text.detach()
@@ -1,13 +1,19 @@
 import asyncio
 import aiohttp
+import threading
 from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple, NamedTuple, Dict, Optional
 from dataclasses import dataclass
 from config import getConfig
 from database import Database
+from metrics import metrics
+from endpoints import EndpointPool, NoEndpointAvailable
+from glossary import Glossary
+from scheduler import PRIORITY_MOD, parse_retry_after
 import json
 import os
 import datetime
+import time
 from pathlib import Path
 
 @dataclass
@@ -23,6 +29,37 @@ class TranslationResult(NamedTuple):
     original: str
     translation: str
 
+class Pricing(NamedTuple):
+    prompt: float       # 每百万输入token的价格
+    completion: float   # 每百万输出token的价格
+    currency: str
+    cached: float       # 每百万命中前缀缓存的输入token的价格
+
+    @classmethod
+    def from_config(cls) -> 'Pricing':
+        prompt = getConfig('LLM', 'price_prompt', '0')
+        return cls(float(prompt),
+                   float(getConfig('LLM', 'price_completion', '0')),
+                   getConfig('LLM', 'price_currency', ''),
+                   float(getConfig('LLM', 'price_prompt_cached', prompt)))
+
+    def cost(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+        return ((prompt_tokens - cached_tokens) * self.prompt + cached_tokens * self.cached
+                + completion_tokens * self.completion) / 1_000_000
+
+    def format(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> str:
+        return f"{self.cost(prompt_tokens, completion_tokens, cached_tokens):.4f} {self.currency}".rstrip()
+
+
+def cached_prompt_tokens(usage: dict) -> int:
+    """用量中命中前缀缓存的输入token数，兼容DeepSeek(prompt_cache_hit_tokens)和OpenAI(prompt_tokens_details)的字段"""
+    if 'prompt_cache_hit_tokens' in usage:
+        return usage['prompt_cache_hit_tokens'] or 0
+    return (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+
+# 估算token数的校正系数范围，避免个别异常记录导致批次过大或过小
+TOKEN_RATIO_RANGE = (0.5, 3.0)
+
 class LLMClient:
     # 翻译助手的系统提示词
     SYSTEM_PROMPT = (
@@ -36,7 +73,16 @@ class LLMClient:
         "3. 对于包含<...>、[...]等标签的文本，保持标签的原样，里面的内容可以考虑翻译\n"
         "4. 如果遇到类似 +10 Damage 这样的数值描述，保持数值的原样，Damage这个单词可以翻译\n"
         "5. 使用Minecraft中文社区常用的翻译方式\n"
+        "6. 请求中的glossary是本批文本中出现的物品和方块的已有译名，遇到这些名称时使用给定的译名，"
+        "返回的JSON中不要包含glossary\n"
     )
+    # 少样本示例，(请求, 回答)，作为固定的对话放在系统提示词之后
+    FEW_SHOT_EXAMPLES = [(
+        {"glossary": {"Energy Cell": "能量单元"}, "items": [{"m": "examplemod", "texts": [
+            "Energy Cell", "Stores up to %s FE", "<Shift> for details", "+10 Attack Damage"]}]},
+        {"items": [{"m": "examplemod", "texts": [
+            "能量单元", "最多储存 %s FE", "按住<Shift>查看详情", "+10 攻击伤害"]}]},
+    )]
 
     def __init__(self, db: Database):
         self.api_base = getConfig('LLM', 'api_base')
@@ -44,41 +90,116 @@ class LLMClient:
         self.model = getConfig('LLM', 'model')
         self.max_tokens = int(getConfig('LLM', 'max_tokens'))
         self.parallel_requests = int(getConfig('LLM', 'parallel_requests'))
+        # 可用的接口，配置了多个接口时在途批次数为各接口并发数之和
+        self.endpoints = EndpointPool.from_config()
+        if len(self.endpoints.endpoints) > 1:
+            self.parallel_requests = self.endpoints.total_concurrency
+        # 工作队列：每次领取的条目数、租约时长（秒）、最大尝试次数
+        self.queue_chunk_size = int(getConfig('LLM', 'queue_chunk_size', '500'))
+        self.lease_seconds = float(getConfig('LLM', 'lease_seconds', '1800'))
+        self.max_attempts = int(getConfig('LLM', 'max_attempts', '3'))
+        # 返回429时最多重试的次数，等待时间由Retry-After决定
+        self.rate_limit_retries = int(getConfig('LLM', 'rate_limit_retries', '5'))
+        self.priority = PRIORITY_MOD
+        # 翻译缓存的保留天数和最大条数，0为不限制
+        self.cache_ttl_days = float(getConfig('LLM', 'cache_ttl_days', '0'))
+        self.cache_max_entries = int(getConfig('LLM', 'cache_max_entries', '0'))
         self.db = db
+        # 用量统计：本次运行的标识、价格、已用token和开始时间
+        self.run_id = datetime.datetime.now().strftime('%Y%m%d_%H%M%S') + f'_{os.getpid()}'
+        self.pricing = Pricing.from_config()
+        self.usage_prompt_tokens = 0
+        self.usage_completion_tokens = 0
+        self.usage_cached_tokens = 0
+        self.usage_started = None
+        self.token_ratio = 1.0
+        self._refresh_token_ratio()
+        # 每个请求开头相同的消息：系统提示词、固定术语表和少样本示例，
+        # 逐字节一致才能命中服务商的前缀缓存，缓存部分按更低的价格计费且处理更快
+        self.glossary_path = getConfig('LLM', 'glossary_path', '<none>')
+        self.few_shot = getConfig('LLM', 'few_shot', '1') == '1'
+        self.prompt_prefix = self._build_prompt_prefix()
+        self.prefix_tokens = sum(self._calculate_tokens(m['content']) for m in self.prompt_prefix)
+        # 每个批次附带的术语数上限，0为不附带；分批时按术语的平均长度为其预留token
+        self.glossary_terms = int(getConfig('LLM', 'glossary_terms', '30'))
+        self.glossary: Glossary | None = None
+        self.glossary_reserve_tokens = 0
         
         # 添加日志目录初始化
         self.log_dir = Path('logs')
         self.log_dir.mkdir(exist_ok=True)
 
+    def _refresh_token_ratio(self):
+        """用该模型已记录的实际用量校正token估算"""
+        ratio = self.db.get_token_ratio(self.model)
+        if ratio:
+            low, high = TOKEN_RATIO_RANGE
+            self.token_ratio = min(high, max(low, ratio))
+
+    def _load_glossary(self) -> Dict[str, str]:
+        """读取glossary_path中的固定术语表 {原文: 译名}，未配置或读取失败时为空"""
+        if not self.glossary_path or self.glossary_path == '<none>':
+            return {}
+        try:
+            with open(self.glossary_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"读取术语表失败，不使用术语表: {e}")
+            return {}
+
+    def _build_prompt_prefix(self) -> List[dict]:
+        """构建所有批次共用的消息前缀，内容只取决于配置，术语表按原文排序保证顺序稳定"""
+        system_prompt = self.SYSTEM_PROMPT
+        glossary = self._load_glossary()
+        if glossary:
+            system_prompt += "7. 以下术语使用给定的译名：\n" + ''.join(
+                f"{term} => {translation}\n" for term, translation in sorted(glossary.items()))
+        messages = [{'role': 'system', 'content': system_prompt}]
+        if self.few_shot:
+            for request, response in self.FEW_SHOT_EXAMPLES:
+                messages.append({'role': 'user', 'content': json.dumps(request, ensure_ascii=False)})
+                messages.append({'role': 'assistant', 'content': json.dumps(response, ensure_ascii=False)})
+        return messages
+
+    def refresh_glossary(self):
+        """用数据库中已有译名的物品和方块名称重建术语表"""
+        if self.glossary_terms <= 0:
+            return
+        with metrics.timer('llm.glossary_build'):
+            self.glossary = Glossary.from_database(self.db)
+            if self.glossary:
+                entry_tokens = sum(self._calculate_tokens(f'"{term}": "{translation}", ')
+                                   for term, translation in self.glossary.entries.items()) / len(self.glossary)
+                self.glossary_reserve_tokens = int(min(self.glossary_terms, len(self.glossary)) * entry_tokens
+                                                   + self._calculate_tokens('"glossary": {}, '))
+            else:
+                self.glossary_reserve_tokens = 0
+        print(f"术语表: {len(self.glossary)} 个物品和方块名称")
+
+    def evict_cache(self) -> int:
+        """按配置的保留天数和最大条数淘汰翻译缓存"""
+        removed = self.db.cache_evict(self.cache_ttl_days, self.cache_max_entries)
+        if removed:
+            print(f"已从翻译缓存中淘汰 {removed} 条过期或超量的记录")
+        return removed
+
+    def _print_memory_cache_stats(self):
+        stats = self.db.memory_cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        if lookups:
+            print(f"内存缓存: {stats['size']}/{stats['capacity']} 条，命中率 {stats['hits'] / lookups:.1%}，"
+                  f"淘汰 {stats['evictions']} 条")
+
     def translate_batch(self, items: List[Tuple[str, str, str]], use_cache: bool = True) -> List[TranslationResult]:
         """批量翻译文本条目"""
+        self._refresh_token_ratio()
+        self.refresh_glossary()
         total_items = len(items)
         print(f"\n开始处理 {total_items} 个待翻译条目...")
         
         # 1. 先检查缓存
-        need_translate = []
         results = [None] * total_items
-        
-        if use_cache:
-            cached_count = 0
-            for i, (modid, key, text) in enumerate(items):
-                cached_translation = self.db.get_cached_translation(modid, text)
-                if cached_translation:
-                    cached_count += 1
-                    results[i] = TranslationResult(
-                        modid=modid,
-                        key=key,
-                        original=text,
-                        translation=cached_translation
-                    )
-                else:
-                    need_translate.append(BatchItem(modid, key, text, i))
-            
-            if cached_count > 0:
-                print(f"✓ 从缓存中获取 {cached_count} 个翻译")
-        else:
-            need_translate = [BatchItem(modid, key, text, i) 
-                             for i, (modid, key, text) in enumerate(items)]
+        need_translate = self._split_cached(items, results, use_cache)
 
         # 2. 处理未缓存的条目
         if need_translate:
@@ -90,10 +211,171 @@ class LLMClient:
 
         return [r for r in results if r is not None]
 
+    def _split_cached(self, items: List[Tuple[str, str, str]],
+                      results: List[Optional[TranslationResult]],
+                      use_cache: bool) -> List[BatchItem]:
+        """将命中缓存的条目写入results，返回仍需翻译的条目"""
+        if not use_cache:
+            return [BatchItem(modid, key, text, i)
+                    for i, (modid, key, text) in enumerate(items)]
+
+        need_translate = []
+        cached_count = 0
+        for i, (modid, key, text) in enumerate(items):
+            # 先查其他整合包已翻译过的同一词条，再查本地缓存
+            cached_translation = self.db.shared and self.db.get_shared_translation(modid, key, text)
+            if cached_translation:
+                metrics.count('shared.translation_hits')
+            else:
+                cached_translation = self.db.get_cached_translation(modid, text)
+            if cached_translation:
+                cached_count += 1
+                results[i] = TranslationResult(
+                    modid=modid,
+                    key=key,
+                    original=text,
+                    translation=cached_translation
+                )
+            else:
+                need_translate.append(BatchItem(modid, key, text, i))
+
+        if cached_count > 0:
+            print(f"✓ 从缓存中获取 {cached_count} 个翻译")
+        return need_translate
+
+    def translate_queue(self, status: int, use_cache: bool = True,
+                        producer_done: threading.Event | None = None) -> int:
+        """从数据库工作队列中分块领取词条并翻译，结果直接写入zhcn3，返回写入的条目数
+
+        传入producer_done时，队列暂时为空也会继续等待其他线程导入新词条，直到该事件被设置
+        """
+        self._refresh_token_ratio()
+        self.refresh_glossary()
+        if use_cache:
+            self.evict_cache()
+        translated = asyncio.run(self._process_queue(status, use_cache, producer_done))
+        if use_cache:
+            self._print_memory_cache_stats()
+        if len(self.endpoints.endpoints) > 1:
+            print(f"接口分配: {self.endpoints.summary()}")
+        self.report_exhausted(status)
+        return translated
+
+    def report_exhausted(self, status: int):
+        """提示尝试次数已达上限、不会再被领取的条目数以及恢复方法"""
+        exhausted = self.db.count_exhausted_work(status, self.max_attempts)
+        if exhausted:
+            print(f"注意: {exhausted} 个条目已达到最大尝试次数 {self.max_attempts}，不会再被领取；"
+                  f"排除问题后用 --retry-exhausted 参数运行 translate 或 batch 重新翻译")
+
+    def retry_exhausted(self) -> int:
+        """清零尝试次数已达上限的条目，使其重新进入工作队列"""
+        reset = self.db.reset_work_attempts(self.max_attempts)
+        print(f"已将 {reset} 个达到最大尝试次数的条目重新加入工作队列")
+        return reset
+
+    async def _process_queue(self, status: int, use_cache: bool,
+                             producer_done: threading.Event | None = None) -> int:
+        """边领取边翻译，保持在途批次数量，领取和请求交替进行
+
+        失败的条目保持租约直到本次运行结束才释放，本次运行不会再领取它们，
+        避免一段时间的接口故障在几秒内耗尽所有尝试次数
+        """
+        # 本次运行中失败的条目，和请求没有发出、需要退回尝试次数的条目
+        failed: List[Tuple[str, str]] = []
+        unsent: List[Tuple[str, str]] = []
+        try:
+            translated = await self._claim_and_translate(status, use_cache, producer_done, failed, unsent)
+        finally:
+            await asyncio.to_thread(self.db.release_work, failed)
+            await asyncio.to_thread(self.db.release_work, unsent, True)
+            metrics.count('llm.items_released', len(failed) + len(unsent))
+        if failed or unsent:
+            print(f"{len(failed) + len(unsent)} 个条目翻译失败，已释放租约，下次运行时重新领取")
+        print(f"工作队列处理完成，共写入 {translated} 个翻译")
+        return translated
+
+    async def _claim_and_translate(self, status: int, use_cache: bool,
+                                   producer_done: threading.Event | None,
+                                   failed: List[Tuple[str, str]], unsent: List[Tuple[str, str]]) -> int:
+        """领取并翻译直到队列清空，返回写入的条目数，失败的条目追加到failed和unsent"""
+        translated = 0
+        after = None
+        pending = set()
+        glossary_stale = producer_done is not None
+        async with aiohttp.ClientSession() as session:
+            semaphore = asyncio.Semaphore(self.parallel_requests)
+            while True:
+                # 在途批次足够多时先等待完成一部分，避免过早领取导致租约过期
+                while len(pending) >= self.parallel_requests * 2:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    translated += sum(task.result() for task in done)
+
+                # 领取前记录导入是否已结束，保证结束前提交的词条都能被这次或之后的领取看到
+                finished = producer_done is None or producer_done.is_set()
+                if finished and glossary_stale:
+                    # 开始时导入还没有结束，全部导入后重建一次术语表
+                    glossary_stale = False
+                    await asyncio.to_thread(self.refresh_glossary)
+                items = await asyncio.to_thread(self.db.claim_work, status, self.queue_chunk_size,
+                                                self.lease_seconds, self.max_attempts, after)
+                if not items:
+                    if after is not None:
+                        # 新导入的词条可能排在after之前，从头再找一遍
+                        after = None
+                        continue
+                    if finished:
+                        break
+                    await asyncio.to_thread(producer_done.wait, 1.0)
+                    continue
+                after = items[-1][:2]
+                print(f"\n领取 {len(items)} 个待翻译条目...")
+
+                results = [None] * len(items)
+                need_translate = await asyncio.to_thread(self._split_cached, items, results, use_cache)
+                cached = [(r.modid, r.key, r.translation) for r in results if r is not None]
+                await asyncio.to_thread(self.db.update_zhcn3_many, cached)
+                translated += len(cached)
+                metrics.count('llm.items_claimed', len(items))
+                metrics.count('llm.items_from_cache', len(cached))
+
+                for batch in self._create_batches(need_translate):
+                    pending.add(asyncio.create_task(
+                        self._process_queue_batch(session, semaphore, batch, results, use_cache,
+                                                  failed, unsent)))
+
+            if pending:
+                done, _ = await asyncio.wait(pending)
+                translated += sum(task.result() for task in done)
+        return translated
+
+    async def _process_queue_batch(self, session: aiohttp.ClientSession,
+                                   semaphore: asyncio.Semaphore,
+                                   batch: List[BatchItem],
+                                   results: List[Optional[TranslationResult]],
+                                   use_cache: bool,
+                                   failed: List[Tuple[str, str]],
+                                   unsent: List[Tuple[str, str]]) -> int:
+        """处理工作队列中的一个批次，写入成功的结果，失败的条目记入failed，运行结束时统一释放"""
+        try:
+            await self._process_batch(session, semaphore, batch, results, use_cache)
+        except NoEndpointAvailable as e:
+            # 请求没有发出，释放时退回尝试次数
+            print(f"处理批次时出错: {e}")
+            unsent.extend((item.modid, item.key) for item in batch)
+            return 0
+        finished = [(r.modid, r.key, r.translation)
+                    for r in (results[item.index] for item in batch) if r is not None]
+        failed.extend((item.modid, item.key) for item in batch if results[item.index] is None)
+        await asyncio.to_thread(self.db.update_zhcn3_many, finished)
+        return len(finished)
+
     def _create_batches(self, items: List[BatchItem]) -> List[List[BatchItem]]:
         """根据token限制将条目分成多个批次"""
-        prompt_tokens = self._calculate_tokens(self.SYSTEM_PROMPT)
-        max_batch_tokens = self.max_tokens * 0.5
+        # 固定前缀（系统提示词、固定术语表、少样本示例）和每批附带的术语都计入批次的token
+        prompt_tokens = self.prefix_tokens + self.glossary_reserve_tokens
+        # 估算值按实际用量校正，估算偏低时相应缩小批次
+        max_batch_tokens = self.max_tokens * 0.5 / self.token_ratio
         
         batches = []
         current_batch = []
@@ -158,21 +440,14 @@ class LLMClient:
         """处理单个批次"""
         async with semaphore:
             print(f"开始处理批次（{len(batch)}个条目）...")
+            metrics.observe('llm.batch_size', len(batch))
             try:
                 translations = await self._translate_batch_async(session, batch)
                 
                 # 只检查是否为字符串类型，空字符串也是有效结果
                 if translations and all(isinstance(t, str) for t in translations):
-                    # 更新缓存和结果
+                    # 更新结果，缓存在线程中批量写入，避免阻塞事件循环
                     for item, translation in zip(batch, translations):
-                        if use_cache:
-                            self.db.cache_translation(
-                                modid=item.modid,
-                                key=item.key,
-                                original=item.text,
-                                translation=translation
-                            )
-                        
                         results[item.index] = TranslationResult(
                             modid=item.modid,
                             key=item.key,
@@ -181,12 +456,22 @@ class LLMClient:
                         )
                     
                     if use_cache:
-                        cache_count, earliest_cache = self.db.get_cache_stats()
+                        await asyncio.to_thread(self.db.cache_translations, [
+                            (item.modid, item.key, item.text, translation)
+                            for item, translation in zip(batch, translations)
+                        ])
+                        cache_count, earliest_cache = await asyncio.to_thread(self.db.get_cache_stats)
                         print(f"✓ 已更新缓存，当前共有 {cache_count} 条翻译记录 (最早记录: {earliest_cache})")
+                    metrics.count('llm.batches_succeeded')
                 else:                    
+                    metrics.count('llm.batches_failed')
                     print(f"批次处理失败：存在无效的翻译结果")
                 
+            except NoEndpointAvailable:
+                metrics.count('llm.batches_failed')
+                raise
             except Exception as e:
+                metrics.count('llm.batches_failed')
                 print(f"处理批次时出错: {str(e)}")
 
     async def _translate_batch_async(self, session: aiohttp.ClientSession, 
@@ -196,11 +481,44 @@ class LLMClient:
         timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')
         log_file = self.log_dir / f'llm_request_{timestamp}.log'
         
-        headers = {
-            'Authorization': f'Bearer {self.api_key}',
-            'Content-Type': 'application/json'
-        }
-        
+        data, grouped_items, position_map = self._build_request(batch)
+
+        # 写入请求日志
+        with open(log_file, 'w', encoding='utf-8') as f:
+            f.write("=== LLM Request ===\n")
+            f.write(json.dumps(data, ensure_ascii=False, indent=2))
+            f.write("\n\n")
+
+        try:
+            result, latency, model = await self._post_chat(session, data)
+            await self._record_usage(result.get('usage') or {}, data['messages'], grouped_items, latency, model)
+            return self._parse_translations(result, grouped_items, position_map, len(batch), log_file)
+            
+        except NoEndpointAvailable:
+            raise
+        except Exception as e:
+            metrics.count('llm.request_errors')
+            error_msg = f'批量翻译失败: {str(e)}'
+            print(error_msg)
+            # 写入错误信息
+            with open(log_file, 'a', encoding='utf-8') as f:
+                f.write("=== Error ===\n")
+                f.write(error_msg)
+                f.write("\n")
+            return [None] * len(batch)
+
+    def _batch_glossary(self, batch: List[BatchItem]) -> Dict[str, str]:
+        """本批文本中出现的术语及其译名"""
+        if not self.glossary:
+            return {}
+        return self.glossary.lookup((item.text for item in batch), self.glossary_terms)
+
+    def _build_request(self, batch: List[BatchItem], glossary: Dict[str, str] | None = None
+                       ) -> Tuple[dict, Dict[str, List[str]], Dict[Tuple[str, int], int]]:
+        """构建请求体，返回(请求体, 按modid分组的原文, 每个(modid, 组内序号)在batch中的位置)
+
+        glossary为None时按当前术语表查找本批的术语，重建已提交的请求时传入提交时使用的术语
+        """
         # 按modid分组构建JSON，同时保存每个文本的位置信息
         grouped_items = {}
         position_map = {}  # 记录每个(modid, text_index)对应batch中的位置
@@ -214,18 +532,19 @@ class LLMClient:
             position_map[(item.modid, text_index)] = current_pos
             current_pos += 1
         
-        # 构建JSON格式的翻译请求
-        translation_request = {
-            "items": [
-                {"m": modid, "texts": texts}
-                for modid, texts in grouped_items.items()
-            ]
-        }
+        # 构建JSON格式的翻译请求，附带本批文本中出现的术语
+        if glossary is None:
+            glossary = self._batch_glossary(batch)
+        translation_request = {}
+        if glossary:
+            translation_request["glossary"] = glossary
+        translation_request["items"] = [
+            {"m": modid, "texts": texts}
+            for modid, texts in grouped_items.items()
+        ]
         
-        messages = [{
-            'role': 'system',
-            'content': self.SYSTEM_PROMPT
-        }, {
+        # 可变的待翻译内容放在最后，前面的消息在所有批次中保持不变
+        messages = [*self.prompt_prefix, {
             'role': 'user',
             'content': json.dumps(translation_request, ensure_ascii=False)
         }]
@@ -235,104 +554,180 @@ class LLMClient:
             'messages': messages,
             'max_tokens': self.max_tokens
         }
+        return data, grouped_items, position_map
 
-        # 写入请求日志
-        with open(log_file, 'w', encoding='utf-8') as f:
-            f.write("=== LLM Request ===\n")
-            f.write(json.dumps(data, ensure_ascii=False, indent=2))
+    def _parse_translations(self, result: dict, grouped_items: Dict[str, List[str]],
+                            position_map: Dict[Tuple[str, int], int], count: int,
+                            log_file: Path) -> List[Optional[str]]:
+        """解析chat completion响应并按原批次顺序还原译文，无法解析时返回全为None的列表"""
+        # 写入响应日志
+        with open(log_file, 'a', encoding='utf-8') as f:
+            f.write("=== LLM Response ===\n")
+            f.write(json.dumps(result, ensure_ascii=False, indent=2))
             f.write("\n\n")
 
-        try:
-            async with session.post(f'{self.api_base}/v1/chat/completions',
-                                  headers=headers,
-                                  json=data) as response:
-                response.raise_for_status()
-                result = await response.json()
-                
-                # 写入响应日志
-                with open(log_file, 'a', encoding='utf-8') as f:
-                    f.write("=== LLM Response ===\n")
-                    f.write(json.dumps(result, ensure_ascii=False, indent=2))
-                    f.write("\n\n")
+        response_text = result['choices'][0]['message']['content'].strip()
+        
+        # 处理响应文本...
+        if response_text.startswith('```json'):
+            response_text = response_text[7:]
+        if response_text.endswith('```'):
+            response_text = response_text[:-3]
+        response_text = response_text.strip()
 
-                response_text = result['choices'][0]['message']['content'].strip()
+        try:
+            response_json = json.loads(response_text)
+            
+            # 添加详细的调试日志
+            with open(log_file, 'a', encoding='utf-8') as f:
+                f.write("\n=== Debug Information ===\n")
+                # 记录原始请求中每个modid的条目数量
+                f.write("Original Request Items Count:\n")
+                for modid, texts in grouped_items.items():
+                    f.write(f"ModID: {modid}, Items: {len(texts)}\n")
+                    f.write("Texts:\n")
+                    for i, text in enumerate(texts):
+                        f.write(f"  {i}: {text}\n")
                 
-                # 处理响应文本...
-                if response_text.startswith('```json'):
-                    response_text = response_text[7:]
-                if response_text.endswith('```'):
-                    response_text = response_text[:-3]
-                response_text = response_text.strip()
-
-                try:
-                    response_json = json.loads(response_text)
-                    
-                    # 添加详细的调试日志
-                    with open(log_file, 'a', encoding='utf-8') as f:
-                        f.write("\n=== Debug Information ===\n")
-                        # 记录原始请求中每个modid的条目数量
-                        f.write("Original Request Items Count:\n")
-                        for modid, texts in grouped_items.items():
-                            f.write(f"ModID: {modid}, Items: {len(texts)}\n")
-                            f.write("Texts:\n")
-                            for i, text in enumerate(texts):
-                                f.write(f"  {i}: {text}\n")
-                        
-                        # 记录响应中每个modid的条目数量
-                        f.write("\nResponse Items Count:\n")
-                        for group in response_json["items"]:
-                            modid = group["m"]
-                            texts = group["texts"]
-                            f.write(f"ModID: {modid}, Items: {len(texts)}\n")
-                            f.write("Translations:\n")
-                            for i, text in enumerate(texts):
-                                f.write(f"  {i}: {text}\n")
-                        
-                        # 检查并记录任何不匹配
-                        f.write("\nMismatch Check:\n")
-                        for group in response_json["items"]:
-                            modid = group["m"]
-                            original_count = len(grouped_items.get(modid, []))
-                            response_count = len(group["texts"])
-                            if original_count != response_count:
-                                f.write(f"WARNING: Count mismatch for {modid}!\n")
-                                f.write(f"  Original: {original_count}, Response: {response_count}\n")
-                    
-                    # 写入解析后的翻译结果
-                    with open(log_file, 'a', encoding='utf-8') as f:
-                        f.write("=== Parsed Translations ===\n")
-                        f.write(json.dumps(response_json, ensure_ascii=False, indent=2))
-                        f.write("\n")
-                    
-                    # 还原顺序的代码保持不变...
-                    translations = [None] * len(batch)
-                    for group in response_json["items"]:
-                        modid = group["m"]
-                        for i, translation in enumerate(group["texts"]):
-                            original_pos = position_map[(modid, i)]
-                            translations[original_pos] = translation
-                    
-                    return translations
-                    
-                except (json.JSONDecodeError, KeyError, TypeError) as e:
-                    error_msg = f"解析翻译响应失败: {str(e)}{response_text}"
-                    print(error_msg)
-                    # 写入错误信息
-                    with open(log_file, 'a', encoding='utf-8') as f:
-                        f.write("=== Error ===\n")
-                        f.write(error_msg)
-                        f.write("\n")
-                    return [None] * len(batch)
+                # 记录响应中每个modid的条目数量
+                f.write("\nResponse Items Count:\n")
+                for group in response_json["items"]:
+                    modid = group["m"]
+                    texts = group["texts"]
+                    f.write(f"ModID: {modid}, Items: {len(texts)}\n")
+                    f.write("Translations:\n")
+                    for i, text in enumerate(texts):
+                        f.write(f"  {i}: {text}\n")
                 
-        except Exception as e:
-            error_msg = f'批量翻译失败: {str(e)}'
+                # 检查并记录任何不匹配
+                f.write("\nMismatch Check:\n")
+                for group in response_json["items"]:
+                    modid = group["m"]
+                    original_count = len(grouped_items.get(modid, []))
+                    response_count = len(group["texts"])
+                    if original_count != response_count:
+                        f.write(f"WARNING: Count mismatch for {modid}!\n")
+                        f.write(f"  Original: {original_count}, Response: {response_count}\n")
+            
+            # 写入解析后的翻译结果
+            with open(log_file, 'a', encoding='utf-8') as f:
+                f.write("=== Parsed Translations ===\n")
+                f.write(json.dumps(response_json, ensure_ascii=False, indent=2))
+                f.write("\n")
+            
+            # 还原顺序的代码保持不变...
+            translations = [None] * count
+            for group in response_json["items"]:
+                modid = group["m"]
+                for i, translation in enumerate(group["texts"]):
+                    original_pos = position_map[(modid, i)]
+                    translations[original_pos] = translation
+            
+            return translations
+            
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            metrics.count('llm.invalid_responses')
+            error_msg = f"解析翻译响应失败: {str(e)}{response_text}"
             print(error_msg)
             # 写入错误信息
             with open(log_file, 'a', encoding='utf-8') as f:
                 f.write("=== Error ===\n")
                 f.write(error_msg)
                 f.write("\n")
-            return [None] * len(batch)
+            return [None] * count
+
+    async def _post_chat(self, session: aiohttp.ClientSession, data: dict) -> Tuple[dict, float, str]:
+        """选择接口并经其调度器放行后发送请求，返回(响应, 延迟, 模型)
+
+        429时暂停该接口的调度器，按Retry-After重试或转到其他有空闲的接口；
+        连接失败、超时或5xx时换一个接口重试，所有接口都失败后抛出最后的错误
+        """
+        prompt_tokens = int(sum(self._calculate_tokens(m['content']) for m in data['messages']) * self.token_ratio)
+        # 翻译的输出和输入的待翻译部分长度相近，按输入的两倍预留
+        reserved = min(prompt_tokens * 2, prompt_tokens + self.max_tokens)
+        failed = set()
+        rate_limited = 0
+        last_error: Exception | None = None
+        while True:
+            try:
+                endpoint = await self.endpoints.acquire(failed)
+            except NoEndpointAvailable:
+                if last_error is None:
+                    raise
+                raise last_error
+            try:
+                async with endpoint.scheduler.request_async(reserved, self.priority) as grant:
+                    request_start = time.perf_counter()
+                    if self.usage_started is None:
+                        self.usage_started = request_start
+                    async with session.post(endpoint.url, headers=endpoint.headers,
+                                            json={**data, 'model': endpoint.model}) as response:
+                        metrics.count(f'llm.http_{response.status}')
+                        if response.status == 429 and rate_limited < self.rate_limit_retries:
+                            rate_limited += 1
+                            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                            grant.used_tokens = 0
+                            endpoint.scheduler.pause(retry_after)
+                            metrics.count('llm.retries')
+                            print(f"接口 {endpoint.name} 请求过于频繁(429)，{retry_after:.1f}秒后重试")
+                            continue
+                        response.raise_for_status()
+                        result = await response.json()
+                    latency = time.perf_counter() - request_start
+                    usage = result.get('usage') or {}
+                    if 'total_tokens' in usage:
+                        grant.used_tokens = usage['total_tokens']
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                last_error = e
+            except aiohttp.ClientResponseError as e:
+                if e.status < 500:
+                    raise
+                last_error = e
+            else:
+                endpoint.record_success(latency)
+                metrics.record_time('llm.request', latency)
+                return result, latency, endpoint.model
+            finally:
+                self.endpoints.release(endpoint)
+            self.endpoints.record_failure(endpoint)
+            failed.add(endpoint)
+            metrics.count('llm.failovers')
+            print(f"接口 {endpoint.name} 请求失败: {last_error}，尝试其他接口")
+
+    async def _record_usage(self, usage: dict, messages: List[dict],
+                            grouped_items: Dict[str, List[str]], latency: float, model: str,
+                            batch_turnaround: float | None = None):
+        """记录接口返回的用量并输出累计用量、速度和估计费用
+
+        批处理任务的结果在服务商处理完后才取回，没有开始时间（usage_started为None），不输出速度，
+        也没有单个请求的延迟，latency传0，任务从提交到完成的时间记在batch_turnaround中
+        """
+        prompt_tokens = usage.get('prompt_tokens') or 0
+        completion_tokens = usage.get('completion_tokens') or 0
+        cached_tokens = cached_prompt_tokens(usage)
+        metrics.count('llm.tokens_in', prompt_tokens)
+        metrics.count('llm.tokens_out', completion_tokens)
+        metrics.count('llm.tokens_cached', cached_tokens)
+        if not prompt_tokens and not completion_tokens:
+            return
+
+        estimated = sum(self._calculate_tokens(m['content']) for m in messages)
+        mods = [(modid, len(texts), sum(len(t) for t in texts)) for modid, texts in grouped_items.items()]
+        await asyncio.to_thread(self.db.record_usage, self.run_id, model, prompt_tokens,
+                                completion_tokens, estimated, latency, mods, cached_tokens,
+                                batch_turnaround)
+
+        self.usage_prompt_tokens += prompt_tokens
+        self.usage_completion_tokens += completion_tokens
+        self.usage_cached_tokens += cached_tokens
+        speed_text = ''
+        if self.usage_started is not None:
+            elapsed = time.perf_counter() - self.usage_started
+            speed = (self.usage_prompt_tokens + self.usage_completion_tokens) / elapsed if elapsed > 0 else 0
+            speed_text = f"{speed:.0f} tokens/s，"
+        print(f"用量: 输入 {self.usage_prompt_tokens}（缓存命中 {self.usage_cached_tokens}）"
+              f" / 输出 {self.usage_completion_tokens} tokens，{speed_text}估计费用 "
+              f"{self.pricing.format(self.usage_prompt_tokens, self.usage_completion_tokens, self.usage_cached_tokens)}")
 
     def _calculate_tokens(self, text: str) -> int:
         """计算文本的token数量"""
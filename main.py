@@ -1,15 +1,28 @@
+import hashlib
 import json
 import os
+import re
 import sys
+import tempfile
 import time
 import ftb_snbt_lib as slib
 import ui
 from collections import deque
 import config as conf
+import quest_staging
+import scheduler
+from database import Database
+from metrics import metrics
 
 # 全局变量存储主窗口实例
 window = None
 
+# 任务文本在翻译缓存中使用的modid，和mod词条共用同一个缓存
+QUEST_CACHE_MODID = 'ftbquests'
+
+# 语言树路径中的一段：['名称'] 或 [下标]
+LANG_KEY_PART_PATTERN = re.compile(r"\['((?:[^']|'(?!\]))*)'\]|\[(\d+)\]")
+
 if conf.getDefaultConfig('dev_mode') == '1':
     DEVELOPMENT_MODE = True
 else:
@@ -38,6 +51,149 @@ def extractLangMapFromLangTree(langTree):
     return langMap
 
 
+def parseLangKey(key):
+    """把 extractLangMapFromLangTree 生成的键解析为路径列表，如 "['a'][0]" -> ['a', 0]"""
+    path = []
+    position = 0
+    while position < len(key):
+        match = LANG_KEY_PART_PATTERN.match(key, position)
+        if not match:
+            raise ValueError(f"无法解析的语言键: {key}")
+        name, index = match.groups()
+        path.append(name if index is None else int(index))
+        position = match.end()
+    return path
+
+
+def setLangValue(langTree, path, value):
+    """按路径设置语言树中的字符串，路径在树中不存在时返回False"""
+    node = langTree
+    try:
+        for part in path[:-1]:
+            node = node[part]
+        if isinstance(path[-1], int) and path[-1] >= len(node):
+            return False
+        if isinstance(path[-1], str) and path[-1] not in node:
+            return False
+        node[path[-1]] = slib.String(value)
+    except (KeyError, IndexError, TypeError):
+        return False
+    return True
+
+
+def resolveLangPath(folder_path, pathConf):
+    """语言文件的实际位置，返回(路径, 是否拆分布局)
+
+    新版FTB Quests把每种语言拆成目录（如 lang/en_us/chapters/*.snbt），此时en_us.snbt不存在而en_us目录存在
+    """
+    path = f"{folder_path}/{pathConf}"
+    splitPath = path[:-len(".snbt")] if path.endswith(".snbt") else path
+    if not os.path.isfile(path) and os.path.isdir(splitPath):
+        return splitPath, True
+    return path, False
+
+
+def listLangFiles(path):
+    """拆分布局目录下所有.snbt文件的相对路径"""
+    files = []
+    for root, _, names in os.walk(path):
+        for name in names:
+            if name.endswith(".snbt"):
+                files.append(os.path.relpath(os.path.join(root, name), path).replace(os.sep, "/"))
+    return sorted(files)
+
+
+def loadLangTree(path, split):
+    """读取语言树，拆分布局时返回 {相对路径: 语言树}，键的第一段就是文件的相对路径"""
+    if not split:
+        with open(path, "r", encoding="utf-8") as f:
+            return slib.load(f)
+    langTree = {}
+    for relPath in listLangFiles(path):
+        with open(os.path.join(path, relPath), "r", encoding="utf-8") as f:
+            langTree[relPath] = slib.load(f)
+    return langTree
+
+
+def loadTargetLangTree(folder_path, split):
+    """读取中文语言树，文件不存在时返回空树"""
+    targetPath, _ = resolveLangPath(folder_path, getQuestConfig('ftb_lang_target_path'))
+    if split:
+        targetPath = targetPath[:-len(".snbt")] if targetPath.endswith(".snbt") else targetPath
+        return loadLangTree(targetPath, True) if os.path.isdir(targetPath) else {}
+    try:
+        return loadLangTree(targetPath, False)
+    except FileNotFoundError:
+        return slib.Compound()
+
+
+def writeTextAtomic(path, text):
+    """先写临时文件再替换，写入过程中出错不会留下写了一半的文件"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tempPath = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".snbt")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tempPath, path)
+    except BaseException:
+        os.remove(tempPath)
+        raise
+
+
+def readTextOrNone(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def sourceHash(text):
+    """英文原文的哈希，用于判断任务文本在整合包更新后是否变化"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def getQuestConfig(key, fallback=None):
+    """读取[QUEST]中的配置，没有时使用[DEFAULT]中的同名配置"""
+    if fallback is None:
+        return conf.getConfig('QUEST', key)
+    return conf.getConfig('QUEST', key, fallback)
+
+
+def getSourceHashPath():
+    return getQuestConfig('source_hash_path', 'staging/quest_source_hash.json')
+
+
+def getWritebackStatePath():
+    return getQuestConfig('writeback_state_path', 'staging/quest_writeback_state.json')
+
+
+def loadJsonOrEmpty(path):
+    """读取JSON文件，文件不存在时返回空字典"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def saveSourceHashes(enusMap, keys):
+    """记录已写回译文的条目对应的英文原文哈希"""
+    if not keys:
+        return
+    sourceHashPath = getSourceHashPath()
+    sourceHashes = loadJsonOrEmpty(sourceHashPath)
+    for key in keys:
+        if key in enusMap:
+            sourceHashes[key] = sourceHash(enusMap[key])
+    os.makedirs(os.path.dirname(sourceHashPath) or ".", exist_ok=True)
+    with open(sourceHashPath, "w", encoding="utf-8") as f:
+        json.dump(sourceHashes, f, ensure_ascii=False, indent=4)
+
+
 def generateReferenceJson():
     if DEVELOPMENT_MODE:
         folder_path = r"D:\Games\Prism Launcher\instances\All the Mods 10 - ATM10\minecraft"
@@ -48,13 +204,9 @@ def generateReferenceJson():
             window.show_info("提示", "请先选择整合包根目录")
             return
 
-    sourcePathConf = conf.getDefaultConfig('ftb_lang_source_path')
-    targetPathConf = conf.getDefaultConfig('ftb_lang_target_path')
-    sourcePath = f"{folder_path}/{sourcePathConf}"
-    targetPath = f"{folder_path}/{targetPathConf}"
-
-    enusTree = slib.load(open(sourcePath, "r", encoding="utf-8"))
-    zhcnTree = slib.load(open(targetPath, "r", encoding="utf-8"))
+    sourcePath, split = resolveLangPath(folder_path, getQuestConfig('ftb_lang_source_path'))
+    enusTree = loadLangTree(sourcePath, split)
+    zhcnTree = loadTargetLangTree(folder_path, split)
 
     zhcnMap = extractLangMapFromLangTree(zhcnTree)
     enusMap = extractLangMapFromLangTree(enusTree)
@@ -76,7 +228,7 @@ def generateReferenceJson():
                 else:
                     referenceMap[enusMap[key]]['source'].append(key)
 
-    referencePath = conf.getDefaultConfig('reference_path')
+    referencePath = getQuestConfig('reference_path')
     with open(referencePath, "w", encoding="utf-8") as f:
         json.dump(referenceMap, f, ensure_ascii=False, indent=4)
     window.show_info("提示", f"参考翻译已保存到 {referencePath}")
@@ -91,33 +243,46 @@ def generateTemporaryJson():
             window.show_info("提示", "请先选择整合包根目录")
             return
 
-    referencePath = conf.getDefaultConfig('reference_path')
+    referencePath = getQuestConfig('reference_path')
     with open(referencePath, "r", encoding="utf-8") as f:
         referenceMap = json.load(f)
 
-    sourcePathConf = conf.getDefaultConfig('ftb_lang_source_path')
-    targetPathConf = conf.getDefaultConfig('ftb_lang_target_path')
-    sourcePath = f"{folder_path}/{sourcePathConf}"
-    targetPath = f"{folder_path}/{targetPathConf}"
-
-    try:
-        zhcnTree = slib.load(open(targetPath, "r", encoding="utf-8"))
-    except FileNotFoundError:
-        zhcnTree = slib.Compound()
-
-    enusTree = slib.load(open(sourcePath, "r", encoding="utf-8"))
+    sourcePath, split = resolveLangPath(folder_path, getQuestConfig('ftb_lang_source_path'))
+    zhcnTree = loadTargetLangTree(folder_path, split)
+    enusTree = loadLangTree(sourcePath, split)
 
     zhcnMap = extractLangMapFromLangTree(zhcnTree)
     enusMap = extractLangMapFromLangTree(enusTree)
 
+    # 上次写回时各条目英文原文的哈希，以及上次生成的工作文件
+    # 原文变化的条目即使已有中文也重新翻译，原文未变且已有AI译文的条目沿用旧译文
+    staging = quest_staging.open_quest_staging()
+    sourceHashes = loadJsonOrEmpty(getSourceHashPath())
+    previousWorkMap = staging.load_work()
+
     translateMap = {}
     translatedMap = {}
+    changedCount = 0
+    reusedCount = 0
 
     for key, value in enusMap.items():
         if len(value) < 1 or enusMap[key].startswith(
                 "{") and enusMap[key].endswith("}"):
             continue
-        if key not in zhcnMap:
+        changed = key in sourceHashes and sourceHashes[key] != sourceHash(value)
+        previous = previousWorkMap.get(key)
+        if previous and previous['origin'] == value and len(previous['target']) > 0:
+            translateMap[key] = previous
+            reusedCount += 1
+        elif changed:
+            changedCount += 1
+            # 没有参考翻译时把旧译文作为参考，方便校对
+            if value in referenceMap:
+                ref = referenceMap[value]['value']
+            else:
+                ref = zhcnMap.get(key, '')
+            translateMap[key] = {'origin': value, 'ref': ref, 'target': ''}
+        elif key not in zhcnMap:
             if value in referenceMap:
                 if key in referenceMap[value]['source']:
                     translatedMap[key] = referenceMap[value]['value']
@@ -131,24 +296,68 @@ def generateTemporaryJson():
         else:
             translatedMap[key] = zhcnMap[key]
 
-    with open(conf.getDefaultConfig('translate_fine_path'), "w", encoding="utf-8") as f:
-        json.dump(translatedMap, f, ensure_ascii=False, indent=4)
-    with open(conf.getDefaultConfig('translate_work_path'), "w", encoding="utf-8") as f:
-        json.dump(translateMap, f, ensure_ascii=False, indent=4)
-    window.show_info("提示", "文件写入成功")
+    try:
+        staging.save_fine(translatedMap)
+        staging.save_work(translateMap)
+    finally:
+        staging.close()
+    pendingCount = sum(1 for value in translateMap.values() if len(value['target']) < 1)
+    window.show_info("提示", f"文件写入成功，待翻译{pendingCount}条，其中原文有变化{changedCount}条，"
+                           f"沿用已有AI译文{reusedCount}条")
 
 
 def translateWithDeepseek():
-    translateMap = {}
-    translateWorkPath = conf.getDefaultConfig('translate_work_path')
-
+    db = Database()
+    staging = quest_staging.open_quest_staging(db)
     try:
-        with open(translateWorkPath, "r", encoding="utf-8") as f:
-            translateMap = json.load(f)
-    except Exception as e:
-        window.show_info("错误", f"打开文件出现错误{e}")
-        return
+        try:
+            translateMap = staging.load_work()
+        except Exception as e:
+            window.show_info("错误", f"打开文件出现错误{e}")
+            return
+        if not translateMap:
+            window.show_info("提示", f"{staging.location}中没有需要翻译的文本，请先生成工作文件")
+            return
+        translateQuestTexts(translateMap, staging, db)
+    finally:
+        staging.close()
+        db.close()
+
+
+def requestQuestCompletion(client, maxTokens, messages, submitLength):
+    """经共享调度器放行后提交任务书文本，返回429时暂停调度器并按Retry-After重试"""
+    from openai import RateLimitError
+
+    # 按每个token约3字节估算，输出长度与输入相近
+    reserved = min(submitLength // 3 * 2 + 256, submitLength // 3 + maxTokens)
+    retries = int(conf.getConfig('LLM', 'rate_limit_retries', '5'))
+    requestScheduler = scheduler.get_scheduler()
+    for attempt in range(retries + 1):
+        with requestScheduler.request(reserved, scheduler.PRIORITY_QUEST) as grant:
+            try:
+                completion = client.chat.completions.create(
+                    model=conf.getConfig('LLM', 'model'),
+                    max_tokens=maxTokens,
+                    messages=messages
+                )
+            except RateLimitError as e:
+                if attempt >= retries:
+                    raise
+                grant.used_tokens = 0
+                requestScheduler.pause(scheduler.parse_retry_after(e.response.headers.get('Retry-After')))
+                metrics.count('llm.retries')
+                continue
+            if completion.usage is not None:
+                grant.used_tokens = completion.usage.total_tokens
+            return completion
+
 
+def translateQuestTexts(translateMap, staging, db, reporter=None):
+    """翻译工作文件中还没有译文的任务文本，缓存中已有的译文直接使用
+
+    reporter提供write和show_info，默认为主窗口
+    """
+    reporter = reporter or window
     maxTokens = int(conf.getConfig('LLM', 'max_tokens'))
 
     toTranslateString = ""
@@ -157,10 +366,16 @@ def translateWithDeepseek():
 
     bytesUpbound = maxTokens * 3 - 256
     locator = []
+    cachedTargets = {}
 
     for key, value in translateMap.items():
         if len(value['target']) > 0:
             continue
+        cached = db.get_cached_translation(QUEST_CACHE_MODID, value['origin'])
+        if cached:
+            value['target'] = cached
+            cachedTargets[key] = cached
+            continue
         if len(toTranslateString.encode('utf-8')) + \
                 len(value['origin'].encode('utf-8')) > bytesUpbound:
             toTranslateQueue.append(toTranslateString.rstrip("#EOL#"))
@@ -180,12 +395,16 @@ def translateWithDeepseek():
 
     from openai import OpenAI
 
+    # 429由共享调度器统一处理，SDK自身不再重试
     client = OpenAI(
         base_url=conf.getConfig('LLM', 'api_base'),
-        api_key=conf.getConfig('LLM', 'api_key')
+        api_key=conf.getConfig('LLM', 'api_key'),
+        max_retries=0
     )
     
-    window.write("正在启动AI翻译 ... 共有" + str(len(locator)) + "条文本需要翻译")
+    if cachedTargets:
+        reporter.write(f"从缓存中获取了{len(cachedTargets)}条翻译")
+    reporter.write("正在启动AI翻译 ... 共有" + str(len(locator)) + "条文本需要翻译")
     # sleep 1 秒
     time.sleep(1)
 
@@ -194,39 +413,39 @@ def translateWithDeepseek():
         for toTranslateString in toTranslateQueue:
             submitLength = len(toTranslateString.encode('utf-8'))
             remainLength -= submitLength
-            window.write(f"正在提交{submitLength}长度的文本，还剩下{remainLength}请等待...")            
-            completion = client.chat.completions.create(
-                model=conf.getConfig('LLM', 'model'),
-                max_tokens=maxTokens,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": '你是一个Minecraft我的世界游戏任务文本翻译专家，将用户输入的英文翻译成中文。用户可以向助手发送需要翻译的内容，助手会回答相应的翻译结果，并确保符合中文语言习惯以及我的世界游戏的风格。如果内容在花括号{}内，不要翻译，原样输出。如果内容中有类似与&开头的以及\\开头的转义字符，保持对应词不变。'
-                    },
-                    {
-                        "role": "user",
-                        "content": toTranslateString
-                    }
-                ]
-            )
+            reporter.write(f"正在提交{submitLength}长度的文本，还剩下{remainLength}请等待...")            
+            completion = requestQuestCompletion(client, maxTokens, [
+                {
+                    "role": "system",
+                    "content": '你是一个Minecraft我的世界游戏任务文本翻译专家，将用户输入的英文翻译成中文。用户可以向助手发送需要翻译的内容，助手会回答相应的翻译结果，并确保符合中文语言习惯以及我的世界游戏的风格。如果内容在花括号{}内，不要翻译，原样输出。如果内容中有类似与&开头的以及\\开头的转义字符，保持对应词不变。'
+                },
+                {
+                    "role": "user",
+                    "content": toTranslateString
+                }
+            ], submitLength)
             # window.write("返回值：" + completion.choices[0].message.content)
             sectionList = completion.choices[0].message.content.split("#EOL#")
             translatedList.extend(sectionList)
     except Exception as e:
-        window.show_info("错误", f"翻译出现错误，请检查API配置和错误信息\n{e}")
+        staging.update_targets(cachedTargets)
+        reporter.show_info("错误", f"翻译出现错误，请检查API配置和错误信息\n{e}")
         return
 
     if len(translatedList) != len(locator):
-        window.show_info("错误", "翻译失败，翻译结果和原文长度不一致，翻译结果有" + str(len(translatedList)) + "条，原文有" + str(len(locator)) + "条")
+        staging.update_targets(cachedTargets)
+        reporter.show_info("错误", "翻译失败，翻译结果和原文长度不一致，翻译结果有" + str(len(translatedList)) + "条，原文有" + str(len(locator)) + "条")
         return
 
     for i in range(len(locator)):
         translateMap[locator[i]]['target'] = translatedList[i]
+    db.cache_translations([(QUEST_CACHE_MODID, locator[i], translateMap[locator[i]]['origin'], translatedList[i])
+                           for i in range(len(locator))])
 
-    with open(translateWorkPath, "w", encoding="utf-8") as f:
-        json.dump(translateMap, f, ensure_ascii=False, indent=4)
-    window.write("AI翻译成功！")
-    window.show_info("提示", f"翻译成功，翻译结果已经写入{translateWorkPath}文件，你可以手动检查修正")
+    # 只更新本次得到译文的条目
+    staging.update_targets({**cachedTargets, **dict(zip(locator, translatedList))})
+    reporter.write("AI翻译成功！")
+    reporter.show_info("提示", f"翻译成功，翻译结果已经写入{staging.location}，你可以手动检查修正")
 
 
 def writeBackToModpack():
@@ -245,31 +464,82 @@ def writeBackToModpack():
         window.show_info("提示", "未选择文件夹")
         return
 
-    sourcePathConf = conf.getDefaultConfig('ftb_lang_source_path')
-    sourcePath = f"{folder_path}/{sourcePathConf}"
-    sourceTree = slib.load(open(sourcePath, "r", encoding="utf-8"))
-
-    translateWorkPath = conf.getDefaultConfig('translate_work_path')
-    translateFinePath = conf.getDefaultConfig('translate_fine_path')
+    targetPath = writeBackLang(folder_path)
+    window.show_info("提示", f"文件已经写回{targetPath}")
 
-    with open(translateWorkPath, "r", encoding="utf-8") as f:
-        translateMap = json.load(f)
 
-    for key, value in translateMap.items():
-        dValue = slib.String(value['target'])
-        exec('sourceTree' + key + ' = dValue')
+def writeBackLang(folder_path):
+    """把工作翻译和精细翻译写回整合包的中文语言文件，返回写入的文件或目录路径
 
-    with open(translateFinePath, "r", encoding="utf-8") as f:
-        translateMap = json.load(f)
+    只重新生成英文原文或译文有变化的文件，生成结果和现有文件相同时不写入
+    """
+    sourcePath, split = resolveLangPath(folder_path, getQuestConfig('ftb_lang_source_path'))
+    targetPath, _ = resolveLangPath(folder_path, getQuestConfig('ftb_lang_target_path'))
+    if split and targetPath.endswith(".snbt"):
+        targetPath = targetPath[:-len(".snbt")]
 
-    for key, value in translateMap.items():
-        dValue = slib.String(value)
-        exec('sourceTree' + key + ' = dValue')
+    # 精细翻译覆盖工作翻译，按所在文件分组
+    staging = quest_staging.open_quest_staging()
+    try:
+        translations = {key: value['target'] for key, value in staging.load_work().items()
+                        if len(value['target']) > 0}
+        translations.update(staging.load_fine())
+    finally:
+        staging.close()
+
+    fileTranslations = {relPath: [] for relPath in (listLangFiles(sourcePath) if split else [""])}
+    for key, value in translations.items():
+        path = parseLangKey(key)
+        if split:
+            if path and path[0] in fileTranslations:
+                fileTranslations[path[0]].append((key, path[1:], value))
+        else:
+            fileTranslations[""].append((key, path, value))
+
+    # 上次写回时每个目标文件的输入摘要和输出摘要，两者都没变时不需要重新解析
+    writebackStatePath = getWritebackStatePath()
+    writebackState = loadJsonOrEmpty(writebackStatePath)
+    writtenFiles = 0
+    writtenEnusMap = {}
+    writtenKeys = []
+
+    for relPath, entries in fileTranslations.items():
+        sourceFile = os.path.join(sourcePath, relPath) if split else sourcePath
+        targetFile = os.path.join(targetPath, relPath) if split else targetPath
+        with open(sourceFile, "rb") as f:
+            sourceBytes = f.read()
+        inputDigest = hashlib.blake2b(sourceBytes, digest_size=16)
+        inputDigest.update(json.dumps(sorted((key, value) for key, _, value in entries),
+                                      ensure_ascii=False).encode('utf-8'))
+        inputDigest = inputDigest.hexdigest()
+
+        existingText = readTextOrNone(targetFile)
+        existingDigest = sourceHash(existingText) if existingText is not None else None
+        state = writebackState.get(targetFile)
+        if state and state['input'] == inputDigest and state['output'] == existingDigest:
+            continue
 
-    targetPathConf = conf.getDefaultConfig('ftb_lang_target_path')
-    targetPath = f"{folder_path}/{targetPathConf}"
-    slib.dump(sourceTree, open(targetPath, "w", encoding="utf-8"))
-    window.show_info("提示", f"文件已经写回{targetPath}")
+        sourceTree = slib.loads(sourceBytes.decode('utf-8-sig'))
+        enusMap = extractLangMapFromLangTree(sourceTree)
+        if split:
+            enusMap = {f"['{relPath}']" + key: value for key, value in enusMap.items()}
+        writtenEnusMap.update(enusMap)
+        for key, path, value in entries:
+            if setLangValue(sourceTree, path, value):
+                writtenKeys.append(key)
+
+        text = slib.dumps(sourceTree)
+        if text != existingText:
+            writeTextAtomic(targetFile, text)
+            writtenFiles += 1
+        writebackState[targetFile] = {'input': inputDigest, 'output': sourceHash(text)}
+
+    saveSourceHashes(writtenEnusMap, writtenKeys)
+    os.makedirs(os.path.dirname(writebackStatePath) or ".", exist_ok=True)
+    with open(writebackStatePath, "w", encoding="utf-8") as f:
+        json.dump(writebackState, f, ensure_ascii=False, indent=4)
+    print(f"写回完成，共 {len(fileTranslations)} 个语言文件，更新了 {writtenFiles} 个")
+    return targetPath
 
 
 if __name__ == "__main__":
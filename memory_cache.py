@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from metrics import metrics
+
+
+class LRUCache:
+    """进程内的LRU缓存，线程安全，容量为0时不缓存
+
+    命中、未命中和淘汰次数同时累加到 metrics 中以 name 为前缀的计数器
+    """
+
+    def __init__(self, capacity: int, name: str = 'lru'):
+        self.capacity = capacity
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable, default: Any = None, negative: Any = None) -> Any:
+        """查找并把该项移到最近使用的位置，不存在时返回default
+
+        negative为表示"已知不存在"的哨兵值，查到它时照常返回，但计为未命中
+        """
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                metrics.count(f'{self.name}.miss')
+                return default
+            self._items.move_to_end(key)
+            hit = negative is None or value is not negative
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.count(f'{self.name}.hit' if hit else f'{self.name}.miss')
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        """写入或更新一项，超出容量时淘汰最久未使用的项"""
+        if self.capacity <= 0:
+            return
+        evicted = 0
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        if evicted:
+            metrics.count(f'{self.name}.evicted', evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict[str, int]:
+        """当前条数和累计的命中、未命中、淘汰次数"""
+        with self._lock:
+            return {'size': len(self._items), 'capacity': self.capacity,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
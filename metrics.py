@@ -0,0 +1,208 @@
+import datetime
+import html
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator, TypeVar
+
+T = TypeVar('T')
+
+# 每个直方图最多保留的样本数，超过后随机替换（水塘抽样）
+_MAX_SAMPLES = 2000
+
+
+class Histogram:
+    """记录数值分布：次数、总和、最值，以及用于计算分位数的样本"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.samples = []
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self.samples) < _MAX_SAMPLES:
+            self.samples.append(value)
+        else:
+            index = random.randrange(self.count)
+            if index < _MAX_SAMPLES:
+                self.samples[index] = value
+
+    def percentile(self, p: float) -> float | None:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    def summary(self) -> dict:
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+
+class Metrics:
+    """进程内的计时器、计数器和直方图，线程安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.counters: dict[str, float] = {}
+        self.timers: dict[str, Histogram] = {}
+        self.histograms: dict[str, Histogram] = {}
+
+    def count(self, name: str, value: float = 1):
+        """累加计数器"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        """记录一个数值（如批次大小）"""
+        with self._lock:
+            self.histograms.setdefault(name, Histogram()).add(value)
+
+    def record_time(self, name: str, seconds: float):
+        """记录一次耗时（秒）"""
+        with self._lock:
+            self.timers.setdefault(name, Histogram()).add(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        """统计with块的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_time(name, time.perf_counter() - start)
+
+    def timed_iter(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        """统计迭代器自身产生元素所花的时间（不含调用方处理元素的时间），结束时记录一次"""
+        iterator = iter(iterable)
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    elapsed += time.perf_counter() - start
+                    return
+                elapsed += time.perf_counter() - start
+                yield item
+        finally:
+            self.record_time(name, elapsed)
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.counters.clear()
+            self.timers.clear()
+            self.histograms.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'started_at': datetime.datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+                'elapsed': time.time() - self.started_at,
+                'counters': dict(sorted(self.counters.items())),
+                'timers': {name: h.summary() for name, h in sorted(self.timers.items())},
+                'histograms': {name: h.summary() for name, h in sorted(self.histograms.items())},
+            }
+
+    def write_report(self, name: str, log_dir: Path = Path('logs')) -> tuple[Path, Path]:
+        """把统计结果写成JSON和HTML报告，返回两个文件的路径"""
+        log_dir.mkdir(parents=True, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        json_path = log_dir / f'run_report_{name}_{timestamp}.json'
+        html_path = json_path.with_suffix('.html')
+
+        report = {'name': name, **self.snapshot()}
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        with open(html_path, 'w', encoding='utf-8') as f:
+            f.write(_render_html(report))
+        return json_path, html_path
+
+
+def _format(value) -> str:
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return f'{value:.4f}' if abs(value) < 100 else f'{value:.1f}'
+    return str(value)
+
+
+def _render_html(report: dict) -> str:
+    """生成不依赖外部资源的HTML报告，计时器按总耗时排序并画出占比条"""
+    elapsed = report['elapsed'] or 1
+    rows = []
+    for name, t in sorted(report['timers'].items(), key=lambda item: -item[1]['total']):
+        share = min(100.0, t['total'] / elapsed * 100)
+        rows.append(
+            f"<tr><td>{html.escape(name)}</td>"
+            + ''.join(f"<td>{_format(t[k])}</td>" for k in ('count', 'total', 'mean', 'p50', 'p90', 'p99', 'max'))
+            + f"<td><div class='bar' style='width:{share:.1f}%'></div>{share:.1f}%</td></tr>")
+    timer_rows = '\n'.join(rows)
+
+    histogram_rows = '\n'.join(
+        f"<tr><td>{html.escape(name)}</td>"
+        + ''.join(f"<td>{_format(h[k])}</td>" for k in ('count', 'mean', 'min', 'p50', 'p90', 'p99', 'max'))
+        + "</tr>"
+        for name, h in report['histograms'].items())
+
+    counter_rows = '\n'.join(
+        f"<tr><td>{html.escape(name)}</td><td>{_format(value)}</td></tr>"
+        for name, value in report['counters'].items())
+
+    return f"""<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="utf-8">
+<title>运行报告 {html.escape(report['name'])}</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; margin-bottom: 2em; }}
+th, td {{ border: 1px solid #ccc; padding: 4px 8px; text-align: right; }}
+td:first-child, th:first-child {{ text-align: left; }}
+.bar {{ display: inline-block; height: 0.8em; background: #4a90d9; margin-right: 4px; }}
+</style>
+</head>
+<body>
+<h1>运行报告：{html.escape(report['name'])}</h1>
+<p>开始时间 {report['started_at']}，总耗时 {report['elapsed']:.2f} 秒</p>
+<h2>计时（秒）</h2>
+<table>
+<tr><th>名称</th><th>次数</th><th>总计</th><th>平均</th><th>p50</th><th>p90</th><th>p99</th><th>最大</th><th>占总耗时</th></tr>
+{timer_rows}
+</table>
+<h2>分布</h2>
+<table>
+<tr><th>名称</th><th>次数</th><th>平均</th><th>最小</th><th>p50</th><th>p90</th><th>p99</th><th>最大</th></tr>
+{histogram_rows}
+</table>
+<h2>计数</h2>
+<table>
+<tr><th>名称</th><th>值</th></tr>
+{counter_rows}
+</table>
+</body>
+</html>
+"""
+
+
+# 全局实例，各模块共用
+metrics = Metrics()
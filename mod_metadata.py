@@ -0,0 +1,103 @@
+import hashlib
+import json
+import re
+import tomllib
+from typing import Iterable
+
+from zip_index import JarIndex, ZipEntry
+
+# Forge/NeoForge的mod描述文件
+_TOML_FILES = ('META-INF/mods.toml', 'META-INF/neoforge.mods.toml')
+_MANIFEST = 'META-INF/MANIFEST.MF'
+_FABRIC_FILE = 'fabric.mod.json'
+_QUILT_FILE = 'quilt.mod.json'
+# mods.toml无法按TOML解析时，用正则提取 modId 和 version
+_TOML_MOD_PATTERN = re.compile(r'modId\s*=\s*"([^"]+)"(?:(?!\[\[mods\]\]).)*?version\s*=\s*"([^"]+)"', re.S)
+
+
+def _read_text(jar: JarIndex, entries: dict[str, ZipEntry], name: str) -> str | None:
+    entry = entries.get(name)
+    if entry is None:
+        return None
+    return jar.read(entry).decode('utf-8-sig', errors='replace')
+
+
+def _manifest_version(text: str | None) -> str | None:
+    if not text:
+        return None
+    for line in text.splitlines():
+        name, _, value = line.partition(':')
+        if name.strip() == 'Implementation-Version' and value.strip():
+            return value.strip()
+    return None
+
+
+def _toml_versions(text: str) -> dict[str, str]:
+    """mods.toml中每个modId对应的version"""
+    try:
+        mods = tomllib.loads(text).get('mods', [])
+        return {str(mod['modId']): str(mod['version']) for mod in mods
+                if isinstance(mod, dict) and 'modId' in mod and 'version' in mod}
+    except (tomllib.TOMLDecodeError, TypeError):
+        return dict(_TOML_MOD_PATTERN.findall(text))
+
+
+def _json_versions(text: str | None, quilt: bool) -> dict[str, str]:
+    """fabric.mod.json或quilt.mod.json中的id和version"""
+    if not text:
+        return {}
+    try:
+        data = json.loads(text)
+        if quilt:
+            data = data.get('quilt_loader', {})
+        if isinstance(data.get('id'), str) and isinstance(data.get('version'), str):
+            return {data['id']: data['version']}
+    except (json.JSONDecodeError, AttributeError):
+        pass
+    return {}
+
+
+def declared_versions(jar: JarIndex) -> dict[str, str]:
+    """读取jar中声明的 modid -> 版本号，支持Forge/NeoForge、Fabric和Quilt"""
+    names = (*_TOML_FILES, _MANIFEST, _FABRIC_FILE, _QUILT_FILE)
+    entries = {entry.name: entry for prefix in (b'META-INF/', b'fabric.mod.json', b'quilt.mod.json')
+               for entry in jar.iter_entries(prefix) if entry.name in names}
+
+    versions = {}
+    manifest_version = None
+    for name in _TOML_FILES:
+        text = _read_text(jar, entries, name)
+        if text:
+            for modid, version in _toml_versions(text).items():
+                # ${file.jarVersion} 由构建时写入的MANIFEST提供
+                if '${' in version:
+                    manifest_version = manifest_version or _manifest_version(_read_text(jar, entries, _MANIFEST))
+                    if not manifest_version:
+                        continue
+                    version = manifest_version
+                versions.setdefault(modid, version)
+    versions.update(_json_versions(_read_text(jar, entries, _FABRIC_FILE), quilt=False))
+    versions.update(_json_versions(_read_text(jar, entries, _QUILT_FILE), quilt=True))
+    if not versions:
+        version = _manifest_version(_read_text(jar, entries, _MANIFEST))
+        if version:
+            versions[''] = version
+    return versions
+
+
+def lang_fingerprint(entries: Iterable[ZipEntry]) -> str:
+    """根据中央目录中语言文件的文件名、CRC和大小计算指纹，不需要解压"""
+    digest = hashlib.blake2b(digest_size=6)
+    for entry in sorted(entries):
+        digest.update(f"{entry.name}:{entry.crc:08x}:{entry.file_size};".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def mod_version(versions: dict[str, str], modid: str, lang_entries: Iterable[ZipEntry]) -> str:
+    """共享词条库使用的版本标识："声明的版本号#语言文件指纹"
+
+    语言文件所在的命名空间与modId不同时使用jar中第一个声明的版本号，都没有时只用指纹。
+    附带指纹可以避免不同构建使用相同版本号（如SNAPSHOT）时误用旧词条。
+    """
+    version = versions.get(modid) or next(iter(versions.values()), '')
+    return f"{version}#{lang_fingerprint(lang_entries)}"
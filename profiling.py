@@ -0,0 +1,191 @@
+"""命令行入口的性能分析和SQL跟踪
+
+cli.py的各个子命令都可以加上：
+    --profile              用cProfile运行，同时采样调用栈，结果写入logs/
+    --profile-interval 秒  调用栈采样间隔，默认0.005
+    --trace-sql            统计Database执行的每种SQL语句的次数和耗时，结果写入logs/
+"""
+import argparse
+import cProfile
+import datetime
+import io
+import pstats
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable
+
+from database import ConnectionManager
+
+LOG_DIR = Path('logs')
+
+
+def _log_path(kind: str, name: str, suffix: str) -> Path:
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    return LOG_DIR / f'{kind}_{name}_{timestamp}{suffix}'
+
+
+class StackSampler:
+    """后台线程定时采样所有线程的调用栈，输出火焰图使用的折叠栈格式
+
+    每行为"线程;外层函数;...;内层函数 次数"，可直接交给flamegraph.pl或speedscope
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: Path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def profile_call(name: str, func: Callable[[], Any], interval: float = 0.005) -> Any:
+    """用cProfile和调用栈采样运行func，把pstats和折叠栈写入logs/"""
+    profiler = cProfile.Profile()
+    sampler = StackSampler(interval)
+    sampler.start()
+    profiler.enable()
+    try:
+        return func()
+    finally:
+        profiler.disable()
+        sampler.stop()
+
+        stats_path = _log_path('profile', name, '.pstats')
+        profiler.dump_stats(stats_path)
+        folded_path = stats_path.with_suffix('.folded')
+        sampler.write(folded_path)
+
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(20)
+        print(output.getvalue())
+        print(f"性能分析结果已保存到 {stats_path}")
+        print(f"火焰图折叠栈已保存到 {folded_path}（{sum(sampler.stacks.values())} 个采样）")
+
+
+class SqlTrace:
+    """按语句汇总执行次数、耗时和影响行数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 语句 -> [次数, 总耗时, 最长耗时, 行数]
+        self.statements: dict[str, list] = {}
+
+    def record(self, sql: str, seconds: float, rows: int):
+        sql = re.sub(r'\s+', ' ', sql).strip()
+        with self._lock:
+            entry = self.statements.setdefault(sql, [0, 0.0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            entry[3] += max(rows, 0)
+
+    def write_report(self, name: str) -> Path:
+        """按总耗时排序写入报告"""
+        path = _log_path('sql_trace', name, '.txt')
+        with self._lock:
+            ordered = sorted(self.statements.items(), key=lambda item: -item[1][1])
+        total = sum(entry[1] for _, entry in ordered)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"共 {len(ordered)} 种语句，执行 {sum(e[0] for _, e in ordered)} 次，耗时 {total:.3f} 秒\n")
+            f.write("（SELECT的耗时只包括执行到第一行，不包括之后的fetch）\n\n")
+            f.write(f"{'次数':>10}{'总耗时':>12}{'平均(ms)':>12}{'最长(ms)':>12}{'行数':>12}  语句\n")
+            for sql, (count, seconds, longest, rows) in ordered:
+                f.write(f"{count:>10}{seconds:>12.3f}{seconds / count * 1000:>12.3f}"
+                        f"{longest * 1000:>12.3f}{rows:>12}  {sql}\n")
+        return path
+
+
+# 当前生效的SQL跟踪
+sql_trace: SqlTrace | None = None
+
+
+class TracingCursor(sqlite3.Cursor):
+    """记录execute/executemany耗时的游标"""
+
+    def execute(self, sql, parameters=(), /):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            if sql_trace:
+                sql_trace.record(sql, time.perf_counter() - start, self.rowcount)
+
+    def executemany(self, sql, seq_of_parameters, /):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            if sql_trace:
+                sql_trace.record(sql, time.perf_counter() - start, self.rowcount)
+
+
+class TracingConnection(sqlite3.Connection):
+    """游标默认使用TracingCursor，conn.execute等快捷方法也改为经由TracingCursor执行"""
+
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=(), /):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters, /):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def enable_sql_trace() -> SqlTrace:
+    """开启SQL跟踪，只对之后新建的数据库连接生效"""
+    global sql_trace
+    sql_trace = SqlTrace()
+    ConnectionManager.connection_factory = TracingConnection
+    return sql_trace
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """添加 --profile、--profile-interval 和 --trace-sql 参数"""
+    parser.add_argument('--profile', action='store_true', help="用cProfile运行并采样调用栈，结果写入logs/")
+    parser.add_argument('--profile-interval', type=float, default=0.005, help="调用栈采样间隔（秒）")
+    parser.add_argument('--trace-sql', action='store_true', help="统计SQL语句的次数和耗时，结果写入logs/")
+
+
+def run_profiled(name: str, func: Callable[[], Any], args: argparse.Namespace) -> Any:
+    """按add_arguments添加的参数决定是否开启性能分析和SQL跟踪后运行func"""
+    trace = enable_sql_trace() if args.trace_sql else None
+    try:
+        if args.profile:
+            return profile_call(name, func, args.profile_interval)
+        return func()
+    finally:
+        if trace:
+            print(f"SQL跟踪结果已保存到 {trace.write_report(name)}")
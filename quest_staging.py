@@ -0,0 +1,121 @@
+"""任务书翻译的暂存：工作翻译 {路径键: {'origin', 'ref', 'target'}} 和精细翻译 {路径键: 译文}
+
+[QUEST] staging_backend 选择保存方式：
+    json   - 两个带缩进的JSON文件（translate_work_path、translate_fine_path），可以直接手动编辑
+    sqlite - 主数据库中的quest_work和quest_fine表，按键随机访问，LLM翻译后只更新有变化的条目；
+             需要手动编辑时用 cli.py quest export 导出为JSON，改完后用 cli.py quest import 导回
+"""
+import json
+import os
+from typing import Dict
+
+import config as conf
+from database import Database
+
+STAGING_BACKENDS = ('json', 'sqlite')
+
+
+def _load_json(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _dump_json(path: str, data: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+
+
+class JsonQuestStaging:
+    """工作翻译和精细翻译分别保存为JSON文件"""
+
+    def __init__(self, work_path: str, fine_path: str):
+        self.work_path = work_path
+        self.fine_path = fine_path
+        self.location = work_path
+
+    def load_work(self) -> Dict[str, dict]:
+        return _load_json(self.work_path)
+
+    def load_fine(self) -> Dict[str, str]:
+        return _load_json(self.fine_path)
+
+    def save_work(self, work: Dict[str, dict]):
+        _dump_json(self.work_path, work)
+
+    def save_fine(self, fine: Dict[str, str]):
+        _dump_json(self.fine_path, fine)
+
+    def update_targets(self, targets: Dict[str, str]) -> int:
+        """更新指定条目的译文，JSON文件只能整体重写"""
+        work = self.load_work()
+        updated = 0
+        for key, target in targets.items():
+            if key in work:
+                work[key]['target'] = target
+                updated += 1
+        self.save_work(work)
+        return updated
+
+    def close(self):
+        pass
+
+
+class SqliteQuestStaging:
+    """工作翻译和精细翻译保存在数据库中"""
+
+    def __init__(self, db: Database, owns_db: bool = False):
+        self.db = db
+        self.owns_db = owns_db
+        self.location = f"{db.db_path} (quest_work)"
+
+    def load_work(self) -> Dict[str, dict]:
+        return {key: {'origin': origin, 'ref': ref, 'target': target}
+                for key, origin, ref, target in self.db.iter_quest_work()}
+
+    def load_fine(self) -> Dict[str, str]:
+        return dict(self.db.iter_quest_fine())
+
+    def save_work(self, work: Dict[str, dict]):
+        self.db.replace_quest_work((key, value['origin'], value['ref'], value['target'])
+                                   for key, value in work.items())
+
+    def save_fine(self, fine: Dict[str, str]):
+        self.db.replace_quest_fine(fine.items())
+
+    def update_targets(self, targets: Dict[str, str]) -> int:
+        return self.db.update_quest_targets(targets.items())
+
+    def close(self):
+        if self.owns_db:
+            self.db.close()
+
+
+def json_staging() -> JsonQuestStaging:
+    """配置中translate_work_path和translate_fine_path对应的JSON暂存"""
+    return JsonQuestStaging(conf.getConfig('QUEST', 'translate_work_path'),
+                            conf.getConfig('QUEST', 'translate_fine_path'))
+
+
+def open_quest_staging(db: Database | None = None) -> JsonQuestStaging | SqliteQuestStaging:
+    """按[QUEST] staging_backend打开暂存，sqlite且未传入db时自行打开数据库，close()时关闭"""
+    backend = conf.getConfig('QUEST', 'staging_backend', 'json')
+    if backend not in STAGING_BACKENDS:
+        raise ValueError(f"无效的staging_backend: {backend}，可选 {', '.join(STAGING_BACKENDS)}")
+    if backend == 'json':
+        return json_staging()
+    if db is None:
+        return SqliteQuestStaging(Database(), owns_db=True)
+    return SqliteQuestStaging(db)
+
+
+def copy_staging(source, target):
+    """把工作翻译和精细翻译从一个暂存复制到另一个，返回(工作条目数, 精细条目数)"""
+    work = source.load_work()
+    fine = source.load_fine()
+    target.save_work(work)
+    target.save_fine(fine)
+    return len(work), len(fine)
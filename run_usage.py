@@ -0,0 +1,5 @@
+import sys
+from cli import main
+
+if __name__ == "__main__":
+    main(['usage', *sys.argv[1:]])
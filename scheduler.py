@@ -0,0 +1,215 @@
+"""进程内共享的LLM请求调度
+
+模组翻译（LLMClient，asyncio）和任务书翻译（OpenAI SDK，同步）访问同一个接口，
+所有请求都先在这里排队：按优先级依次放行，受每分钟请求数、每分钟token数和并发数限制。
+额度按最近60秒的滑动窗口计算，和服务端的统计方式一致，开头的突发请求用完额度后不会紧接着触发429。
+收到429时整个调度器暂停Retry-After秒，避免所有请求同时重试。
+"""
+import asyncio
+import collections
+import heapq
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator
+
+from config import getConfig
+from metrics import metrics
+
+# 优先级，数值越小越先放行：任务书文本排在大量模组词条之前
+PRIORITY_QUEST = 0
+PRIORITY_MOD = 1
+_PRIORITY_NAMES = {PRIORITY_QUEST: 'quest', PRIORITY_MOD: 'mod'}
+
+# 等待其他请求时的轮询间隔（秒），异步等待者不会被唤醒，只能轮询
+_POLL_INTERVAL = 0.05
+# 速率限制的统计窗口（秒）
+_WINDOW_SECONDS = 60.0
+
+
+class RateWindow:
+    """最近60秒内最多limit个单位的滑动窗口，limit为0时不限制"""
+
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.used = 0.0
+        # [时间, 数量]，数量在请求完成后按实际用量修正
+        self._entries: collections.deque[list] = collections.deque()
+
+    def expire(self, now: float):
+        while self._entries and now - self._entries[0][0] >= _WINDOW_SECONDS:
+            self.used -= self._entries.popleft()[1]
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """还需要等待多少秒，窗口中才有amount的余量"""
+        if not self.limit:
+            return 0.0
+        excess = self.used + amount - self.limit
+        for timestamp, entry_amount in self._entries:
+            if excess <= 0:
+                break
+            excess -= entry_amount
+            if excess <= 0:
+                return timestamp + _WINDOW_SECONDS - now
+        return 0.0 if excess <= 0 else _WINDOW_SECONDS
+
+    def record(self, amount: float, now: float) -> list | None:
+        if not self.limit:
+            return None
+        entry = [now, amount]
+        self._entries.append(entry)
+        self.used += amount
+        return entry
+
+    def adjust(self, entry: list | None, amount: float):
+        """把已记录的数量改为amount，条目已过期时忽略"""
+        if entry is not None and entry[1] != amount and self._entries and entry[0] >= self._entries[0][0]:
+            self.used += amount - entry[1]
+            entry[1] = amount
+
+
+class RequestGrant:
+    """一次放行的请求，请求完成后把实际用量写入used_tokens，用于校正预留的token"""
+
+    def __init__(self, reserved_tokens: int, window_entry: list | None):
+        self.reserved_tokens = reserved_tokens
+        self.used_tokens: int | None = None
+        self.window_entry = window_entry
+
+
+class RequestScheduler:
+    def __init__(self, rpm: float = 0, tpm: float = 0, max_concurrency: int = 0):
+        self.max_concurrency = max_concurrency
+        self._requests = RateWindow(rpm)
+        self._tokens = RateWindow(tpm)
+        self._active = 0
+        self._paused_until = 0.0
+        self._waiting: list[tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+
+    @classmethod
+    def from_config(cls, section: str = 'LLM') -> 'RequestScheduler':
+        """按配置节中的rpm、tpm和parallel_requests创建，未设置parallel_requests时使用[LLM]中的值"""
+        return cls(float(getConfig(section, 'rpm', '0')),
+                   float(getConfig(section, 'tpm', '0')),
+                   int(getConfig(section, 'parallel_requests', getConfig('LLM', 'parallel_requests', '0'))))
+
+    def has_capacity(self) -> bool:
+        """当前没有暂停且并发未满"""
+        with self._lock:
+            return (time.monotonic() >= self._paused_until
+                    and not (self.max_concurrency and self._active >= self.max_concurrency))
+
+    def _try_acquire(self, entry: tuple[int, int], tokens: int) -> RequestGrant | float:
+        """持有锁时调用：轮到entry且额度足够时占用额度并返回RequestGrant，否则返回建议等待的秒数"""
+        if self._waiting[0] != entry:
+            return _POLL_INTERVAL
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.max_concurrency and self._active >= self.max_concurrency:
+            return _POLL_INTERVAL
+        self._requests.expire(now)
+        self._tokens.expire(now)
+        # 单个请求超过每分钟token数时按窗口的上限计算，否则永远无法放行
+        tokens = min(tokens, self._tokens.limit) if self._tokens.limit else tokens
+        wait = max(self._requests.wait_time(1, now), self._tokens.wait_time(tokens, now))
+        if wait > 0:
+            return wait
+        self._requests.record(1, now)
+        grant = RequestGrant(tokens, self._tokens.record(tokens, now))
+        self._active += 1
+        heapq.heappop(self._waiting)
+        self._released.notify_all()
+        return grant
+
+    def _enqueue(self, priority: int) -> tuple[int, int]:
+        entry = (priority, next(self._sequence))
+        heapq.heappush(self._waiting, entry)
+        return entry
+
+    def _release(self, grant: RequestGrant):
+        with self._lock:
+            self._active -= 1
+            if grant.used_tokens is not None:
+                # 预留多了退回，少了补扣
+                self._tokens.adjust(grant.window_entry, grant.used_tokens)
+            self._released.notify_all()
+
+    def _cancel(self, entry: tuple[int, int]):
+        with self._lock:
+            self._waiting.remove(entry)
+            heapq.heapify(self._waiting)
+            self._released.notify_all()
+
+    @contextmanager
+    def request(self, tokens: int, priority: int = PRIORITY_MOD) -> Iterator[RequestGrant]:
+        """同步等待放行，tokens为预计消耗的token数（输入加输出）"""
+        started = time.perf_counter()
+        with self._lock:
+            entry = self._enqueue(priority)
+            try:
+                while not isinstance(grant := self._try_acquire(entry, tokens), RequestGrant):
+                    self._released.wait(grant)
+            except BaseException:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                raise
+        metrics.record_time(f'scheduler.wait_{_PRIORITY_NAMES.get(priority, priority)}',
+                            time.perf_counter() - started)
+        try:
+            yield grant
+        finally:
+            self._release(grant)
+
+    @asynccontextmanager
+    async def request_async(self, tokens: int, priority: int = PRIORITY_MOD) -> AsyncIterator[RequestGrant]:
+        """异步等待放行，不占用事件循环的线程"""
+        started = time.perf_counter()
+        with self._lock:
+            entry = self._enqueue(priority)
+        try:
+            while True:
+                with self._lock:
+                    grant = self._try_acquire(entry, tokens)
+                if isinstance(grant, RequestGrant):
+                    break
+                await asyncio.sleep(min(grant, 1.0))
+        except BaseException:
+            self._cancel(entry)
+            raise
+        metrics.record_time(f'scheduler.wait_{_PRIORITY_NAMES.get(priority, priority)}',
+                            time.perf_counter() - started)
+        try:
+            yield grant
+        finally:
+            self._release(grant)
+
+    def pause(self, seconds: float):
+        """收到429后暂停放行，已在途的请求不受影响"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        metrics.count('scheduler.pauses')
+
+
+_schedulers: dict[str, RequestScheduler] = {}
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(section: str = 'LLM') -> RequestScheduler:
+    """进程内共享的调度器，每个接口（配置节）一个，第一次使用时按配置创建"""
+    with _scheduler_lock:
+        if section not in _schedulers:
+            _schedulers[section] = RequestScheduler.from_config(section)
+        return _schedulers[section]
+
+
+def parse_retry_after(value: str | None, default: float = 1.0) -> float:
+    """解析Retry-After响应头（秒数），无法解析时返回default"""
+    try:
+        return max(0.0, float(value)) if value is not None else default
+    except ValueError:
+        return default
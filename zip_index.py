@@ -0,0 +1,168 @@
+import mmap
+import struct
+import zipfile
+import zlib
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+# 中央目录结束记录
+_EOCD_SIGNATURE = b'PK\x05\x06'
+_EOCD_STRUCT = struct.Struct('<4s4H2LH')
+# zip64中央目录结束记录及其定位器
+_ZIP64_LOCATOR_SIGNATURE = b'PK\x06\x07'
+_ZIP64_LOCATOR_STRUCT = struct.Struct('<4sLQL')
+_ZIP64_EOCD_SIGNATURE = b'PK\x06\x06'
+_ZIP64_EOCD_STRUCT = struct.Struct('<4sQ2H2L4Q')
+# 中央目录文件头
+_CENTRAL_SIGNATURE = b'PK\x01\x02'
+_CENTRAL_STRUCT = struct.Struct('<4s6H3L5H2L')
+_CENTRAL_LENGTHS = struct.Struct('<3H')  # 文件名、扩展字段、注释长度，位于文件头偏移28处
+# 本地文件头
+_LOCAL_SIGNATURE = b'PK\x03\x04'
+_LOCAL_STRUCT = struct.Struct('<4s5H3L2H')
+
+_MAX_COMMENT = 0xFFFF
+_ZIP64_LIMIT = 0xFFFFFFFF
+
+
+class ZipEntry(NamedTuple):
+    name: str
+    flags: int
+    method: int
+    crc: int
+    compress_size: int
+    file_size: int
+    header_offset: int
+
+
+class JarIndex:
+    """基于mmap直接读取zip中央目录
+
+    按文件名前缀查找条目时只解析匹配条目的文件头，不为每个文件创建ZipInfo，
+    适合在包含大量class文件的jar中快速定位少量语言文件。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法映射
+            self._file.close()
+            raise zipfile.BadZipFile("File is empty")
+        try:
+            self._locate_central_directory()
+        except (struct.error, zipfile.BadZipFile):
+            self.close()
+            raise
+
+    def _locate_central_directory(self):
+        """定位中央目录的起止位置"""
+        mm = self._mm
+        eocd = mm.rfind(_EOCD_SIGNATURE, max(0, len(mm) - _EOCD_STRUCT.size - _MAX_COMMENT))
+        if eocd < 0:
+            raise zipfile.BadZipFile("File is not a zip file")
+        _, _, _, _, count, cd_size, cd_offset, _ = _EOCD_STRUCT.unpack_from(mm, eocd)
+        cd_end = eocd
+
+        locator = eocd - _ZIP64_LOCATOR_STRUCT.size
+        if locator >= 0 and mm[locator:locator + 4] == _ZIP64_LOCATOR_SIGNATURE:
+            _, _, zip64_offset, _ = _ZIP64_LOCATOR_STRUCT.unpack_from(mm, locator)
+            # 定位器记录的偏移不含前置数据，直接取定位器之前的记录
+            zip64_eocd = locator - _ZIP64_EOCD_STRUCT.size
+            if mm[zip64_eocd:zip64_eocd + 4] != _ZIP64_EOCD_SIGNATURE:
+                raise zipfile.BadZipFile("Corrupt zip64 end of central directory")
+            fields = _ZIP64_EOCD_STRUCT.unpack_from(mm, zip64_eocd)
+            count, cd_size, cd_offset = fields[7], fields[8], fields[9]
+            cd_end = zip64_eocd
+
+        # 文件前可能拼接了其他数据（如自解压程序），所有偏移都要加上这段长度
+        self._concat = cd_end - cd_size - cd_offset
+        if self._concat < 0:
+            raise zipfile.BadZipFile("Bad offset for central directory")
+        self._cd_start = cd_offset + self._concat
+        self._cd_end = self._cd_start + cd_size
+        self.count = count
+
+    def iter_entries(self, prefix: bytes = b'') -> Iterator[ZipEntry]:
+        """遍历文件名以prefix开头的条目"""
+        mm = self._mm
+        pos = self._cd_start
+        header_size = _CENTRAL_STRUCT.size
+        while pos + header_size <= self._cd_end:
+            if mm[pos:pos + 4] != _CENTRAL_SIGNATURE:
+                raise zipfile.BadZipFile("Bad magic number for central directory")
+            name_len, extra_len, comment_len = _CENTRAL_LENGTHS.unpack_from(mm, pos + 28)
+            name_start = pos + header_size
+            if not prefix or mm.find(prefix, name_start, name_start + name_len) == name_start:
+                yield self._read_entry(pos, name_start, name_len, extra_len)
+            pos = name_start + name_len + extra_len + comment_len
+
+    def _read_entry(self, pos: int, name_start: int, name_len: int, extra_len: int) -> ZipEntry:
+        """解析一个中央目录文件头"""
+        (_, _, _, flags, method, _, _, crc, compress_size, file_size,
+         _, _, _, _, _, _, header_offset) = _CENTRAL_STRUCT.unpack_from(self._mm, pos)
+        raw_name = self._mm[name_start:name_start + name_len]
+        # 与zipfile一致：设置了UTF-8标志位时按UTF-8解码，否则按cp437
+        name = raw_name.decode('utf-8' if flags & 0x800 else 'cp437')
+
+        if _ZIP64_LIMIT in (compress_size, file_size, header_offset):
+            extra = self._mm[name_start + name_len:name_start + name_len + extra_len]
+            file_size, compress_size, header_offset = self._parse_zip64_extra(
+                extra, file_size, compress_size, header_offset)
+
+        return ZipEntry(name, flags, method, crc, compress_size, file_size,
+                        header_offset + self._concat)
+
+    @staticmethod
+    def _parse_zip64_extra(extra: bytes, file_size: int, compress_size: int,
+                           header_offset: int) -> tuple[int, int, int]:
+        """从zip64扩展字段中读取被截断为0xFFFFFFFF的大小和偏移"""
+        pos = 0
+        while pos + 4 <= len(extra):
+            tag, size = struct.unpack_from('<2H', extra, pos)
+            if tag == 0x0001:
+                values = iter(struct.unpack_from(f'<{size // 8}Q', extra, pos + 4))
+                if file_size == _ZIP64_LIMIT:
+                    file_size = next(values)
+                if compress_size == _ZIP64_LIMIT:
+                    compress_size = next(values)
+                if header_offset == _ZIP64_LIMIT:
+                    header_offset = next(values)
+                break
+            pos += 4 + size
+        return file_size, compress_size, header_offset
+
+    def read(self, entry: ZipEntry) -> bytes:
+        """读取并解压一个条目
+
+        只直接处理未加密的存储和deflate条目，其他情况交给zipfile
+        """
+        if entry.flags & 0x1 or entry.method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            with zipfile.ZipFile(self.path, 'r') as zip_file:
+                return zip_file.read(entry.name)
+
+        mm = self._mm
+        pos = entry.header_offset
+        if mm[pos:pos + 4] != _LOCAL_SIGNATURE:
+            raise zipfile.BadZipFile(f"Bad magic number for file header: {entry.name}")
+        name_len, extra_len = _LOCAL_STRUCT.unpack_from(mm, pos)[9:]
+        data_start = pos + _LOCAL_STRUCT.size + name_len + extra_len
+        data = mm[data_start:data_start + entry.compress_size]
+
+        if entry.method == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS, entry.file_size or zlib.DEF_BUF_SIZE)
+        if zlib.crc32(data) != entry.crc:
+            raise zipfile.BadZipFile(f"Bad CRC-32 for file {entry.name}")
+        return data
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self) -> 'JarIndex':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()